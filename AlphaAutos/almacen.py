@@ -0,0 +1,70 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, storages
+
+# -------------------------------------------------------------------
+# Almacenamiento por contenido de Coche.imagen
+# -------------------------------------------------------------------
+# El FileSystemStorage de Django renombra al chocar ('3.jpg',
+# '3_JentJLk.jpg'...), así que cada subida de la misma foto era otra copia.
+# Aquí el nombre del fichero es el SHA-256 de su contenido:
+#
+#   coches/3f/3f2a...c9.jpg
+#
+# La subida se escribe en un temporal mientras se calcula el hash y luego
+# se mueve a su sitio; si ese contenido ya existía, el temporal se borra.
+# Cuántos coches usan cada fichero se lleva en ArchivoImagen (ver
+# imagenes.py), que es quien borra los que se quedan sin referencias. La
+# subida cuenta ya su referencia, antes de reutilizar un fichero que
+# exista, para que no se borre entre medias.
+#
+# Se configura como STORAGES['imagenes'] en settings.py.
+
+
+class AlmacenContenido(FileSystemStorage):
+
+    def _ruta_contenido(self, name, digest):
+        directorio = posixpath.dirname(name)
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(directorio, digest[:2], f"{digest}{extension}")
+
+    def get_available_name(self, name, max_length=None):
+        # Dos subidas con el mismo contenido deben acabar en el mismo nombre
+        return name
+
+    def _save(self, name, content):
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        descriptor, temporal = tempfile.mkstemp(dir=self.location, prefix='.subida-')
+        try:
+            with os.fdopen(descriptor, 'wb') as destino:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for trozo in content.chunks():
+                    digest.update(trozo)
+                    destino.write(trozo)
+
+            nombre = self._ruta_contenido(name, digest.hexdigest())
+            ruta = self.path(nombre)
+            # La referencia va antes de mirar si el fichero existe: si recolectar() lo
+            # está borrando, esto espera a que termine y entonces ya no existe
+            from .imagenes import sumar_referencia
+            sumar_referencia(nombre)
+            if os.path.exists(ruta):
+                return nombre
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            # mkstemp crea el fichero con 0o600
+            os.chmod(temporal, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+            # Atómico: nadie ve nunca un fichero a medio escribir
+            os.replace(temporal, ruta)
+            return nombre
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+
+
+def almacen_imagenes():
+    return storages['imagenes']
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class AlphaautosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'AlphaAutos'
+
+    def ready(self):
+        from . import bd, perfil_plantillas, sesiones, vigilancia_sql
+        from .signals import conectar_senales
+        conectar_senales()
+        # PRAGMA de SQLite en cada conexión (AlphaAutos/bd.py)
+        bd.instalar()
+        # Consultas lentas y N+1 (AlphaAutos/vigilancia_sql.py)
+        vigilancia_sql.instalar()
+        # Datos de sesión al hacer login y volcado de las visitas (AlphaAutos/sesiones.py)
+        sesiones.instalar()
+        # Perfil del render de plantillas, si ALPHAAUTOS_PERFIL_PLANTILLAS (AlphaAutos/perfil_plantillas.py)
+        perfil_plantillas.instalar()
@@ -0,0 +1,280 @@
+import logging
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import *
+from .replicas import en_primario
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Autocompletado con índices de prefijos en memoria
+# -------------------------------------------------------------------
+# Los formularios de búsqueda sugieren mientras se escribe (GET
+# /autocompletar/<tipo>/?q=cor). Cada pulsación no puede ir a la BD: cada
+# proceso guarda, por tipo, una lista ordenada con los textos ya
+# normalizados (minúsculas, sin tildes) y busca el prefijo con bisect.
+#
+#   - Cada texto entra una vez por palabra ("AlphaAutos Sevilla Centro"
+#     sale con "alp", con "sev" y con "cen"), como el índice de texto
+#     (buscador.py).
+#   - Los textos repetidos (muchos coches con el mismo modelo) son una
+#     sola entrada con el conjunto de sus ids.
+#   - Se cargan al arrancar el servidor (calentar(), desde mysite/wsgi.py
+#     y asgi.py) o, si no, con la primera consulta.
+#   - Las señales (signals.py) aplican los cambios de este proceso en
+#     cuanto se confirma la transacción. Lo que cambien otros procesos se
+#     ve al recargar el índice, cada ALPHAAUTOS_AUTOCOMPLETAR_S segundos
+#     (en un hilo: mientras tanto se sigue respondiendo con el anterior).
+
+# Máximo de sugerencias por consulta
+LIMITE_SUGERENCIAS = 50
+
+
+def normalizar(texto):
+    """Minúsculas, sin tildes y con los espacios de una en una."""
+    if texto.isascii():
+        # Casi todos: sin tildes que quitar
+        return ' '.join(texto.lower().split())
+    texto = unicodedata.normalize('NFKD', texto.casefold())
+    return ' '.join(''.join(c for c in texto if not unicodedata.combining(c)).split())
+
+
+def _claves(texto):
+    """Lo que queda desde el principio de cada palabra: 'a b c' -> 'a b c', 'b c', 'c'."""
+    palabras = normalizar(texto).split(' ')
+    return [' '.join(palabras[i:]) for i in range(len(palabras)) if palabras[i]]
+
+
+class IndicePrefijos:
+    """Textos de un campo, ordenados por sus claves normalizadas, con los ids que los tienen."""
+
+    def __init__(self, pares=()):
+        # {texto: {ids}} y {id: texto}
+        self._ids = {}
+        self._texto_de = {}
+        for pk, texto in pares:
+            if texto:
+                self._texto_de[pk] = texto
+                self._ids.setdefault(texto, set()).add(pk)
+        # [(clave, texto)] ordenada
+        self._claves = sorted((clave, texto) for texto in self._ids for clave in _claves(texto))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._texto_de)
+
+    def poner(self, pk, texto):
+        with self._lock:
+            if self._texto_de.get(pk) == texto:
+                return
+            self._quitar(pk)
+            if not texto:
+                return
+            self._texto_de[pk] = texto
+            ids = self._ids.setdefault(texto, set())
+            if not ids:
+                for clave in _claves(texto):
+                    insort(self._claves, (clave, texto))
+            ids.add(pk)
+
+    def quitar(self, pk):
+        with self._lock:
+            self._quitar(pk)
+
+    def _quitar(self, pk):
+        texto = self._texto_de.pop(pk, None)
+        if texto is None:
+            return
+        ids = self._ids[texto]
+        ids.discard(pk)
+        if not ids:
+            del self._ids[texto]
+            for clave in _claves(texto):
+                del self._claves[bisect_left(self._claves, (clave, texto))]
+
+    def buscar(self, prefijo, limite=10, con_ids=True):
+        """
+        [(texto, ids)] de los textos con alguna palabra que empieza por
+        `prefijo`; con `con_ids=False`, [(texto, cuántos ids)].
+        """
+        prefijo = normalizar(prefijo)
+        if not prefijo:
+            return []
+        resultado, vistos = [], set()
+        with self._lock:
+            claves = self._claves
+            # Por posición: un slice copiaría todo lo que queda de la lista
+            for i in range(bisect_left(claves, (prefijo,)), len(claves)):
+                clave, texto = claves[i]
+                if not clave.startswith(prefijo) or len(resultado) == limite:
+                    break
+                if texto not in vistos:
+                    vistos.add(texto)
+                    ids = self._ids[texto]
+                    resultado.append((texto, sorted(ids) if con_ids else len(ids)))
+        return resultado
+
+
+class Fuente:
+    """
+    De dónde sale un tipo de sugerencia: `campo` de `modelo` (puede pasar
+    por una FK, como buscador.Indice). `con_ids` dice si las sugerencias
+    llevan los ids o solo cuántos hay; `permiso`, si hace falta alguno
+    además de haber iniciado sesión.
+    """
+
+    def __init__(self, tipo, modelo, campo, con_ids=True, permiso=None):
+        self.tipo = tipo
+        self.modelo = modelo
+        self.campo = campo
+        self.con_ids = con_ids
+        self.permiso = permiso
+        self.indice = None
+        self.cargado = 0.0
+        # Cambios que llegan mientras se carga: se aplican también al índice nuevo
+        self._cambios = None
+        self._lock = threading.Lock()
+        self._cargando = threading.Lock()
+
+    def texto(self, objeto):
+        valor = objeto
+        for parte in self.campo.split('__'):
+            valor = getattr(valor, parte, None) if valor is not None else None
+        return '' if valor is None else str(valor)
+
+    def relacion(self):
+        """(modelo relacionado, fk, campo) si el texto sale de otro modelo."""
+        if '__' not in self.campo:
+            return None
+        fk, campo = self.campo.split('__', 1)
+        return self.modelo._meta.get_field(fk).related_model, fk, campo
+
+    def cargar(self):
+        """Lee el campo de toda la tabla (del primario) y cambia el índice por el nuevo."""
+        with self._cargando:
+            with self._lock:
+                self._cambios = []
+            try:
+                with en_primario():
+                    pares = self.modelo.objects.values_list('pk', self.campo).iterator(chunk_size=5000)
+                    nuevo = IndicePrefijos(pares)
+            except Exception:
+                with self._lock:
+                    self._cambios = None
+                raise
+            with self._lock:
+                for pk, texto in self._cambios:
+                    _aplicar(nuevo, pk, texto)
+                self._cambios = None
+                self.indice = nuevo
+                self.cargado = time.monotonic()
+        return nuevo
+
+    def _recargar(self):
+        try:
+            self.cargar()
+        except Exception:
+            logger.exception("No se ha podido recargar el autocompletado de '%s'", self.tipo)
+        finally:
+            # La conexión de este hilo
+            connections.close_all()
+
+    def obtener(self):
+        """El índice; lo carga si no lo hay y lanza la recarga si ha caducado."""
+        indice = self.indice
+        if indice is None:
+            with self._cargando:
+                indice = self.indice
+            return indice if indice is not None else self.cargar()
+        caducado = time.monotonic() - self.cargado > settings.ALPHAAUTOS_AUTOCOMPLETAR_S
+        if caducado and not self._cargando.locked():
+            self.cargado = time.monotonic()
+            threading.Thread(target=self._recargar, daemon=True, name=f"autocompletar-{self.tipo}").start()
+        return indice
+
+    def cambiar(self, pk, texto):
+        """Pone el texto de `pk` (None = quitarlo) en el índice, si está cargado o cargándose."""
+        with self._lock:
+            if self._cambios is not None:
+                self._cambios.append((pk, texto))
+            indice = self.indice
+        if indice is not None:
+            _aplicar(indice, pk, texto)
+
+    def en_uso(self):
+        return self.indice is not None or self._cambios is not None
+
+    def olvidar(self):
+        with self._cargando:
+            self.indice = None
+
+
+def _aplicar(indice, pk, texto):
+    if texto is None:
+        indice.quitar(pk)
+    else:
+        indice.poner(pk, texto)
+
+
+FUENTES = {
+    fuente.tipo: fuente for fuente in (
+        Fuente('marca', Marca, 'nombre'),
+        Fuente('modelo', Coche, 'modelo', con_ids=False),
+        Fuente('concesionario', Concesionario, 'nombre'),
+        Fuente('ciudad', Concesionario, 'ciudad', con_ids=False),
+        # Los usuarios de los compradores (no los de empleados ni administradores)
+        Fuente('usuario', Comprador, 'usuario__username', permiso='AlphaAutos.view_comprador'),
+    )
+}
+
+
+def sugerencias(tipo, prefijo, limite=10):
+    """Lo que devuelve la API: [{'texto', 'ids'}] o [{'texto', 'total'}] según la fuente."""
+    fuente = FUENTES[tipo]
+    limite = max(1, min(limite, LIMITE_SUGERENCIAS))
+    clave = 'ids' if fuente.con_ids else 'total'
+    return [
+        {'texto': texto, clave: ids}
+        for texto, ids in fuente.obtener().buscar(prefijo, limite, fuente.con_ids)
+    ]
+
+
+def al_confirmar(tipo, pares):
+    """
+    Aplica [(pk, texto o None)] cuando se confirme la transacción en curso
+    (si se deshace, el índice no se entera). Lo usan las señales y las
+    operaciones que no las lanzan (importacion.py, masivo.py).
+    """
+    fuente = FUENTES[tipo]
+    if not fuente.en_uso():
+        # Sin índice: ya leerá estos datos de la BD cuando se cargue
+        return
+    pares = list(pares)
+    transaction.on_commit(lambda: [fuente.cambiar(pk, texto) for pk, texto in pares])
+
+
+def reiniciar():
+    """Olvida los índices (tras cambios masivos sin señales, como generar_datos)."""
+    for fuente in FUENTES.values():
+        fuente.olvidar()
+
+
+def calentar():
+    """Carga los índices en un hilo, para no hacer esperar a la primera consulta."""
+    def cargar_todos():
+        try:
+            for fuente in FUENTES.values():
+                fuente.cargar()
+        except Exception:
+            # P. ej. sin migrar: se cargará con la primera consulta
+            logger.exception("No se ha podido cargar el autocompletado")
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=cargar_todos, daemon=True, name='autocompletar').start()
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+# -------------------------------------------------------------------
+# Ajustes de cada conexión a la base de datos
+# -------------------------------------------------------------------
+# El perfil de BD ('sqlite' o 'postgres') se elige en settings.py con
+# ALPHAAUTOS_BD. En SQLite, los PRAGMA de ALPHAAUTOS_SQLITE_PRAGMAS (WAL,
+# synchronous, mmap, caché, busy_timeout) son por conexión, así que se
+# aplican al abrir cada una, desde AlphaautosConfig.ready().
+#
+# Se lanzan sobre la conexión sqlite3 directamente, no con un cursor de
+# Django: así no pasan por los execute_wrapper (no cuentan como
+# consultas de la petición que abre la conexión).
+
+
+def aplicar_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    for pragma, valor in getattr(settings, 'ALPHAAUTOS_SQLITE_PRAGMAS', {}).items():
+        connection.connection.execute(f"PRAGMA {pragma} = {valor}")
+
+
+def pragmas_actuales(connection):
+    """{pragma: valor} tal y como los ve la conexión (para el benchmark y las pruebas)."""
+    if connection.vendor != 'sqlite':
+        return {}
+    connection.ensure_connection()
+    resultado = {}
+    for pragma in getattr(settings, 'ALPHAAUTOS_SQLITE_PRAGMAS', {}):
+        fila = connection.connection.execute(f"PRAGMA {pragma}").fetchone()
+        # mmap_size no devuelve nada en las BD en memoria
+        resultado[pragma] = fila[0] if fila else None
+    return resultado
+
+
+def instalar():
+    connection_created.connect(aplicar_pragmas, dispatch_uid='alphaautos_pragmas_sqlite')
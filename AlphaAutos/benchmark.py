@@ -0,0 +1,460 @@
+import http.client
+import itertools
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+from importlib import import_module
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.models import Count
+from django.template import engines
+from django.test import Client, RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from . import metricas
+from .cache import cache_catalogo
+from .form import CocheSearchForm, VentaSearchForm
+from .models import *
+
+# -------------------------------------------------------------------
+# Benchmark de las vistas principales
+# -------------------------------------------------------------------
+# Cada escenario es una petición a una vista (GET o el POST de
+# crear_venta). Se lanza de dos formas:
+#
+#   - 'cliente': con el Client de Django, una petición detrás de otra en
+#     el propio proceso. Mide lo que cuesta la vista, sin red ni servidor.
+#   - 'http': contra un servidor WSGI con hilos levantado en 127.0.0.1,
+#     con N peticiones a la vez (http.client, una conexión por hilo).
+#   - 'asgi': igual, pero contra uvicorn sirviendo mysite/asgi.py. Las
+#     vistas async (concesionario_detail...) no ocupan hilo mientras
+#     esperan; las síncronas pasan por sync_to_async.
+#
+# Por escenario: peticiones/s, latencias p50/p95/p99 (de las muestras,
+# no de cubetas) y consultas por petición. Las consultas salen del
+# registro de metricas.py, que el comando pone a medir todas las
+# peticiones.
+#
+# comparar() enfrenta un resultado con otro guardado (la "base") y marca
+# las regresiones que pasan del umbral. Ver manage.py benchmark.
+
+ESCENARIOS = ['coche_list', 'buscar_coches', 'lista_ventas', 'resumen_ventas', 'crear_venta', 'concesionario_detail']
+
+PERCENTILES = (50, 95, 99)
+
+
+@contextmanager
+def bd_aparte(escala, semilla, stdout):
+    """
+    BD de pruebas llena con generar_datos (misma escala y semilla = mismos
+    datos); la de desarrollo no se toca. Se borra al salir.
+    """
+    # En un fichero: en SQLite, la de memoria no se comparte bien entre hilos
+    directorio = tempfile.mkdtemp(prefix='alphaautos-benchmark-')
+    if connection.vendor == 'sqlite':
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directorio, 'benchmark.sqlite3')
+    # debug=False: como en producción, sin guardar cada consulta en memoria
+    setup_test_environment(debug=False)
+    nombre_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        stdout.write(f"Generando datos (escala {escala}, semilla {semilla})...")
+        call_command('generar_datos', escala=escala, semilla=semilla, stdout=open(os.devnull, 'w'))
+        yield
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def preparar(usuario, por_vender=200):
+    """
+    {escenario: (método, url, datos o función que da los datos de cada petición)} con datos que existen en la BD.
+    Crea `por_vender` coches sin vender para los POST de crear_venta (uno por petición).
+    """
+    coche = Coche.objects.order_by('pk').first()
+    concesionario = Concesionario.objects.order_by('pk').first()
+    comprador = Comprador.objects.order_by('pk').first()
+    if not (coche and concesionario and comprador):
+        raise ValueError('La BD no tiene datos: hace falta generar_datos antes.')
+
+    # crear_venta: cada POST vende un coche nuevo (uno ya vendido no se puede vender otra vez, ver
+    # reservas.py). Si se acaban, los siguientes POST vuelven a probar los primeros y fallan
+    coches = itertools.cycle([nuevo.pk for nuevo in coches_por_vender(coche, por_vender)] or [coche.pk])
+    lock = threading.Lock()
+    hoy = date.today()
+
+    def datos_venta():
+        with lock:
+            coche_id = next(coches)
+        return {
+            'comprador': comprador.pk, 'coche': coche_id, 'metodo_pago': 'Tarjeta',
+            'fecha_venta_day': hoy.day, 'fecha_venta_month': hoy.month, 'fecha_venta_year': hoy.year,
+        }
+
+    # Una palabra del modelo de un coche real: la búsqueda siempre encuentra algo
+    palabra = coche.modelo.split()[0]
+    return {
+        'coche_list': ('GET', reverse('AlphaAutos:coche_list'), None),
+        'buscar_coches': ('GET', reverse('AlphaAutos:buscar_coches') + '?' + urlencode({'modelo': palabra}), None),
+        'lista_ventas': ('GET', reverse('AlphaAutos:lista_ventas'), None),
+        'resumen_ventas': (
+            'GET', reverse('AlphaAutos:resumen_ventas') + '?' + urlencode({'agrupar': 'concesionario'}), None,
+        ),
+        'crear_venta': ('POST', reverse('AlphaAutos:crear_venta'), datos_venta),
+        'concesionario_detail': (
+            'GET', reverse('AlphaAutos:concesionario_detail', kwargs={'id_concesionario': concesionario.pk}), None,
+        ),
+    }
+
+
+def coches_por_vender(modelo, n):
+    """`n` coches nuevos sin vender, copias de `modelo`."""
+    return Coche.objects.bulk_create([
+        Coche(marca_id=modelo.marca_id, concesionario_id=modelo.concesionario_id, modelo=modelo.modelo,
+              precio=modelo.precio, transmision=modelo.transmision, fecha_fabricacion=modelo.fecha_fabricacion)
+        for _ in range(n)
+    ])
+
+
+def percentil(ordenadas, p):
+    """Percentil `p` de una lista ya ordenada (interpolación lineal, como numpy)."""
+    if not ordenadas:
+        return None
+    posicion = (len(ordenadas) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenadas) - 1)
+    return ordenadas[inferior] + (ordenadas[superior] - ordenadas[inferior]) * (posicion - inferior)
+
+
+def _resumir(nombre_vista, latencias, errores, segundos):
+    latencias = sorted(latencias)
+    fila = next((f for f in metricas.registro.resumen() if f['vista'] == nombre_vista), None)
+    return {
+        'peticiones': len(latencias),
+        'errores': errores,
+        'peticiones_s': round(len(latencias) / segundos, 1) if segundos else None,
+        **{f"p{p}_ms": round(percentil(latencias, p) * 1000, 2) for p in PERCENTILES},
+        # La media sale de suma / cuenta del histograma: es exacta, no interpolada
+        'consultas_media': round(fila['consultas']['media'], 2) if fila else None,
+        'consultas_max': fila['consultas']['max'] if fila else None,
+    }
+
+
+def _datos(datos):
+    return datos() if callable(datos) else datos
+
+
+def medir_cliente(usuario, escenarios, peticiones, calentamiento=5):
+    """Un Client de Django, peticiones en serie. Devuelve {escenario: resumen}."""
+    cliente = Client()
+    cliente.force_login(usuario)
+    resultados = {}
+    for nombre, (metodo, url, datos) in escenarios.items():
+        pedir = cliente.post if metodo == 'POST' else cliente.get
+        cache_catalogo().clear()
+        for _ in range(calentamiento):
+            pedir(url, _datos(datos))
+        metricas.registro.limpiar()
+        latencias, errores = [], 0
+        inicio = time.perf_counter()
+        for _ in range(peticiones):
+            antes = time.perf_counter()
+            respuesta = pedir(url, _datos(datos))
+            latencias.append(time.perf_counter() - antes)
+            errores += respuesta.status_code >= 400
+        resultados[nombre] = _resumir(f"AlphaAutos:{nombre}", latencias, errores, time.perf_counter() - inicio)
+    return resultados
+
+
+class _Silencioso(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class ServidorLocal:
+    """Servidor WSGI con hilos en 127.0.0.1 y un puerto libre, mientras dure el `with`."""
+
+    def __enter__(self):
+        self.servidor = ThreadedWSGIServer(('127.0.0.1', 0), _Silencioso, allow_reuse_address=True)
+        self.servidor.set_app(get_wsgi_application())
+        self.puerto = self.servidor.server_address[1]
+        self.hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self.hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+class ServidorASGI:
+    """uvicorn (un proceso, su bucle en un hilo) en 127.0.0.1 y un puerto libre, mientras dure el `with`."""
+
+    def __enter__(self):
+        try:
+            import uvicorn
+        except ImportError:
+            raise ValueError('El modo asgi necesita uvicorn (pip install uvicorn).')
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.puerto = self.socket.getsockname()[1]
+        configuracion = uvicorn.Config(get_asgi_application(), lifespan='off', log_level='warning', access_log=False)
+        self.servidor = uvicorn.Server(configuracion)
+        self.hilo = threading.Thread(target=self.servidor.run, kwargs={'sockets': [self.socket]}, daemon=True)
+        self.hilo.start()
+        while not self.servidor.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.servidor.should_exit = True
+        self.hilo.join()
+        self.socket.close()
+
+
+class _Conexion:
+    """Una conexión HTTP keep-alive con la sesión del usuario y su token CSRF."""
+
+    def __init__(self, puerto, cookies, token):
+        self.http = http.client.HTTPConnection('127.0.0.1', puerto, timeout=60)
+        self.cabeceras = {'Cookie': cookies, 'Host': '127.0.0.1'}
+        self.token = token
+
+    def pedir(self, metodo, url, datos):
+        cabeceras = dict(self.cabeceras)
+        cuerpo = None
+        if metodo == 'POST':
+            cuerpo = urlencode({**datos, 'csrfmiddlewaretoken': self.token})
+            cabeceras['Content-Type'] = 'application/x-www-form-urlencoded'
+            cabeceras['Referer'] = f'http://127.0.0.1:{self.http.port}{url}'
+        self.http.request(metodo, url, body=cuerpo, headers=cabeceras)
+        respuesta = self.http.getresponse()
+        respuesta.read()
+        return respuesta.status
+
+
+def _sesion_http(usuario, puerto, url_formulario):
+    """Cookies de sesión + CSRF y el token del formulario, para que los POST pasen CsrfViewMiddleware."""
+    from django.conf import settings
+    cliente = Client()
+    cliente.force_login(usuario)
+    sesion = cliente.cookies[settings.SESSION_COOKIE_NAME].value
+    conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=60)
+    conexion.request('GET', url_formulario, headers={'Cookie': f"{settings.SESSION_COOKIE_NAME}={sesion}"})
+    respuesta = conexion.getresponse()
+    html = respuesta.read().decode()
+    csrf = re.search(rf"{settings.CSRF_COOKIE_NAME}=([^;]+)", respuesta.getheader('Set-Cookie') or '')
+    token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', html)
+    conexion.close()
+    cookies = f"{settings.SESSION_COOKIE_NAME}={sesion}"
+    if csrf:
+        cookies += f"; {settings.CSRF_COOKIE_NAME}={csrf.group(1)}"
+    return cookies, token.group(1) if token else ''
+
+
+def medir_http(usuario, escenarios, peticiones, concurrencia, calentamiento=5, asgi=False):
+    """`concurrencia` hilos contra un servidor local (WSGI, o uvicorn con `asgi`). Devuelve {escenario: resumen}."""
+    resultados = {}
+    with (ServidorASGI() if asgi else ServidorLocal()) as servidor:
+        cookies, token = _sesion_http(usuario, servidor.puerto, reverse('AlphaAutos:crear_venta'))
+        locales = threading.local()
+
+        def una(metodo, url, datos):
+            if not hasattr(locales, 'conexion'):
+                locales.conexion = _Conexion(servidor.puerto, cookies, token)
+            antes = time.perf_counter()
+            estado = locales.conexion.pedir(metodo, url, _datos(datos))
+            return time.perf_counter() - antes, estado
+
+        with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+            for nombre, (metodo, url, datos) in escenarios.items():
+                cache_catalogo().clear()
+                list(pool.map(lambda _: una(metodo, url, datos), range(calentamiento * concurrencia)))
+                metricas.registro.limpiar()
+                inicio = time.perf_counter()
+                medidas = list(pool.map(lambda _: una(metodo, url, datos), range(peticiones)))
+                segundos = time.perf_counter() - inicio
+                resultados[nombre] = _resumir(
+                    f"AlphaAutos:{nombre}", [latencia for latencia, _ in medidas],
+                    sum(estado >= 400 for _, estado in medidas), segundos,
+                )
+    return resultados
+
+
+# -------------------------------------------------------------------
+# Muchos compradores a la vez (manage.py estres_ventas)
+# -------------------------------------------------------------------
+def estres_ventas(compradores, coches):
+    """
+    Cada comprador intenta comprar un coche de `coches` (el i-ésimo, el
+    coche i % len(coches)), todos a la vez y cada uno en su hilo y su
+    conexión, con un POST a la vista crear_venta (RequestFactory, sin
+    middleware). Devuelve cuántos compraron (redirección), cuántos
+    perdieron la carrera (el formulario con el error), los errores, las
+    latencias y los coches con más de una venta activa (tiene que ser 0).
+    Los compradores necesitan el permiso add_venta.
+    """
+    from .views import crear_venta
+
+    salida = threading.Barrier(len(compradores))
+    fabrica = RequestFactory()
+    url = reverse('AlphaAutos:crear_venta')
+    hoy = date.today()
+
+    def comprar(i):
+        comprador, coche = compradores[i], coches[i % len(coches)]
+        peticion = fabrica.post(url, {
+            'coche': coche.pk, 'metodo_pago': 'Tarjeta',
+            'fecha_venta_day': hoy.day, 'fecha_venta_month': hoy.month, 'fecha_venta_year': hoy.year,
+        })
+        peticion.user = comprador.usuario
+        peticion.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        peticion._messages = CookieStorage(peticion)
+        try:
+            salida.wait()
+            antes = time.perf_counter()
+            try:
+                respuesta = crear_venta(peticion)
+            except Exception as error:
+                return time.perf_counter() - antes, type(error).__name__
+            return time.perf_counter() - antes, respuesta.status_code == 302
+        finally:
+            connection.close()
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(compradores)) as pool:
+        medidas = list(pool.map(comprar, range(len(compradores))))
+    segundos = time.perf_counter() - inicio
+
+    latencias = sorted(latencia for latencia, _ in medidas)
+    resultados = [resultado for _, resultado in medidas]
+    ids = [coche.pk for coche in coches]
+    return {
+        'compradores': len(compradores),
+        'coches': len(coches),
+        'ventas': resultados.count(True),
+        'conflictos': resultados.count(False),
+        'errores': dict(Counter(r for r in resultados if isinstance(r, str))),
+        'intentos_s': round(len(compradores) / segundos, 1),
+        **{f"p{p}_ms": round(percentil(latencias, p) * 1000, 2) for p in PERCENTILES},
+        'dobles': (
+            Venta.objects.filter(coche_id__in=ids, anulada=False)
+            .values('coche').annotate(n=Count('id')).filter(n__gt=1).count()
+        ),
+        'vendidos': Coche.objects.filter(pk__in=ids, vendido=True).count(),
+    }
+
+
+# -------------------------------------------------------------------
+# Render de listados: DjangoTemplates contra Jinja2
+# -------------------------------------------------------------------
+# Las plantillas que tienen versión Jinja2 (AlphaAutos/jinja2/), con la
+# variable de sus filas, la consulta de la vista y su formulario de
+# búsqueda. Ver manage.py comparar_plantillas.
+PLANTILLAS_JINJA2 = [
+    ('concesionario/coche_list.html', 'coches',
+     lambda: Coche.objects.select_related('marca', 'concesionario'), None),
+    ('concesionario/lista_ventas.html', 'ventas',
+     lambda: Venta.objects.select_related('coche__marca', 'comprador__usuario'), None),
+    ('concesionario/lista_clientes.html', 'clientes',
+     lambda: Comprador.objects.select_related('usuario'), None),
+    ('concesionario/lista_empleados.html', 'empleados',
+     lambda: Empleado.objects.select_related('concesionario'), None),
+    ('Crud_Coche/coche_busqueda.html', 'coches',
+     lambda: Coche.objects.select_related('marca', 'concesionario'), lambda usuario: CocheSearchForm()),
+    ('Crud_Venta/venta_busqueda.html', 'ventas',
+     lambda: Venta.objects.select_related('coche__marca', 'comprador__usuario'),
+     lambda usuario: VentaSearchForm(request=usuario)),
+]
+
+
+def peticion_de(usuario):
+    """GET / de `usuario` con sesión, para los context processors."""
+    request = RequestFactory().get('/')
+    request.user = usuario
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+    return request
+
+
+def comparar_motores(usuario, filas, repeticiones):
+    """
+    Renderiza cada plantilla de PLANTILLAS_JINJA2 con `filas` filas (las de
+    la BD repetidas hasta llegar) con los dos motores, `repeticiones` veces
+    cada uno tras una de calentamiento, como `usuario`. Solo mide el
+    render: las filas se cargan antes. Devuelve por plantilla la mediana
+    en ms de cada motor y cuántas veces más rápido va Jinja2.
+    """
+    resultados = []
+    for nombre, variable, consulta, formulario in PLANTILLAS_JINJA2:
+        base = list(consulta()[:filas])
+        contexto = {variable: list(itertools.islice(itertools.cycle(base), filas)) if base else []}
+        if formulario:
+            contexto['form'] = formulario(usuario)
+        medianas = {}
+        for motor in ('django', 'jinja2'):
+            plantilla = engines[motor].get_template(nombre)
+            tiempos = []
+            for _ in range(repeticiones + 1):
+                request = peticion_de(usuario)
+                inicio = time.perf_counter()
+                plantilla.render(contexto, request)
+                tiempos.append(time.perf_counter() - inicio)
+            medianas[motor] = percentil(sorted(tiempos[1:]), 50) * 1000
+        resultados.append({
+            'plantilla': nombre,
+            'filas': len(contexto[variable]),
+            'django_ms': round(medianas['django'], 1),
+            'jinja2_ms': round(medianas['jinja2'], 1),
+            'veces': round(medianas['django'] / medianas['jinja2'], 1),
+        })
+    return resultados
+
+
+# -------------------------------------------------------------------
+# Comparación con una base
+# -------------------------------------------------------------------
+def comparar(actual, base, umbral):
+    """
+    [(modo, escenario, medida, base, actual, cambio)] de lo que ha empeorado
+    más que `umbral` (0.2 = 20 %). Latencias y consultas empeoran al
+    subir; peticiones/s, al bajar.
+    """
+    regresiones = []
+    for modo, escenarios in actual['resultados'].items():
+        for escenario, medidas in escenarios.items():
+            anterior = base.get('resultados', {}).get(modo, {}).get(escenario)
+            if not anterior:
+                continue
+            for medida in ('p50_ms', 'p95_ms', 'peticiones_s', 'consultas_media'):
+                antes, ahora = anterior.get(medida), medidas.get(medida)
+                if not antes or ahora is None:
+                    continue
+                cambio = (ahora - antes) / antes
+                if medida == 'peticiones_s':
+                    cambio = -cambio
+                if medida == 'consultas_media':
+                    # Las consultas no dependen de la máquina: media consulta más por petición ya es una regresión
+                    empeora = ahora - antes >= 0.5
+                else:
+                    empeora = cambio > umbral
+                if empeora:
+                    regresiones.append((modo, escenario, medida, antes, ahora, cambio))
+    return regresiones
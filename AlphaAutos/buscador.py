@@ -0,0 +1,337 @@
+import operator
+import re
+from functools import lru_cache, reduce
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import *
+
+# -------------------------------------------------------------------
+# Motor de búsqueda de texto
+# -------------------------------------------------------------------
+# Las vistas buscar_* ya no encadenan filtros __icontains (LIKE '%x%',
+# que obliga a recorrer la tabla entera). Cada modelo buscable tiene un
+# índice de texto propio y un backend intercambiable lo consulta:
+#
+#   - SQLite:     tabla virtual FTS5 con tokenizador unicode61 sin tildes.
+#   - PostgreSQL: columna tsvector con pesos por campo e índice GIN,
+#                 configuración 'alphaautos_es' (spanish + unaccent).
+#   - Resto:      __icontains de toda la vida, como respaldo.
+#
+# Las tablas se crean en la migración 0005 y se mantienen al día con
+# las señales de AlphaAutos/signals.py.
+#
+# La búsqueda no devuelve una lista de ids: es una subconsulta sobre la
+# tabla del índice (id IN (SELECT rowid ... MATCH ...)) que va dentro de
+# la consulta de la vista. Los demás filtros (precio, ventas de un
+# comprador...) y la paginación por cursor se aplican así a todas las
+# coincidencias, sin tope, en una sola consulta.
+#
+# Orden por relevancia (mas_relevantes): el backend ordena por bm25 (FTS5)
+# o ts_rank (PostgreSQL) en su propia consulta sobre la tabla del índice,
+# solo entre las coincidencias que pasan los filtros de la vista, y se
+# queda con las N primeras. Calcular el rank fila a fila desde la consulta
+# de la vista (una subconsulta correlacionada) no escala.
+
+
+class Indice:
+    """
+    Describe qué campos de un modelo se indexan. `campos` relaciona el
+    nombre de la columna del índice con la ruta ORM de la que sale el texto
+    (p. ej. 'marca' -> 'marca__nombre').
+    """
+
+    def __init__(self, tipo, modelo, campos):
+        self.tipo = tipo
+        self.modelo = modelo
+        self.campos = campos
+        self.tabla = f"alphaautos_busqueda_{tipo}"
+
+    def queryset(self):
+        relaciones = {ruta.rsplit('__', 1)[0] for ruta in self.campos.values() if '__' in ruta}
+        return self.modelo.objects.select_related(*relaciones)
+
+    def textos(self, objeto):
+        valores = []
+        for ruta in self.campos.values():
+            valor = objeto
+            for parte in ruta.split('__'):
+                valor = getattr(valor, parte, None) if valor is not None else None
+            valores.append('' if valor is None else str(valor))
+        return valores
+
+    def dependencias(self):
+        """
+        Modelos relacionados cuyo cambio obliga a reindexar este índice:
+        [(modelo_relacionado, nombre_fk, campos_usados)].
+        """
+        resultado = {}
+        for ruta in self.campos.values():
+            if '__' not in ruta:
+                continue
+            fk, campo = ruta.split('__', 1)
+            relacionado = self.modelo._meta.get_field(fk).related_model
+            resultado.setdefault((relacionado, fk), set()).add(campo)
+        return [(modelo, fk, campos) for (modelo, fk), campos in resultado.items()]
+
+
+INDICES = {
+    indice.tipo: indice for indice in (
+        Indice('coche', Coche, {'marca': 'marca__nombre', 'modelo': 'modelo', 'concesionario': 'concesionario__nombre'}),
+        Indice('marca', Marca, {'nombre': 'nombre', 'pais_origen': 'pais_origen'}),
+        Indice('concesionario', Concesionario, {'nombre': 'nombre', 'ciudad': 'ciudad', 'telefono': 'telefono'}),
+        Indice('empleado', Empleado, {'nombre': 'nombre', 'puesto': 'puesto'}),
+        Indice('comprador', Comprador, {'usuario': 'usuario__username', 'telefono': 'telefono', 'email': 'usuario__email'}),
+        Indice('aseguradora', Aseguradora, {'nombre': 'nombre', 'pais': 'pais', 'telefono': 'telefono'}),
+    )
+}
+
+
+def _terminos(texto):
+    # Solo letras y números: lo demás no forma parte de ningún token
+    return re.findall(r'\w+', texto or '')
+
+
+def _en_lotes(iterable, tamanio=1000):
+    lote = []
+    for elemento in iterable:
+        lote.append(elemento)
+        if len(lote) == tamanio:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+class BuscadorBase:
+    """Interfaz común de los backends de búsqueda."""
+
+    def indexar(self, indice, objetos):
+        raise NotImplementedError
+
+    def eliminar(self, indice, ids):
+        raise NotImplementedError
+
+    def coincidentes(self, indice, criterios):
+        """
+        Subconsulta con los ids que cumplen TODOS los criterios
+        ({campo: texto}), o None si no hay ningún criterio con texto. El
+        campo None busca en cualquier campo. Va dentro de la consulta de la
+        vista (pk__in=...), así que sus filtros, el orden y la paginación se
+        aplican sobre todas las coincidencias, no sobre las N primeras.
+        """
+        raise NotImplementedError
+
+    def relevantes(self, indice, criterios, candidatos, limite):
+        """
+        Ids de `candidatos` (subconsulta de ids, con los filtros de la
+        vista) que cumplen los criterios, de más a menos relevante, como
+        mucho `limite`. None si el backend no ordena por relevancia.
+        """
+        return None
+
+    def vaciar(self, indice):
+        raise NotImplementedError
+
+    def reconstruir(self, indice):
+        self.vaciar(indice)
+        for lote in _en_lotes(indice.queryset().order_by('pk').iterator(chunk_size=2000), 2000):
+            self.indexar(indice, lote)
+
+
+class BuscadorIcontains(BuscadorBase):
+    """Respaldo sin índice: el comportamiento original con __icontains."""
+
+    def indexar(self, indice, objetos):
+        pass
+
+    def eliminar(self, indice, ids):
+        pass
+
+    def vaciar(self, indice):
+        pass
+
+    def coincidentes(self, indice, criterios):
+        filtro = Q()
+        for campo, texto in criterios.items():
+            if not (texto and _terminos(texto)):
+                continue
+            if campo is None:
+                # Cada término, en alguno de los campos
+                for termino in _terminos(texto):
+                    filtro &= reduce(operator.or_, (
+                        Q(**{f"{ruta}__icontains": termino}) for ruta in indice.campos.values()
+                    ))
+            else:
+                filtro &= Q(**{f"{indice.campos[campo]}__icontains": texto.strip()})
+        if not filtro:
+            return None
+        return indice.modelo.objects.filter(filtro).values('pk')
+
+
+class BuscadorSQLite(BuscadorBase):
+    """Tablas virtuales FTS5; el rowid de cada fila es el id del objeto."""
+
+    def indexar(self, indice, objetos):
+        columnas = ', '.join(indice.campos)
+        marcadores = ', '.join(['%s'] * (len(indice.campos) + 1))
+        filas = [[objeto.pk, *indice.textos(objeto)] for objeto in objetos]
+        if filas:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"REPLACE INTO {indice.tabla} (rowid, {columnas}) VALUES ({marcadores})", filas
+                )
+
+    def eliminar(self, indice, ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {indice.tabla} WHERE rowid = %s", [[i] for i in ids])
+
+    def vaciar(self, indice):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {indice.tabla}")
+
+    def _consulta(self, criterios):
+        # modelo : "golf"* AND marca : "seat"*  (prefijos, sin tildes, sin mayúsculas)
+        partes = [
+            f'{campo} : "{termino}"*' if campo else f'"{termino}"*'
+            for campo, texto in criterios.items()
+            for termino in _terminos(texto)
+        ]
+        return ' AND '.join(partes) or None
+
+    def coincidentes(self, indice, criterios):
+        consulta = self._consulta(criterios)
+        if consulta is None:
+            return None
+        return RawSQL(f"SELECT rowid FROM {indice.tabla} WHERE {indice.tabla} MATCH %s", [consulta])
+
+    def relevantes(self, indice, criterios, candidatos, limite):
+        # rank es bm25(): FTS5 lo calcula mientras recorre las coincidencias (menor = mejor).
+        # Los candidatos van en un JOIN: con "rowid IN (...)" FTS5 busca rowid a rowid
+        # (~45 s con 200.000 coches frente a ~20 ms)
+        consulta = self._consulta(criterios)
+        if consulta is None:
+            return None
+        sql, parametros = candidatos.query.sql_with_params()
+        t = indice.tabla
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {t}.rowid FROM {t} JOIN ({sql}) candidatos ON candidatos.id = {t}.rowid "
+                f"WHERE {t} MATCH %s ORDER BY {t}.rank, {t}.rowid LIMIT %s",
+                [*parametros, consulta, limite],
+            )
+            return [fila[0] for fila in cursor.fetchall()]
+
+
+class BuscadorPostgres(BuscadorBase):
+    """Columna tsvector generada (pesos A, B, C por campo) con índice GIN."""
+
+    PESOS = 'ABC'
+
+    def indexar(self, indice, objetos):
+        columnas = ', '.join(indice.campos)
+        actualizar = ', '.join(f"{campo} = EXCLUDED.{campo}" for campo in indice.campos)
+        marcadores = ', '.join(['%s'] * (len(indice.campos) + 1))
+        filas = [[objeto.pk, *indice.textos(objeto)] for objeto in objetos]
+        if filas:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {indice.tabla} (objeto_id, {columnas}) VALUES ({marcadores}) "
+                    f"ON CONFLICT (objeto_id) DO UPDATE SET {actualizar}",
+                    filas,
+                )
+
+    def eliminar(self, indice, ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {indice.tabla} WHERE objeto_id = ANY(%s)", [list(ids)])
+
+    def vaciar(self, indice):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {indice.tabla}")
+
+    def _consulta(self, indice, criterios):
+        # golf:*B & seat:*A  -> el peso limita cada término a su campo
+        pesos = dict(zip(indice.campos, self.PESOS))
+        partes = [
+            f"{termino}:*{pesos[campo]}" if campo else f"{termino}:*"
+            for campo, texto in criterios.items()
+            for termino in _terminos(texto)
+        ]
+        return ' & '.join(partes) or None
+
+    def coincidentes(self, indice, criterios):
+        consulta = self._consulta(indice, criterios)
+        if consulta is None:
+            return None
+        return RawSQL(
+            f"SELECT objeto_id FROM {indice.tabla} WHERE documento @@ to_tsquery('alphaautos_es', %s)",
+            [consulta],
+        )
+
+    def relevantes(self, indice, criterios, candidatos, limite):
+        consulta = self._consulta(indice, criterios)
+        if consulta is None:
+            return None
+        sql, parametros = candidatos.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT objeto_id FROM {indice.tabla}, to_tsquery('alphaautos_es', %s) consulta "
+                f"WHERE documento @@ consulta AND objeto_id IN ({sql}) "
+                f"ORDER BY ts_rank(documento, consulta) DESC, objeto_id LIMIT %s",
+                [consulta, *parametros, limite],
+            )
+            return [fila[0] for fila in cursor.fetchall()]
+
+
+BACKENDS_POR_MOTOR = {
+    'sqlite': BuscadorSQLite,
+    'postgresql': BuscadorPostgres,
+}
+
+
+@lru_cache(maxsize=None)
+def _crear_buscador(ruta, motor):
+    if ruta:
+        return import_string(ruta)()
+    return BACKENDS_POR_MOTOR.get(motor, BuscadorIcontains)()
+
+
+def obtener_buscador():
+    """Backend configurado en settings.ALPHAAUTOS_BUSCADOR o el propio del motor de BD."""
+    return _crear_buscador(getattr(settings, 'ALPHAAUTOS_BUSCADOR', None), connection.vendor)
+
+
+def filtro(tipo, criterios, campo='pk'):
+    """Q con `campo`__in las coincidencias de `tipo` (None si no hay criterios de texto)."""
+    coincidentes = obtener_buscador().coincidentes(INDICES[tipo], criterios)
+    if coincidentes is None:
+        return None
+    return Q(**{f"{campo}__in": coincidentes})
+
+
+def buscar(queryset, tipo, criterios, campo='pk'):
+    """
+    Filtra `queryset` por la búsqueda de texto, en la misma consulta (para
+    paginarlo con paginar_keyset). `campo` es la FK al modelo `tipo` si el
+    queryset es de otro modelo (p. ej. 'coche' en las ventas). Sin
+    criterios de texto devuelve el queryset tal cual.
+    """
+    condicion = filtro(tipo, criterios, campo)
+    return queryset if condicion is None else queryset.filter(condicion)
+
+
+def mas_relevantes(queryset, tipo, criterios, limite):
+    """
+    Las `limite` filas de `queryset` (del modelo `tipo`) que cumplen los
+    criterios, de más a menos relevante. None si no hay criterios de texto
+    o el backend no ordena por relevancia (__icontains).
+    """
+    ids = obtener_buscador().relevantes(INDICES[tipo], criterios, queryset.order_by().values('pk'), limite)
+    if not ids:
+        return ids
+    objetos = queryset.in_bulk(ids)
+    return [objetos[pk] for pk in ids if pk in objetos]
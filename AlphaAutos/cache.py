@@ -0,0 +1,283 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db import transaction
+
+from .replicas import en_primario
+
+# -------------------------------------------------------------------
+# Caché del catálogo
+# -------------------------------------------------------------------
+# Las páginas de catálogo (marcas, concesionarios, aseguradoras, coches)
+# se leen mucho más de lo que se escriben. Se guardan en la caché
+# 'catalogo' (settings.CACHES) tanto los objetos/listas como los
+# fragmentos de plantilla ya renderizados.
+#
+# Invalidación por versiones: cada cosa cacheable depende de unos
+# "tokens" ('marca:3', 'lista:marca', 'concesionario:2:coches', ...).
+# Cada token tiene una versión en la propia caché; las señales de
+# AlphaAutos/signals.py la cambian cuando se guarda o borra algo, y
+# toda entrada guardada con una versión anterior deja de valer. Así,
+# editar una Marca solo invalida lo que depende de esa marca.
+# Dentro de una transacción la versión se cambia otra vez al confirmar
+# (ver invalidar).
+#
+# Ojo: con 'lru' o 'locmem' cada proceso tiene su caché; si se sirve con
+# varios procesos hay que usar un backend compartido ('file', Redis...).
+
+ALIAS = 'catalogo'
+
+# Aciertos y fallos de obtener(), por tipo de clave ('marca', 'lista', ...)
+_estadisticas = Counter()
+_estadisticas_lock = threading.Lock()
+
+
+def cache_catalogo():
+    return caches[ALIAS]
+
+
+def _clave_version(token):
+    return f"version:{token}"
+
+
+def versiones(tokens):
+    """Versión actual de cada token (se crea si la caché no la tiene)."""
+    tokens = list(tokens)
+    cache = cache_catalogo()
+    actuales = cache.get_many([_clave_version(t) for t in tokens])
+    resultado = {}
+    for token in tokens:
+        version = actuales.get(_clave_version(token))
+        if version is None:
+            # Si la versión se ha expulsado se empieza por una nueva, nunca por una antigua
+            cache.add(_clave_version(token), time.time_ns(), timeout=None)
+            version = cache.get(_clave_version(token))
+        resultado[token] = version
+    return resultado
+
+
+def _cambiar_versiones(tokens):
+    ahora = time.time_ns()
+    cache_catalogo().set_many({_clave_version(t): ahora for t in tokens}, timeout=None)
+
+
+def invalidar(*tokens):
+    """
+    Cambia la versión de los tokens: lo que dependa de ellos deja de valer.
+    Dentro de una transacción se vuelve a cambiar al confirmarla: hasta
+    entonces otra petición puede leer las filas de antes y guardarlas con
+    la versión nueva, y eso duraría todo el timeout.
+    """
+    if tokens:
+        _cambiar_versiones(tokens)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: _cambiar_versiones(tokens))
+
+
+def _firma(versiones_entrada):
+    texto = '|'.join(f"{token}={version}" for token, version in sorted(versiones_entrada.items()))
+    return hashlib.md5(texto.encode()).hexdigest()[:12]
+
+
+def _anotar(clave, resultado):
+    with _estadisticas_lock:
+        _estadisticas[f"{clave.split(':', 1)[0]}.{resultado}"] += 1
+
+
+def obtener(clave, dependencias, cargar, dependencias_de=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Devuelve (valor, firma). `valor` sale de la caché si ninguna de sus
+    dependencias ha cambiado; si no, se llama a `cargar()` y se guarda.
+
+    `dependencias_de(valor)` permite añadir tokens que solo se conocen
+    tras cargar (p. ej. las marcas de los coches de una página).
+    La `firma` resume las versiones y sirve para claves de fragmentos.
+    """
+    encontrado = _leer(clave)
+    if encontrado is not None:
+        return encontrado
+    # Las versiones se leen antes de cargar: un cambio a mitad invalida la entrada
+    versiones_entrada = versiones(dependencias)
+    # Del primario: con la réplica atrasada se guardaría lo de antes bajo las versiones nuevas
+    with en_primario():
+        valor = cargar()
+    return valor, _guardar(clave, valor, versiones_entrada, dependencias_de, timeout)
+
+
+async def aobtener(clave, dependencias, cargar, dependencias_de=None, timeout=DEFAULT_TIMEOUT):
+    """
+    obtener() para las vistas async: `cargar()` devuelve una corrutina (ORM
+    async). Las lecturas de la caché no se pasan a un hilo: con 'lru' y
+    'locmem' son memoria del proceso y no bloquean el bucle.
+    """
+    encontrado = _leer(clave)
+    if encontrado is not None:
+        return encontrado
+    versiones_entrada = versiones(dependencias)
+    with en_primario():
+        valor = await cargar()
+    return valor, _guardar(clave, valor, versiones_entrada, dependencias_de, timeout)
+
+
+def _leer(clave):
+    """(valor, firma) si la entrada está y sigue valiendo; None si hay que cargar."""
+    entrada = cache_catalogo().get(f"datos:{clave}")
+    if entrada is not None and versiones(entrada['versiones']) == entrada['versiones']:
+        _anotar(clave, 'aciertos')
+        return entrada['valor'], _firma(entrada['versiones'])
+    _anotar(clave, 'fallos')
+    return None
+
+
+def _guardar(clave, valor, versiones_entrada, dependencias_de, timeout):
+    if dependencias_de is not None:
+        versiones_entrada.update(versiones(set(dependencias_de(valor)) - set(versiones_entrada)))
+    cache_catalogo().set(f"datos:{clave}", {'valor': valor, 'versiones': versiones_entrada}, timeout)
+    return _firma(versiones_entrada)
+
+
+def estadisticas():
+    """Aciertos/fallos de obtener() y, si el backend los lleva, los suyos."""
+    with _estadisticas_lock:
+        resultado = {'obtener': dict(_estadisticas)}
+    backend = cache_catalogo()
+    if hasattr(backend, 'estadisticas'):
+        resultado['backend'] = backend.estadisticas()
+    return resultado
+
+
+# -------------------------------------------------------------------
+# Permisos del usuario
+# -------------------------------------------------------------------
+# El menú y los botones consultan perms.* en cada página (2 consultas).
+# Se guardan en la caché y se invalidan al cambiar grupos o permisos.
+
+def permisos_usuario(user):
+    if not user.is_authenticated or not user.is_active:
+        return set()
+    if user.is_superuser:
+        # has_perm() no consulta la BD para superusuarios activos
+        return {'*'}
+    permisos, _ = obtener(
+        f"permisos:{user.pk}", ['permisos', f"permisos:{user.pk}"], user.get_all_permissions,
+    )
+    # ModelBackend reutiliza esta caché en has_perm()
+    user._perm_cache = permisos
+    return permisos
+
+
+def perfil_permisos(user):
+    """Resumen corto de los permisos, para variar los fragmentos con botones."""
+    permisos = permisos_usuario(user)
+    return hashlib.md5('|'.join(sorted(permisos)).encode()).hexdigest()[:12] if permisos else 'anonimo'
+
+
+def contexto_cache(request):
+    """Context processor: 'perfil_cache' para las etiquetas {% cache %}."""
+    return {'perfil_cache': perfil_permisos(request.user)}
+
+
+# -------------------------------------------------------------------
+# Backend LRU en memoria del proceso
+# -------------------------------------------------------------------
+# Como LocMemCache, pero acotado también por tamaño (OPTIONS['MAX_BYTES'])
+# y expulsando siempre lo menos usado. Lleva contadores de aciertos,
+# fallos y expulsiones.
+
+_almacenes = {}
+_contadores = {}
+_locks = {}
+
+
+class LRUCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        opciones = params.get('OPTIONS', {})
+        self._max_bytes = int(opciones.get('MAX_BYTES', 64 * 1024 * 1024))
+        self._datos = _almacenes.setdefault(name, OrderedDict())
+        self._contadores = _contadores.setdefault(name, {'bytes': 0, 'aciertos': 0, 'fallos': 0, 'expulsiones': 0})
+        self._lock = _locks.setdefault(name, threading.Lock())
+
+    def _caducada(self, clave):
+        expira = self._datos[clave][1]
+        return expira is not None and expira <= time.time()
+
+    def _quitar(self, clave):
+        valor, _ = self._datos.pop(clave)
+        self._contadores['bytes'] -= len(valor)
+
+    def _guardar(self, clave, valor, timeout):
+        datos = pickle.dumps(valor, self.pickle_protocol)
+        if clave in self._datos:
+            self._quitar(clave)
+        self._datos[clave] = (datos, self.get_backend_timeout(timeout))
+        self._contadores['bytes'] += len(datos)
+        # Se expulsa por el principio (lo menos usado) hasta volver a los límites
+        while self._datos and (
+            len(self._datos) > self._max_entries or self._contadores['bytes'] > self._max_bytes
+        ):
+            self._quitar(next(iter(self._datos)))
+            self._contadores['expulsiones'] += 1
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        clave = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if clave in self._datos and not self._caducada(clave):
+                return False
+            self._guardar(clave, value, timeout)
+            return True
+
+    def get(self, key, default=None, version=None):
+        clave = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if clave not in self._datos or self._caducada(clave):
+                if clave in self._datos:
+                    self._quitar(clave)
+                self._contadores['fallos'] += 1
+                return default
+            self._datos.move_to_end(clave)
+            self._contadores['aciertos'] += 1
+            datos = self._datos[clave][0]
+        return pickle.loads(datos)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        clave = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            self._guardar(clave, value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        clave = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if clave not in self._datos or self._caducada(clave):
+                return False
+            self._datos[clave] = (self._datos[clave][0], self.get_backend_timeout(timeout))
+            return True
+
+    def delete(self, key, version=None):
+        clave = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if clave not in self._datos:
+                return False
+            self._quitar(clave)
+            return True
+
+    def has_key(self, key, version=None):
+        clave = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            return clave in self._datos and not self._caducada(clave)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+            self._contadores['bytes'] = 0
+
+    def estadisticas(self):
+        with self._lock:
+            return {'entradas': len(self._datos), **self._contadores}
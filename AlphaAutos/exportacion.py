@@ -0,0 +1,150 @@
+import csv
+import io
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .models import *
+from .paginacion import _bloques
+from .replicas import alias_lectura
+
+# -------------------------------------------------------------------
+# Exportación de ventas, coches, clientes y empleados (CSV / JSON)
+# -------------------------------------------------------------------
+# Las filas salen con values_list() (tuplas, sin instancias ni
+# select_related) y QuerySet.iterator(), y se envían por bloques con
+# StreamingHttpResponse: la memoria no depende del número de filas.
+# Con ?gzip=1 cada bloque se comprime según sale (fichero .gz).
+
+FILAS_POR_BLOQUE = 2000
+
+# tipo -> modelo, permiso necesario y columnas (cabecera, campo)
+EXPORTACIONES = {
+    'ventas': {
+        'modelo': Venta,
+        # Como lista_ventas: basta con iniciar sesión (el comprador solo ve lo suyo)
+        'permiso': None,
+        'columnas': [
+            ('id', 'id'),
+            ('fecha_venta', 'fecha_venta'),
+            ('comprador', 'comprador__usuario__username'),
+            ('coche_id', 'coche_id'),
+            ('marca', 'coche__marca__nombre'),
+            ('modelo', 'coche__modelo'),
+            ('precio_final', 'precio_final'),
+            ('metodo_pago', 'metodo_pago'),
+        ],
+    },
+    'coches': {
+        'modelo': Coche,
+        'permiso': 'AlphaAutos.view_coche',
+        'columnas': [
+            ('id', 'id'),
+            ('marca', 'marca__nombre'),
+            ('modelo', 'modelo'),
+            ('precio', 'precio'),
+            ('transmision', 'transmision'),
+            ('fecha_fabricacion', 'fecha_fabricacion'),
+            ('concesionario', 'concesionario__nombre'),
+            ('vendido', 'vendido'),
+        ],
+    },
+    'clientes': {
+        'modelo': Comprador,
+        'permiso': 'AlphaAutos.view_comprador',
+        'columnas': [
+            ('id', 'id'),
+            ('username', 'usuario__username'),
+            ('nombre', 'usuario__first_name'),
+            ('apellidos', 'usuario__last_name'),
+            ('email', 'usuario__email'),
+            ('telefono', 'telefono'),
+        ],
+    },
+    'empleados': {
+        'modelo': Empleado,
+        'permiso': 'AlphaAutos.view_empleado',
+        'columnas': [
+            ('id', 'id'),
+            ('nombre', 'nombre'),
+            ('puesto', 'puesto'),
+            ('salario', 'salario'),
+            ('fecha_contratacion', 'fecha_contratacion'),
+            ('concesionario', 'concesionario__nombre'),
+        ],
+    },
+}
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+}
+
+
+def filas(tipo, usuario):
+    """Tuplas a exportar de `tipo`, con el mismo filtro por rol que lista_ventas."""
+    exportacion = EXPORTACIONES[tipo]
+    # Las filas se leen ya fuera de la vista, mientras se envía la respuesta:
+    # la BD se fija ahora, que es cuando se sabe si toca la réplica
+    queryset = exportacion['modelo'].objects.using(alias_lectura())
+    if usuario.rol == Usuario.COMPRADOR:
+        if tipo == 'ventas':
+            queryset = queryset.filter(comprador__usuario=usuario)
+        elif tipo == 'clientes':
+            queryset = queryset.filter(usuario=usuario)
+    campos = [campo for _, campo in exportacion['columnas']]
+    return queryset.order_by('pk').values_list(*campos).iterator(chunk_size=FILAS_POR_BLOQUE)
+
+
+def _csv(cabeceras, tuplas):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    # BOM para que Excel lea bien las tildes
+    buffer.write('\ufeff')
+    escritor.writerow(cabeceras)
+    for bloque in _bloques(tuplas, FILAS_POR_BLOQUE):
+        escritor.writerows(bloque)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _json(cabeceras, tuplas):
+    # Un único array JSON que se va escribiendo objeto a objeto
+    codificador = DjangoJSONEncoder(ensure_ascii=False)
+    yield '['
+    separador = ''
+    for bloque in _bloques(tuplas, FILAS_POR_BLOQUE):
+        partes = []
+        for tupla in bloque:
+            partes.append(separador + codificador.encode(dict(zip(cabeceras, tupla))))
+            separador = ','
+        yield '\n'.join(partes)
+    yield ']'
+
+
+def _gzip(trozos):
+    # wbits=31: formato gzip (cabecera y CRC), no zlib en bruto
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for trozo in trozos:
+        comprimido = compresor.compress(trozo.encode())
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+
+def respuesta(tipo, formato, usuario, comprimir=False):
+    cabeceras = [cabecera for cabecera, _ in EXPORTACIONES[tipo]['columnas']]
+    generador = _csv if formato == 'csv' else _json
+    contenido = generador(cabeceras, filas(tipo, usuario))
+    nombre = f"{tipo}.{formato}"
+    if comprimir:
+        response = StreamingHttpResponse(_gzip(contenido), content_type='application/gzip')
+        nombre += '.gz'
+    else:
+        response = StreamingHttpResponse((trozo.encode() for trozo in contenido), content_type=FORMATOS[formato])
+    response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return response
@@ -1,11 +1,58 @@
 from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
 from django import forms
 from .models import *
 from datetime import datetime
 from django import forms
 from .models import *
+from django.db.models import Max, Min
 from django.forms import ModelForm
+from . import opciones
 from django.contrib.auth.forms import UserCreationForm
+from django.urls import reverse, reverse_lazy
+
+
+# -------------------------------------------------------------------
+# Autocompletado de los buscadores (AlphaAutos/autocompletar.py)
+# -------------------------------------------------------------------
+# script.js pide sugerencias a la URL de data-autocompletar mientras se escribe
+def autocompletado(tipo, attrs=None):
+    return forms.TextInput(attrs={
+        **(attrs or {}),
+        'data-autocompletar': reverse_lazy('AlphaAutos:autocompletar', args=[tipo]),
+        'autocomplete': 'off',
+    })
+
+
+# -------------------------------------------------------------------
+# Desplegables con búsqueda remota (AlphaAutos/opciones.py)
+# -------------------------------------------------------------------
+class SelectRemoto(forms.Select):
+    """
+    <select> de un ModelChoiceField que solo pinta la opción vacía y la
+    elegida. script.js trae las demás de /opciones/<relacion>/ al abrirlo.
+    """
+
+    def __init__(self, relacion, attrs=None):
+        super().__init__(attrs)
+        self.relacion = relacion
+
+    def get_context(self, name, value, attrs):
+        contexto = super().get_context(name, value, attrs)
+        contexto['widget']['attrs']['data-opciones'] = reverse('AlphaAutos:opciones', args=[self.relacion])
+        return contexto
+
+    def optgroups(self, name, value, attrs=None):
+        # Nada de recorrer el queryset: solo se busca lo elegido (un id, o ninguno)
+        campo = self.choices.field
+        opciones = [] if campo.empty_label is None else [('', campo.empty_label)]
+        ids = [valor for valor in value if valor and str(valor).isdigit()]
+        if ids:
+            opciones += [(objeto.pk, campo.label_from_instance(objeto)) for objeto in campo.queryset.filter(pk__in=ids)]
+        return [(None, [
+            self.create_option(name, valor, etiqueta, str(valor) in value, indice, attrs=attrs)
+            for indice, (valor, etiqueta) in enumerate(opciones)
+        ], 0)]
 
 # -------------------------------------------------------------------
 # Formulario de registro de usuario personalizado
@@ -37,29 +84,51 @@ class CocheModelForm(ModelForm):
                 attrs={'class': 'form-select d-inline w-auto'}
             ),
             'precio': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
-            'modelo': forms.TextInput(attrs={'class': 'form-control'})
+            'modelo': forms.TextInput(attrs={'class': 'form-control'}),
+            'marca': SelectRemoto('marca'),
+            'concesionario': SelectRemoto('concesionario'),
         }
         
     def clean(self):
-        precio = self.cleaned_data.get('precio')
-        fecha_fabricacion = self.cleaned_data.get('fecha_fabricacion')
-        
-        # Validar que el precio no sea negativo
-        if precio is not None and precio <= 0:
-            self.add_error('precio', 'El precio no puede ser negativo o 0.')
-            
-        # Validar que la fecha de fabricación no sea futura
-        if fecha_fabricacion is not None and fecha_fabricacion > datetime.now().date():
-            self.add_error('fecha_fabricacion', 'La fecha de fabricación no puede ser futura.')
+        errores = errores_coche(self.cleaned_data.get('precio'), self.cleaned_data.get('fecha_fabricacion'))
+        for campo, mensaje in errores.items():
+            self.add_error(campo, mensaje)
         return self.cleaned_data
-    
+
+
+def errores_coche(precio, fecha_fabricacion, hoy=None):
+    """
+    Reglas de negocio de un coche: {campo: mensaje}. Las usan CocheModelForm
+    y la importación de CSV (importacion.py), que pasa `hoy` una vez por lote.
+    """
+    errores = {}
+    # Validar que el precio no sea negativo
+    if precio is not None and precio <= 0:
+        errores['precio'] = 'El precio no puede ser negativo o 0.'
+
+    # Validar que la fecha de fabricación no sea futura
+    if fecha_fabricacion is not None and fecha_fabricacion > (hoy or datetime.now().date()):
+        errores['fecha_fabricacion'] = 'La fecha de fabricación no puede ser futura.'
+    return errores
+
+
+# Lo más alto que cabe en Coche.precio (max_digits=10) y en Empleado.salario (max_digits=8)
+PRECIO_MAXIMO = Decimal('99999999.99')
+SALARIO_MAXIMO = Decimal('999999.99')
+
+
+def importe_ajustado(importe, porcentaje):
+    """`importe` subido o bajado un `porcentaje`, redondeado como el ROUND() del UPDATE de masivo.py."""
+    return (importe * (1 + porcentaje / 100)).quantize(Decimal('0.01'), ROUND_HALF_UP)
+
+
 # -------------------------------------------------------------------
 # Crud_Coche
 # VISTA: Buscar un coche (CRUD - Read)
 # -------------------------------------------------------------------
 class CocheSearchForm(forms.Form):
-    marca = forms.CharField(required=False, label="Marca")
-    modelo = forms.CharField(required=False, label="Modelo")
+    marca = forms.CharField(required=False, label="Marca", widget=autocompletado('marca'))
+    modelo = forms.CharField(required=False, label="Modelo", widget=autocompletado('modelo'))
     precio_max = forms.DecimalField(required=False, min_value=0, label="Precio Máximo")
 
     def clean(self):
@@ -117,8 +186,8 @@ class ConcesionarioModelForm(ModelForm):
 # VISTA: Buscar un concesionario (CRUD - Create)
 # -------------------------------------------------------------------
 class ConcesionarioSearchForm(forms.Form):
-    nombre = forms.CharField(required=False, label="Nombre")
-    ciudad = forms.CharField(required=False, label="Ciudad")
+    nombre = forms.CharField(required=False, label="Nombre", widget=autocompletado('concesionario'))
+    ciudad = forms.CharField(required=False, label="Ciudad", widget=autocompletado('ciudad'))
     telefono = forms.CharField(required=False, label="Teléfono")
 
     def clean(self):
@@ -180,7 +249,7 @@ class MarcaModelForm(ModelForm):
 # VISTA: Buscar una marca (CRUD - Create)
 # -------------------------------------------------------------------
 class MarcaSearchForm(forms.Form):
-    nombre = forms.CharField(required=False, label="Nombre")
+    nombre = forms.CharField(required=False, label="Nombre", widget=autocompletado('marca'))
     pais_origen = forms.CharField(required=False, label="País de Origen")
     anio_fundacion = forms.IntegerField(required=False, min_value=1900, max_value=datetime.now().year, label="anio de Fundación")
 
@@ -222,7 +291,8 @@ class EmpleadoModelForm(ModelForm):
              'fecha_contratacion': forms.SelectDateWidget(
                 years=range(2000, datetime.now().year + 10),
                 attrs={'class': 'form-select d-inline w-auto'}
-            )
+            ),
+            'concesionario': SelectRemoto('concesionario'),
         }
         
     def clean(self):
@@ -246,7 +316,10 @@ class EmpleadoModelForm(ModelForm):
 class EmpleadoSearchForm(forms.Form):
     nombre = forms.CharField(required=False, label="Nombre")
     puesto = forms.CharField(required=False, label="Puesto")
-    concesionario = forms.ModelChoiceField(queryset=Concesionario.objects.all(), required=False, label="Concesionario")
+    concesionario = forms.ModelChoiceField(
+        queryset=Concesionario.objects.all(), required=False, label="Concesionario",
+        widget=SelectRemoto('concesionario'),
+    )
 
     def clean(self):
         cleaned = super().clean()
@@ -364,7 +437,7 @@ class CompradorEditForm(forms.ModelForm):
 # - email: campo de texto para buscar por email
 # Valida que al menos uno de los campos tenga valor y que el teléfono sea numérico si se proporciona.
 class CompradorSearchForm(forms.Form):
-    usuario = forms.CharField(required=False, label="Usuario")
+    usuario = forms.CharField(required=False, label="Usuario", widget=autocompletado('usuario'))
     telefono = forms.CharField(required=False, label="Teléfono")
     email = forms.CharField(required=False, label="Email")
     def clean(self):
@@ -414,6 +487,11 @@ class AseguradoraModelForm(ModelForm):
     class Meta:
         model = Aseguradora
         fields = ['nombre', 'pais', 'telefono', 'web', 'seguros']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Seguro.__str__ usa el modelo del coche: lo traemos en la misma consulta
+        self.fields['seguros'].queryset = Seguro.objects.select_related('coche')
         
     def clean(self):
         telefono = self.cleaned_data.get('telefono')
@@ -466,13 +544,15 @@ class VentaModelForm(ModelForm):
     class Meta:
         model = Venta
         # Definimos los campos (recordamos que 'comprador' lo gestionamos dinámicamente abajo)
-        fields = ['comprador', 'coche', 'fecha_venta', 'metodo_pago'] 
+        fields = ['comprador', 'coche', 'fecha_venta', 'metodo_pago', 'anulada'] 
         widgets = {
              'fecha_venta': forms.SelectDateWidget(
                 years=range(2000, datetime.now().year + 1),
                 attrs={'class': 'form-select d-inline w-auto'}
             ),
-            'metodo_pago': forms.TextInput(attrs={'class': 'form-control'})
+            'metodo_pago': forms.TextInput(attrs={'class': 'form-control'}),
+            'coche': SelectRemoto('coche_venta'),
+            'comprador': SelectRemoto('comprador'),
         }
     
     def __init__(self, *args, **kwargs):
@@ -480,17 +560,23 @@ class VentaModelForm(ModelForm):
         self.user = kwargs.pop('request')
         super(VentaModelForm, self).__init__(*args, **kwargs)
         
-        if self.user and self.user.is_superuser:
-            # Si es ADMIN: Puede ver TODOS los coches en el select (Vendido o no)
-            self.fields['coche'].queryset = Coche.objects.all()
-        else:
-            # Si es USUARIO NORMAL: Solo ve coches DISPONIBLES (venta__isnull=True)
-            self.fields['coche'].queryset = Coche.objects.filter(venta__isnull=True)
+        # Los mismos querysets que /opciones/ (opciones.py): ADMIN, todos los coches (vendidos o no);
+        # USUARIO NORMAL, solo los DISPONIBLES, sin reserva de otro (y, al editar, el de la propia venta)
+        coches = opciones.RELACIONES['coche_venta'].consulta(self.user)
+        if self.instance.pk and not (self.user and self.user.is_superuser):
+            coches |= Coche.objects.filter(pk=self.instance.coche_id)
+        self.fields['coche'].queryset = coches
+        if 'comprador' in self.fields:
+            self.fields['comprador'].queryset = opciones.RELACIONES['comprador'].consulta(self.user)
 
         # LSi es COMPRADOR, borramos el campo 'comprador' para que no pueda elegir
         if self.user and self.user.rol == Usuario.COMPRADOR:
             if 'comprador' in self.fields:
                 del self.fields['comprador'] 
+
+        # Anular solo tiene sentido al editar una venta que ya existe
+        if not self.instance.pk:
+            del self.fields['anulada']
     
     def clean(self):
         fecha_venta = self.cleaned_data.get('fecha_venta')
@@ -506,14 +592,14 @@ class VentaSearchForm(forms.Form):
     coche = forms.CharField(
         required=False, 
         label="Modelo de coche", 
-        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Ej: Corolla'})
+        widget=autocompletado('modelo', {'class': 'form-control', 'placeholder': 'Ej: Corolla'})
     )
     
     # Este campo lo ocultaremos dinámicamente
     comprador = forms.CharField(
         required=False, 
         label="Nombre del comprador", 
-        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Ej: Juan'})
+        widget=autocompletado('usuario', {'class': 'form-control', 'placeholder': 'Ej: Juan'})
     )
     
     metodo_pago = forms.CharField(
@@ -532,3 +618,243 @@ class VentaSearchForm(forms.Form):
             if 'comprador' in self.fields:
                 del self.fields['comprador']
         
+
+# -------------------------------------------------------------------
+# VISTA: Resumen de ventas (filtro por fechas y agrupación)
+# -------------------------------------------------------------------
+class ResumenVentasForm(forms.Form):
+    AGRUPACIONES = (
+        ('', 'Sin desglose'),
+        ('dia', 'Por día'),
+        ('mes', 'Por mes'),
+        ('concesionario', 'Por concesionario'),
+        ('marca', 'Por marca'),
+        ('metodo_pago', 'Por método de pago'),
+    )
+    desde = forms.DateField(
+        required=False, label="Desde",
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    hasta = forms.DateField(
+        required=False, label="Hasta",
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    agrupar = forms.ChoiceField(
+        required=False, label="Agrupar", choices=AGRUPACIONES,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+    def clean(self):
+        desde = self.cleaned_data.get('desde')
+        hasta = self.cleaned_data.get('hasta')
+        if desde and hasta and desde > hasta:
+            self.add_error('hasta', 'La fecha final no puede ser anterior a la inicial.')
+        return self.cleaned_data
+
+# -------------------------------------------------------------------
+# Crud_Coche
+# VISTA: Importar coches desde CSV
+# -------------------------------------------------------------------
+class ImportarCochesForm(forms.Form):
+    DELIMITADORES = (
+        (',', 'Coma (,)'),
+        (';', 'Punto y coma (;)'),
+    )
+    fichero = forms.FileField(
+        label="Fichero CSV",
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,text/csv'})
+    )
+    delimitador = forms.ChoiceField(
+        label="Separador", choices=DELIMITADORES,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    simular = forms.BooleanField(required=False, label="Solo validar (no guardar nada)")
+
+# -------------------------------------------------------------------
+# VISTA: Operaciones masivas (masivo.py)
+# -------------------------------------------------------------------
+# La selección son los ids marcados en el listado y/o unos filtros. Si no
+# hay ni ids ni filtros no se hace nada (nunca "toda la tabla" sin querer).
+class MasivoForm(forms.Form):
+    ACCIONES = ()
+    ids = forms.CharField(required=False, widget=forms.HiddenInput)
+    accion = forms.ChoiceField(label="Acción", widget=forms.Select(attrs={'class': 'form-select'}))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['accion'].choices = self.ACCIONES
+
+    def clean_ids(self):
+        texto = self.cleaned_data.get('ids') or ''
+        try:
+            return [int(pk) for pk in texto.split(',') if pk.strip()]
+        except ValueError:
+            raise forms.ValidationError('Selección no válida.')
+
+    def filtros(self):
+        """{lookup: valor} de los filtros rellenos (los define cada subclase)."""
+        return {}
+
+    def clean(self):
+        cleaned = super().clean()
+        if not cleaned.get('ids') and not self.filtros():
+            raise forms.ValidationError('Marca elementos en el listado o elige al menos un filtro.')
+        return cleaned
+
+    def seleccion(self, queryset):
+        if self.cleaned_data['ids']:
+            queryset = queryset.filter(pk__in=self.cleaned_data['ids'])
+        return queryset.filter(**self.filtros())
+
+    def requerir(self, *campos):
+        for campo in campos:
+            if self.cleaned_data.get(campo) in (None, ''):
+                self.add_error(campo, 'Este campo es obligatorio para esta acción.')
+
+
+class CochesMasivoForm(MasivoForm):
+    ACCIONES = (
+        ('ajustar_precio', 'Subir/bajar el precio un porcentaje'),
+        ('fijar_precio', 'Fijar el precio'),
+        ('cambiar_concesionario', 'Cambiar de concesionario'),
+        ('eliminar', 'Eliminar'),
+    )
+    marca = forms.ModelChoiceField(
+        queryset=Marca.objects.all(), required=False, label="Filtrar por marca",
+        widget=SelectRemoto('marca', attrs={'class': 'form-select'})
+    )
+    concesionario = forms.ModelChoiceField(
+        queryset=Concesionario.objects.all(), required=False, label="Filtrar por concesionario",
+        widget=SelectRemoto('concesionario', attrs={'class': 'form-select'})
+    )
+    porcentaje = forms.DecimalField(
+        required=False, label="Porcentaje", min_value=-99, max_value=1000, decimal_places=2,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+    precio = forms.DecimalField(
+        required=False, label="Precio", max_digits=10, decimal_places=2,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+    nuevo_concesionario = forms.ModelChoiceField(
+        queryset=Concesionario.objects.all(), required=False, label="Nuevo concesionario",
+        widget=SelectRemoto('concesionario', attrs={'class': 'form-select'})
+    )
+
+    def filtros(self):
+        filtros = {}
+        if self.cleaned_data.get('marca'):
+            filtros['marca'] = self.cleaned_data['marca']
+        if self.cleaned_data.get('concesionario'):
+            filtros['concesionario'] = self.cleaned_data['concesionario']
+        return filtros
+
+    def clean(self):
+        cleaned = super().clean()
+        accion = cleaned.get('accion')
+        if accion == 'ajustar_precio':
+            self.requerir('porcentaje')
+            if cleaned.get('porcentaje') is not None and 'ids' in cleaned:
+                self.validar_ajuste(cleaned['porcentaje'])
+        elif accion == 'fijar_precio':
+            self.requerir('precio')
+            # Mismas reglas que CocheModelForm
+            for campo, mensaje in errores_coche(cleaned.get('precio'), None).items():
+                self.add_error(campo, mensaje)
+        elif accion == 'cambiar_concesionario':
+            self.requerir('nuevo_concesionario')
+        return cleaned
+
+    def validar_ajuste(self, porcentaje):
+        # Mismas reglas que CocheModelForm para el coche más barato y el más caro de la selección
+        rango = self.seleccion(Coche.objects.all()).aggregate(minimo=Min('precio'), maximo=Max('precio'))
+        if rango['minimo'] is None:
+            return
+        minimo = importe_ajustado(rango['minimo'], porcentaje)
+        for mensaje in errores_coche(minimo, None).values():
+            self.add_error('porcentaje', f"El coche más barato ({rango['minimo']} €) quedaría a {minimo} €. {mensaje}")
+        maximo = importe_ajustado(rango['maximo'], porcentaje)
+        if maximo > PRECIO_MAXIMO:
+            self.add_error('porcentaje', f"El coche más caro ({rango['maximo']} €) pasaría del precio máximo ({PRECIO_MAXIMO} €).")
+
+
+class EmpleadosMasivoForm(MasivoForm):
+    ACCIONES = (
+        ('cambiar', 'Cambiar puesto y/o salario'),
+        ('eliminar', 'Eliminar'),
+    )
+    concesionario = forms.ModelChoiceField(
+        queryset=Concesionario.objects.all(), required=False, label="Filtrar por concesionario",
+        widget=SelectRemoto('concesionario', attrs={'class': 'form-select'})
+    )
+    filtro_puesto = forms.CharField(
+        required=False, label="Filtrar por puesto",
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+    puesto = forms.CharField(
+        required=False, label="Nuevo puesto", max_length=100,
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+    salario = forms.DecimalField(
+        required=False, label="Nuevo salario", min_value=0, max_digits=8, decimal_places=2,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+    porcentaje = forms.DecimalField(
+        required=False, label="o ajustar el salario un porcentaje", min_value=-99, max_value=1000, decimal_places=2,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+
+    def filtros(self):
+        filtros = {}
+        if self.cleaned_data.get('concesionario'):
+            filtros['concesionario'] = self.cleaned_data['concesionario']
+        if self.cleaned_data.get('filtro_puesto'):
+            filtros['puesto__iexact'] = self.cleaned_data['filtro_puesto'].strip()
+        return filtros
+
+    def clean(self):
+        cleaned = super().clean()
+        if cleaned.get('accion') == 'cambiar':
+            if not cleaned.get('puesto') and cleaned.get('salario') is None and cleaned.get('porcentaje') is None:
+                self.add_error('puesto', 'Indica un puesto, un salario o un porcentaje.')
+            if cleaned.get('salario') is not None and cleaned.get('porcentaje') is not None:
+                self.add_error('porcentaje', 'Indica el salario o el porcentaje, no los dos.')
+            # Mismas reglas que EmpleadoModelForm
+            if cleaned.get('salario') is not None and cleaned['salario'] <= 0:
+                self.add_error('salario', 'El salario no puede ser negativo o 0.')
+            elif cleaned.get('porcentaje') is not None and 'ids' in cleaned:
+                self.validar_ajuste(cleaned['porcentaje'])
+        return cleaned
+
+    def validar_ajuste(self, porcentaje):
+        # Mismas reglas que EmpleadoModelForm para el salario más bajo y el más alto de la selección
+        rango = self.seleccion(Empleado.objects.all()).aggregate(minimo=Min('salario'), maximo=Max('salario'))
+        if rango['minimo'] is None:
+            return
+        minimo = importe_ajustado(rango['minimo'], porcentaje)
+        if minimo <= 0:
+            self.add_error('porcentaje', f"El salario más bajo ({rango['minimo']} €) quedaría a {minimo} €. El salario no puede ser negativo o 0.")
+        maximo = importe_ajustado(rango['maximo'], porcentaje)
+        if maximo > SALARIO_MAXIMO:
+            self.add_error('porcentaje', f"El salario más alto ({rango['maximo']} €) pasaría del salario máximo ({SALARIO_MAXIMO} €).")
+
+
+class VentasMasivoForm(MasivoForm):
+    ACCIONES = (
+        ('eliminar', 'Eliminar'),
+    )
+    metodo_pago = forms.CharField(
+        required=False, label="Filtrar por método de pago",
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+    hasta = forms.DateField(
+        required=False, label="Vendidas hasta",
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+
+    def filtros(self):
+        filtros = {}
+        if self.cleaned_data.get('metodo_pago'):
+            filtros['metodo_pago__iexact'] = self.cleaned_data['metodo_pago'].strip()
+        if self.cleaned_data.get('hasta'):
+            filtros['fecha_venta__lte'] = self.cleaned_data['hasta']
+        return filtros
@@ -0,0 +1,164 @@
+import random
+import zlib
+
+from faker import Faker
+
+# -------------------------------------------------------------------
+# Generación de filas para el comando generar_datos
+# -------------------------------------------------------------------
+# Este módulo se ejecuta en los procesos del pool, por eso no importa
+# nada de Django: en Windows los procesos se arrancan de cero y no
+# tienen la configuración cargada.
+#
+# Cada función devuelve diccionarios de campos. Las claves foráneas se
+# devuelven como índice (p. ej. 'marca_idx') y el proceso principal las
+# traduce al id real, así los procesos no necesitan la base de datos.
+
+PUESTOS = ['Vendedor', 'Mecánico', 'Gerente', 'Administrativo']
+METODOS_PAGO = ['Transferencia', 'Efectivo', 'Financiación', 'Tarjeta']
+TIPOS_SEGURO = ['Básico', 'Completo', 'Premium']
+
+
+
+def _fila_concesionario(fake, rnd, i, total):
+    return {
+        'nombre': f"Concesionario {fake.company()}"[:100],
+        'direccion': fake.address(),
+        'telefono': fake.msisdn()[:9],
+        'ciudad': fake.city()[:50],
+    }
+
+
+def _fila_marca(fake, rnd, i, total):
+    return {
+        'nombre': fake.company()[:50],
+        'pais_origen': fake.country()[:50],
+        'anio_fundacion': rnd.randint(1950, 2020),
+        'descripcion': fake.text(100),
+    }
+
+
+def _fila_aseguradora(fake, rnd, i, total):
+    return {
+        'nombre': fake.company()[:100],
+        'pais': fake.country()[:50],
+        'telefono': fake.msisdn()[:9],
+        'web': f"www.{fake.domain_name()}"[:100],
+    }
+
+
+def _fila_coche(fake, rnd, i, total):
+    return {
+        'marca_idx': rnd.randrange(total['marca']),
+        'concesionario_idx': rnd.randrange(total['concesionario']),
+        'modelo': fake.word().capitalize(),
+        'precio': round(rnd.uniform(8000, 60000), 2),
+        'transmision': rnd.choice(['MT', 'AT']),
+        'fecha_fabricacion': fake.date_between(start_date='-5y', end_date='today'),
+    }
+
+
+def _fila_empleado(fake, rnd, i, total):
+    return {
+        'concesionario_idx': rnd.randrange(total['concesionario']),
+        'nombre': fake.name()[:100],
+        'puesto': rnd.choice(PUESTOS),
+        'salario': round(rnd.uniform(1200, 3000), 2),
+        'fecha_contratacion': fake.date_between(start_date='-10y', end_date='today'),
+    }
+
+
+def _fila_usuario(fake, rnd, i, total):
+    # El sufijo con el índice global garantiza que el username sea único
+    return {
+        'username': f"{fake.user_name()[:130]}_{i}",
+        'email': fake.email(),
+        'first_name': fake.first_name()[:150],
+        'last_name': fake.last_name()[:150],
+    }
+
+
+def _fila_comprador(fake, rnd, i, total):
+    return {
+        'usuario_idx': i,
+        'telefono': fake.msisdn()[:9],
+    }
+
+
+def _fila_datos_cliente(fake, rnd, i, total):
+    letras = 'TRWAGMYFPDXBNJZSQVHLCKE'
+    return {
+        'comprador_idx': i,
+        'direccion': fake.address(),
+        'dni': f"{i:08d}{letras[i % 23]}",
+        'puntos_fidelidad': round(rnd.uniform(0, 100), 2),
+    }
+
+
+def _fila_seguro(fake, rnd, i, total):
+    return {
+        'coche_idx': i,
+        'tipo_seguro': rnd.choice(TIPOS_SEGURO),
+        'precio_mensual': round(rnd.uniform(30, 200), 2),
+        'duracion': rnd.randint(6, 36),
+    }
+
+
+def _fila_mantenimiento(fake, rnd, i, total):
+    return {
+        'fecha_revision': fake.date_between(start_date='-2y', end_date='today'),
+        'kilometros': rnd.randint(5000, 120000),
+        'comentarios': fake.sentence(),
+        'coste': round(rnd.uniform(100, 1000), 2),
+    }
+
+
+def _fila_venta(fake, rnd, i, total):
+    # Un coche solo puede tener una venta activa: las primeras se reparten una por
+    # coche (la mitad queda vendida) y el resto son ventas anuladas de cualquier coche
+    activa = i < total['coche'] // 2
+    return {
+        'comprador_idx': rnd.randrange(total['comprador']),
+        'coche_idx': i if activa else rnd.randrange(total['coche']),
+        'fecha_venta': fake.date_between(start_date='-2y', end_date='today'),
+        'precio_final': round(rnd.uniform(9000, 50000), 2),
+        'metodo_pago': rnd.choice(METODOS_PAGO),
+        'anulada': not activa,
+    }
+
+
+def _fila_aseguradora_seguros(fake, rnd, i, total):
+    return {
+        'aseguradora_idx': rnd.randrange(total['aseguradora']),
+        'seguro_idx': i,
+    }
+
+
+def _fila_mantenimiento_coches(fake, rnd, i, total):
+    # Cada mantenimiento se hace a un coche; los coches se reparten sin repetir pares
+    return {
+        'mantenimiento_idx': i,
+        'coche_idx': (i * 7919) % total['coche'],
+    }
+
+
+GENERADORES = {
+    nombre[len('_fila_'):]: funcion
+    for nombre, funcion in list(globals().items()) if nombre.startswith('_fila_')
+}
+
+_fake = None
+
+
+def iniciar_proceso():
+    global _fake
+    _fake = Faker('es_ES')
+
+
+def generar_lote(nombre, inicio, cantidad, semilla, total):
+    """Genera las filas [inicio, inicio + cantidad) de un modelo de forma determinista."""
+    semilla_lote = zlib.crc32(f"{semilla}:{nombre}:{inicio}".encode())
+    _fake.seed_instance(semilla_lote)
+    rnd = random.Random(semilla_lote)
+    generador = GENERADORES[nombre]
+    return [generador(_fake, rnd, i, total) for i in range(inicio, inicio + cantidad)]
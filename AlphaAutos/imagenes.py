@@ -0,0 +1,264 @@
+import io
+import logging
+import os
+import posixpath
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from PIL import Image, ImageOps
+
+from .almacen import almacen_imagenes
+from .cache import invalidar
+from .models import ArchivoImagen, Coche
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Rendiciones de Coche.imagen
+# -------------------------------------------------------------------
+# Las plantillas servían el original subido (hay PNG de más de 1 MB).
+# Cada imagen tiene ahora versiones WebP redimensionadas, guardadas junto
+# al original en 'rendiciones/<ruta sin extensión>_<nombre>.webp'.
+#
+# Se generan con Pillow en un pool de hilos del propio proceso, fuera de
+# la petición de crear_coche/editar_coche (se encolan al confirmarse la
+# transacción). Al terminar, el hilo apunta en Coche.imagen_rendida de
+# los coches con esa imagen que ya tiene rendiciones; hasta entonces el
+# filtro |rendicion devuelve el original. Así el filtro no pregunta al
+# almacenamiento (un stat en disco, o una petición HEAD en S3) por cada
+# fila de un listado. Para las imágenes ya subidas: manage.py generar_rendiciones
+
+# nombre -> (ancho máximo, alto máximo, calidad WebP)
+RENDICIONES = {
+    'miniatura': (160, 120, 70),
+    'grande': (1200, 900, 82),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _obtener_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            hilos = getattr(settings, 'ALPHAAUTOS_IMAGENES_HILOS', 2)
+            _pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='rendiciones')
+        return _pool
+
+
+def ruta_rendicion(nombre, rendicion):
+    base, _ = os.path.splitext(nombre)
+    return f"rendiciones/{base}_{rendicion}.webp"
+
+
+def generar_rendiciones(nombre, forzar=False, storage=default_storage):
+    """Crea (o rehace con `forzar`) las rendiciones de la imagen `nombre`. Devuelve cuántas ha escrito."""
+    pendientes = [
+        rendicion for rendicion in RENDICIONES
+        if forzar or not storage.exists(ruta_rendicion(nombre, rendicion))
+    ]
+    if not pendientes:
+        return 0
+
+    with almacen_imagenes().open(nombre, 'rb') as fichero:
+        original = Image.open(fichero)
+        # Respeta la orientación EXIF de las fotos de móvil
+        original = ImageOps.exif_transpose(original)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'A' in original.getbands() else 'RGB')
+
+    for rendicion in pendientes:
+        ancho, alto, calidad = RENDICIONES[rendicion]
+        imagen = original.copy()
+        imagen.thumbnail((ancho, alto), Image.LANCZOS)
+        contenido = io.BytesIO()
+        imagen.save(contenido, 'WEBP', quality=calidad, method=4)
+        ruta = ruta_rendicion(nombre, rendicion)
+        if storage.exists(ruta):
+            storage.delete(ruta)
+        storage.save(ruta, ContentFile(contenido.getvalue()))
+    return len(pendientes)
+
+
+def marcar_rendida(nombre):
+    """Apunta que los coches con la imagen `nombre` ya tienen rendiciones. Devuelve cuántos cambian."""
+    return Coche.objects.filter(imagen=nombre).exclude(imagen_rendida=nombre).update(imagen_rendida=nombre)
+
+
+def _tarea(nombre, tokens):
+    try:
+        generar_rendiciones(nombre)
+        marcados = marcar_rendida(nombre)
+    except Exception:
+        logger.exception("No se han podido generar las rendiciones de %s", nombre)
+        return
+    finally:
+        if getattr(settings, 'ALPHAAUTOS_IMAGENES_HILOS', 2) > 0:
+            # La conexión de este hilo del pool
+            connections.close_all()
+    if marcados:
+        # Las páginas cacheadas con el original pasan a usar las rendiciones
+        invalidar(*tokens)
+
+
+def _lanzar(nombre, tokens):
+    if getattr(settings, 'ALPHAAUTOS_IMAGENES_HILOS', 2) <= 0:
+        # Sin hilos (tests, depuración): en el propio proceso de la petición
+        _tarea(nombre, tokens)
+    else:
+        _obtener_pool().submit(_tarea, nombre, tokens)
+
+
+def encolar(nombre, tokens=()):
+    """Genera las rendiciones en segundo plano cuando se confirme la transacción actual."""
+    if nombre:
+        transaction.on_commit(lambda: _lanzar(nombre, list(tokens)))
+
+
+def url_rendicion(imagen, rendicion, storage=default_storage):
+    """URL de la rendición si ya está generada (según su Coche); si no, la del original."""
+    if not imagen:
+        return ''
+    if getattr(imagen.instance, 'imagen_rendida', None) == imagen.name:
+        return storage.url(ruta_rendicion(imagen.name, rendicion))
+    return imagen.url
+
+
+def eliminar_rendiciones(nombre, storage=default_storage):
+    for rendicion in RENDICIONES:
+        ruta = ruta_rendicion(nombre, rendicion)
+        if storage.exists(ruta):
+            storage.delete(ruta)
+
+
+# -------------------------------------------------------------------
+# Referencias a los ficheros de imagen
+# -------------------------------------------------------------------
+# Con el almacenamiento por contenido (almacen.py) varios coches pueden
+# compartir fichero. ArchivoImagen cuenta cuántos lo usan: la subida
+# (almacen.py) suma la del coche que la sube y las señales de Coche suman
+# y restan al asignar otra imagen o borrar. Cuando un
+# fichero se queda a 0 se borra, junto con sus rendiciones, al confirmarse
+# la transacción. Para recontar y limpiar a mano: manage.py recolectar_imagenes
+
+def sumar_referencia(nombre):
+    if not nombre:
+        return
+    if ArchivoImagen.objects.filter(nombre=nombre).update(referencias=F('referencias') + 1):
+        return
+    try:
+        with transaction.atomic():
+            ArchivoImagen.objects.create(nombre=nombre, referencias=1)
+    except IntegrityError:
+        # Otra petición ha creado la fila entre medias
+        sumar_referencia(nombre)
+
+
+def quitar_referencia(nombre, veces=1):
+    if not nombre:
+        return
+    ArchivoImagen.objects.filter(nombre=nombre, referencias__gt=0).update(
+        referencias=Greatest(F('referencias') - veces, 0)
+    )
+    transaction.on_commit(lambda: recolectar([nombre]))
+
+
+def recolectar(nombres):
+    """Borra los ficheros de `nombres` que ya no usa ningún coche. Devuelve cuántos ha borrado."""
+    almacen = almacen_imagenes()
+    borrados = 0
+    for nombre in nombres:
+        # Solo quien borra la fila con 0 referencias borra el fichero. El DELETE deja la
+        # fila bloqueada hasta el final del atomic: una subida del mismo contenido
+        # (sumar_referencia en almacen.py) espera a que el fichero ya no esté y lo vuelve a
+        # escribir; si la subida ha llegado antes, ya no hay fila con 0 y no se borra nada
+        with transaction.atomic():
+            if not ArchivoImagen.objects.filter(nombre=nombre, referencias=0).delete()[0]:
+                continue
+            if almacen.exists(nombre):
+                almacen.delete(nombre)
+            eliminar_rendiciones(nombre)
+        borrados += 1
+    return borrados
+
+
+# Nombres que ya siguen el esquema de almacen.py: <dir>/<ab>/<sha256>.<ext>
+_NOMBRE_CONTENIDO = re.compile(r'(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}(\.\w+)?$')
+
+
+def es_nombre_contenido(nombre):
+    return bool(_NOMBRE_CONTENIDO.search(nombre))
+
+
+def _referencias_coches():
+    filas = (
+        Coche.objects.exclude(imagen='').exclude(imagen__isnull=True)
+        .values_list('imagen').order_by().annotate(total=Count('id'))
+    )
+    return dict(filas)
+
+
+def migrar_antiguas():
+    """Pasa las imágenes subidas antes del almacenamiento por contenido a su nombre por hash."""
+    almacen = almacen_imagenes()
+    migradas = 0
+    for nombre in list(_referencias_coches()):
+        if es_nombre_contenido(nombre) or not almacen.exists(nombre):
+            continue
+        with almacen.open(nombre, 'rb') as fichero:
+            nuevo = almacen.save(nombre, fichero)
+        Coche.objects.filter(imagen=nombre).update(imagen=nuevo)
+        migradas += 1
+    return migradas
+
+
+def recontar():
+    """Rehace ArchivoImagen desde Coche. Devuelve los nombres que se han quedado a 0."""
+    referencias = _referencias_coches()
+    existentes = {archivo.nombre: archivo for archivo in ArchivoImagen.objects.all()}
+    cambiados = []
+    for nombre, archivo in existentes.items():
+        total = referencias.get(nombre, 0)
+        if archivo.referencias != total:
+            archivo.referencias = total
+            cambiados.append(archivo)
+    ArchivoImagen.objects.bulk_update(cambiados, ['referencias'], batch_size=2000)
+    ArchivoImagen.objects.bulk_create([
+        ArchivoImagen(nombre=nombre, referencias=total)
+        for nombre, total in referencias.items() if nombre not in existentes
+    ], batch_size=2000)
+    return [nombre for nombre, archivo in existentes.items() if not referencias.get(nombre)]
+
+
+def _recorrer(almacen, directorio):
+    if not almacen.exists(directorio):
+        return
+    subdirectorios, ficheros = almacen.listdir(directorio)
+    for fichero in ficheros:
+        yield posixpath.join(directorio, fichero)
+    for subdirectorio in subdirectorios:
+        yield from _recorrer(almacen, posixpath.join(directorio, subdirectorio))
+
+
+def huerfanos(directorio='coches'):
+    """Ficheros de imagen y de rendición en disco que no usa ningún coche."""
+    # También los que tienen referencias sin coche aún: subidas cuyo coche no se ha guardado
+    usados = set(_referencias_coches()) | set(
+        ArchivoImagen.objects.filter(referencias__gt=0).values_list('nombre', flat=True)
+    )
+    bases = {os.path.splitext(nombre)[0] for nombre in usados}
+    originales = [nombre for nombre in _recorrer(almacen_imagenes(), directorio) if nombre not in usados]
+    rendiciones = [
+        nombre for nombre in _recorrer(default_storage, f"rendiciones/{directorio}")
+        if nombre[len('rendiciones/'):].rsplit('_', 1)[0] not in bases
+    ]
+    return originales, rendiciones
@@ -0,0 +1,84 @@
+import os
+
+from django.conf import settings
+from django.template.backends.jinja2 import Jinja2
+from django.template.defaultfilters import floatformat, title
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.formats import localize
+from django.utils.timezone import template_localtime
+from jinja2 import ChainableUndefined, Environment, FileSystemBytecodeCache
+
+from .metricas import MedirPlantillas
+from .templatetags.filas import partes_url
+from .templatetags.imagenes import rendicion
+
+# -------------------------------------------------------------------
+# Jinja2 para los listados y resultados de búsqueda más pesados
+# -------------------------------------------------------------------
+# Opcional: si jinja2 está instalado, settings.py añade el motor 'jinja2'
+# y, con ALPHAAUTOS_JINJA2=1, las vistas de coche_list, lista_ventas,
+# lista_clientes, lista_empleados y los *_busqueda.html renderizan las
+# plantillas de AlphaAutos/jinja2/ en vez de las de templates/. Las demás
+# páginas siguen con DjangoTemplates. manage.py comparar_plantillas mide
+# los dos motores con las mismas filas.
+#
+# Jinja2 compila cada plantilla a una función de Python (y guarda ese
+# código en ALPHAAUTOS_JINJA2_BYTECODE para no recompilar al arrancar),
+# así que un bucle de 10.000 filas es un bucle de Python, sin un nodo
+# por cada {{ }}. Lo que en Django es una etiqueta aquí es una función:
+#
+#   {% url 'a' x %}             -> {{ url('a', x) }}
+#   {% url 'a' fila.id %} x N   -> {% set ver = ruta_con_id('a') %} ... {{ ver(fila.id) }}
+#   {% static 'x' %}            -> {{ static('x') }}
+#   {% csrf_token %}            -> {{ csrf_input }}
+#   {% bootstrap_css %}...      -> {{ bootstrap_css() }} (extensión de django-bootstrap5)
+#   perms.AlphaAutos.view_coche -> igual (PermWrapper responde a [] y Jinja2 lo prueba)
+#
+# Para que salga lo mismo que con Django: cada {{ }} pasa por localize()
+# (fechas y decimales en español) y lo que no existe da '' en lugar de error.
+
+
+def ruta_con_id(ruta):
+    """Función id -> URL de `ruta`: reverse() una vez por render en lugar de una por fila."""
+    prefijo, sufijo = partes_url(ruta)
+    return lambda id: f"{prefijo}{id}{sufijo}"
+
+
+def url(ruta, *args, **kwargs):
+    return reverse(ruta, args=args or None, kwargs=kwargs or None)
+
+
+def _como_django(valor):
+    # Lo que hace Django con cada {{ }} antes de escaparlo (render_value_in_context)
+    return localize(template_localtime(valor))
+
+
+def entorno(**opciones):
+    """Environment de settings.TEMPLATES['jinja2']['OPTIONS']['environment']."""
+    opciones.setdefault('extensions', []).append('django_bootstrap5.jinja2.BootstrapTags')
+    opciones['undefined'] = ChainableUndefined
+    opciones['finalize'] = _como_django
+    directorio = settings.ALPHAAUTOS_JINJA2_BYTECODE
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+        opciones['bytecode_cache'] = FileSystemBytecodeCache(directorio)
+    env = Environment(**opciones)
+    env.globals.update({
+        'url': url,
+        'ruta_con_id': ruta_con_id,
+        'static': static,
+        'now': timezone.now,
+    })
+    env.filters.update({
+        'floatformat': floatformat,
+        # El title de Django no pone en mayúscula lo que va tras un apóstrofo o un número
+        'title': title,
+        'rendicion': rendicion,
+    })
+    return env
+
+
+class PlantillasJinja(MedirPlantillas, Jinja2):
+    """Jinja2 con el tiempo de render en las métricas por vista (metricas.py)."""
@@ -0,0 +1,145 @@
+import json
+import os
+import platform
+from datetime import datetime
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from AlphaAutos import bd, benchmark
+from AlphaAutos.models import Usuario
+
+# -------------------------------------------------------------------
+# Benchmark reproducible de las vistas principales
+# -------------------------------------------------------------------
+# Crea una BD de pruebas aparte (la de desarrollo no se toca), la llena
+# con generar_datos (misma --escala y --semilla = mismos datos) y mide
+# los escenarios de AlphaAutos/benchmark.py con el Client de Django y
+# contra un servidor HTTP local con hilos.
+#
+#   manage.py benchmark --escala 20 --salida base.json
+#   manage.py benchmark --escala 20 --base base.json --umbral 0.3
+#
+# Con --base, termina con error si algo ha empeorado más que el umbral
+# (sirve para CI).
+
+
+class Command(BaseCommand):
+    help = 'Mide peticiones/s, latencias y consultas de las vistas principales y compara con una base'
+
+    def add_arguments(self, parser):
+        parser.add_argument('escenarios', nargs='*',
+                            help=f"Solo estos escenarios (por defecto todos: {', '.join(benchmark.ESCENARIOS)}).")
+        parser.add_argument('--escala', type=int, default=10, help='Escala de generar_datos (10 = 100 coches, 500 ventas).')
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--peticiones', type=int, default=200, help='Peticiones medidas por escenario y modo.')
+        parser.add_argument('--concurrencia', type=int, default=8, help='Peticiones a la vez en el modo http.')
+        parser.add_argument('--modo', choices=['cliente', 'http', 'asgi', 'ambos', 'todos'], default='ambos',
+                            help="'ambos' = cliente + http; 'todos' añade asgi (necesita uvicorn).")
+        parser.add_argument('--salida', help='Guarda los resultados en este JSON.')
+        parser.add_argument('--base', help='JSON de una ejecución anterior con el que comparar.')
+        parser.add_argument('--umbral', type=float, default=0.3,
+                            help='Empeoramiento permitido frente a la base (0.3 = 30 %%).')
+
+    def handle(self, *args, **options):
+        base = None
+        if options['base']:
+            with open(options['base'], encoding='utf-8') as fichero:
+                base = json.load(fichero)
+
+        resultados = self.medir(options)
+        for modo, escenarios in resultados['resultados'].items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"Modo {modo}"))
+            self.stdout.write(
+                f"  {'escenario':<22}{'pet/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'consultas':>11}{'errores':>9}"
+            )
+            for nombre, r in escenarios.items():
+                consultas = f"{r['consultas_media']:.1f}" if r['consultas_media'] is not None else '-'
+                self.stdout.write(
+                    f"  {nombre:<22}{r['peticiones_s']:>9.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+                    f"{consultas:>11}{r['errores']:>9}"
+                )
+
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as fichero:
+                json.dump(resultados, fichero, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Resultados guardados en {options['salida']}")
+
+        if base is not None:
+            for clave in ('escala', 'perfil_bd'):
+                if base.get('entorno', {}).get(clave) != resultados['entorno'][clave]:
+                    self.stdout.write(self.style.WARNING(f"La base se midió con otro '{clave}': la comparación no es fiable."))
+            regresiones = benchmark.comparar(resultados, base, options['umbral'])
+            for modo, escenario, medida, antes, ahora, cambio in regresiones:
+                self.stdout.write(self.style.ERROR(
+                    f"  REGRESIÓN {modo}/{escenario} {medida}: {antes} -> {ahora} ({cambio:+.0%})"
+                ))
+            if regresiones:
+                raise CommandError(f"{len(regresiones)} regresiones respecto a {options['base']}")
+            self.stdout.write(self.style.SUCCESS(f"Sin regresiones respecto a {options['base']}"))
+
+    def medir(self, options):
+        seleccion = options['escenarios'] or benchmark.ESCENARIOS
+        desconocidos = set(seleccion) - set(benchmark.ESCENARIOS)
+        if desconocidos:
+            raise CommandError(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+        modos = {'ambos': ['cliente', 'http'], 'todos': ['cliente', 'http', 'asgi']}.get(options['modo'], [options['modo']])
+
+        with benchmark.bd_aparte(options['escala'], options['semilla'], self.stdout):
+            usuario = Usuario.objects.create_superuser('benchmark', 'benchmark@alphaautos.es', 'benchmark')
+            # Un coche sin vender por cada POST de crear_venta, calentamiento incluido (5 por hilo en http)
+            por_vender = 0
+            if 'crear_venta' in seleccion:
+                por_vender = len(modos) * (options['peticiones'] + 5 * options['concurrencia'])
+            escenarios = {
+                nombre: datos for nombre, datos in benchmark.preparar(usuario, por_vender).items() if nombre in seleccion
+            }
+
+            pragmas = bd.pragmas_actuales(connection)
+            resultados = {}
+            # Todas las peticiones medidas, para sacar las consultas de metricas.registro; y sin
+            # el log de consultas lentas, que con carga concurrente avisaría de casi todas
+            with override_settings(ALPHAAUTOS_METRICAS_MUESTREO=1, ALPHAAUTOS_SQL_LENTA_MS=float('inf'),
+                                   ALLOWED_HOSTS=['127.0.0.1', 'testserver']):
+                for modo in modos:
+                    self.stdout.write(f"Midiendo en modo {modo}...")
+                    if modo == 'cliente':
+                        resultados[modo] = benchmark.medir_cliente(usuario, escenarios, options['peticiones'])
+                    elif modo == 'http':
+                        resultados[modo] = benchmark.medir_http(
+                            usuario, escenarios, options['peticiones'], options['concurrencia'],
+                        )
+                    else:
+                        # Como mysite/asgi.py: vistas async y sin conexiones persistentes (cada petición, un hilo nuevo)
+                        conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+                        connection.settings_dict['CONN_MAX_AGE'] = 0
+                        try:
+                            with override_settings(ROOT_URLCONF='mysite.urls_asgi'):
+                                resultados[modo] = benchmark.medir_http(
+                                    usuario, escenarios, options['peticiones'], options['concurrencia'], asgi=True,
+                                )
+                        finally:
+                            connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+
+        return {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'entorno': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'bd': connection.vendor,
+                'perfil_bd': settings.ALPHAAUTOS_BD,
+                'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+                'pool': bool(connection.settings_dict['OPTIONS'].get('pool')),
+                'pragmas': pragmas,
+                'cpus': os.cpu_count(),
+                'escala': options['escala'],
+                'semilla': options['semilla'],
+                'peticiones': options['peticiones'],
+                'concurrencia': options['concurrencia'],
+                'cache': settings.ALPHAAUTOS_CACHE,
+            },
+            'resultados': resultados,
+        }
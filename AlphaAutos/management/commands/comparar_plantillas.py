@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+
+from AlphaAutos import benchmark, perfil_plantillas
+from AlphaAutos.models import Usuario
+
+# -------------------------------------------------------------------
+# Render de los listados: DjangoTemplates contra Jinja2
+# -------------------------------------------------------------------
+# En una BD aparte (como manage.py benchmark), renderiza coche_list,
+# lista_ventas, lista_clientes, lista_empleados y las búsquedas de coches
+# y ventas con --filas filas, con las plantillas de templates/ y con las
+# de jinja2/, como superusuario (todas las acciones de cada fila).
+#
+#   manage.py comparar_plantillas --filas 5000 --repeticiones 5
+
+
+class Command(BaseCommand):
+    help = 'Compara el tiempo de render de los listados con DjangoTemplates y con Jinja2'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=2000, help='Filas de cada listado.')
+        parser.add_argument('--repeticiones', type=int, default=5, help='Render por plantilla y motor.')
+        parser.add_argument('--escala', type=int, default=1, help='Escala de generar_datos.')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if 'jinja2' not in engines:
+            raise CommandError('Hace falta jinja2 instalado (pip install jinja2).')
+        if options['filas'] < 1 or options['repeticiones'] < 1:
+            raise CommandError('Hacen falta al menos una fila y una repetición.')
+
+        with benchmark.bd_aparte(options['escala'], options['semilla'], self.stdout):
+            usuario = Usuario.objects.create_superuser('plantillas', 'plantillas@alphaautos.es', 'plantillas')
+            self.stdout.write(f"Renderizando con {options['filas']} filas, {options['repeticiones']} veces...")
+            # Sin el perfil de plantillas (en DEBUG está puesto): Django pagaría un ContextVar.get() por nodo
+            perfil = perfil_plantillas.instalado()
+            perfil_plantillas.desinstalar()
+            try:
+                resultados = benchmark.comparar_motores(usuario, options['filas'], options['repeticiones'])
+            finally:
+                if perfil:
+                    perfil_plantillas.instalar()
+
+        self.stdout.write(f"  {'plantilla':40}{'filas':>7}{'django ms':>11}{'jinja2 ms':>11}{'veces':>7}")
+        for r in resultados:
+            self.stdout.write(
+                f"  {r['plantilla']:40}{r['filas']:7d}{r['django_ms']:11.1f}{r['jinja2_ms']:11.1f}{r['veces']:7.1f}"
+            )
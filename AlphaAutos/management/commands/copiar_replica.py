@@ -0,0 +1,29 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from AlphaAutos.replicas import alias_replica
+
+
+class Command(BaseCommand):
+    help = 'Copia la BD SQLite principal sobre la réplica (para probar la réplica de lectura en local)'
+
+    def handle(self, *args, **options):
+        alias = alias_replica()
+        if alias is None:
+            raise CommandError('No hay réplica: define ALPHAAUTOS_REPLICA.')
+        primario, replica = connections['default'], connections[alias]
+        if primario.vendor != 'sqlite':
+            raise CommandError('En PostgreSQL la réplica se mantiene con la replicación del servidor.')
+
+        # API de copia de SQLite: copia consistente aunque haya escrituras a la vez
+        origen = sqlite3.connect(primario.settings_dict['NAME'])
+        destino = sqlite3.connect(replica.settings_dict['NAME'])
+        try:
+            with destino:
+                origen.backup(destino)
+        finally:
+            origen.close()
+            destino.close()
+        self.stdout.write(self.style.SUCCESS(f"Réplica '{replica.settings_dict['NAME']}' al día."))
@@ -0,0 +1,70 @@
+from django.contrib.auth.models import Permission
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from AlphaAutos import benchmark
+from AlphaAutos.models import Coche, Comprador, Usuario
+
+# -------------------------------------------------------------------
+# Prueba de estrés de crear_venta: muchos compradores, pocos coches
+# -------------------------------------------------------------------
+# En una BD aparte (como manage.py benchmark), --compradores hilos
+# intentan comprar a la vez --coches coches recién creados con un POST a
+# crear_venta (la vista, con su formulario y su transacción). Cada coche
+# solo puede venderse una vez: tiene que haber exactamente --coches
+# ventas, el resto conflictos, ningún error y ningún coche con dos ventas
+# activas (AlphaAutos/reservas.py).
+#
+#   manage.py estres_ventas --compradores 300 --coches 10
+#   manage.py estres_ventas --compradores 300 --coches 300   (sin competencia, para comparar)
+
+
+class Command(BaseCommand):
+    help = 'Muchos compradores a la vez sobre pocos coches: comprueba que ninguno se vende dos veces'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compradores', type=int, default=300, help='Compradores (hilos) a la vez.')
+        parser.add_argument('--coches', type=int, default=10, help='Coches en venta que se disputan.')
+        parser.add_argument('--escala', type=int, default=1, help='Escala de generar_datos para el resto de la BD.')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['compradores'] < 1 or options['coches'] < 1:
+            raise CommandError('Hacen falta al menos un comprador y un coche.')
+
+        with benchmark.bd_aparte(options['escala'], options['semilla'], self.stdout):
+            usuarios = Usuario.objects.bulk_create([
+                Usuario(username=f"estres{i}", rol=Usuario.COMPRADOR, password='!')
+                for i in range(options['compradores'])
+            ])
+            compradores = Comprador.objects.bulk_create([Comprador(usuario=usuario) for usuario in usuarios])
+            # crear_venta pide add_venta; en esta BD no tiene por qué existir el grupo Compradores
+            permiso = Permission.objects.get(content_type__app_label='AlphaAutos', codename='add_venta')
+            Usuario.user_permissions.through.objects.bulk_create([
+                Usuario.user_permissions.through(usuario_id=usuario.pk, permission_id=permiso.pk)
+                for usuario in usuarios
+            ])
+            coches = benchmark.coches_por_vender(Coche.objects.order_by('pk').first(), options['coches'])
+            # Cada hilo abre su conexión: la de este no debe tener nada a medias
+            connection.close()
+
+            self.stdout.write(f"{options['compradores']} compradores a la vez sobre {options['coches']} coches...")
+            # Sin el log de consultas lentas: con cientos de escrituras en cola avisaría de casi todas
+            with override_settings(ALPHAAUTOS_SQL_LENTA_MS=float('inf')):
+                r = benchmark.estres_ventas(compradores, coches)
+
+        self.stdout.write(
+            f"  ventas {r['ventas']}, conflictos {r['conflictos']}, errores {sum(r['errores'].values())}"
+            f" {r['errores'] or ''}"
+        )
+        self.stdout.write(
+            f"  {r['intentos_s']:.1f} intentos/s, p50 {r['p50_ms']:.1f} ms, p95 {r['p95_ms']:.1f} ms,"
+            f" p99 {r['p99_ms']:.1f} ms"
+        )
+        self.stdout.write(f"  coches vendidos {r['vendidos']}/{r['coches']}, con más de una venta activa: {r['dobles']}")
+
+        esperadas = min(r['coches'], r['compradores'])
+        if r['dobles'] or r['errores'] or r['ventas'] != esperadas or r['vendidos'] != esperadas:
+            raise CommandError('Resultado incorrecto: hay ventas dobles, errores o coches sin vender.')
+        self.stdout.write(self.style.SUCCESS('Ningún coche vendido dos veces.'))
@@ -0,0 +1,141 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from AlphaAutos.cache import cache_catalogo
+from AlphaAutos.models import *
+
+# -------------------------------------------------------------------
+# Planes de ejecución de los listados
+# -------------------------------------------------------------------
+# Llama a cada vista de listado, captura los SELECT que lanza y muestra
+# su plan (EXPLAIN QUERY PLAN en SQLite, EXPLAIN en PostgreSQL) y su
+# tiempo dos veces: sin los índices de Meta.indexes ("antes", se borran
+# dentro de una transacción que se deshace) y con ellos ("después").
+# Pensado para lanzarse sobre una BD grande (manage.py generar_datos).
+
+
+class Command(BaseCommand):
+    help = 'Muestra el plan de ejecución de las consultas de cada listado, sin y con los índices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('vistas', nargs='*', help='Solo estas vistas (por nombre de URL).')
+        parser.add_argument('--repeticiones', type=int, default=3,
+                            help='Ejecuciones de cada consulta para medir el tiempo (se toma la mejor).')
+        parser.add_argument('--analizar', action='store_true',
+                            help='Lanza ANALYZE antes: sin estadísticas el planificador puede ignorar índices útiles.')
+
+    def listados(self):
+        """[(nombre de URL, kwargs, parámetros GET)] con datos que existen en la BD."""
+        coche = Coche.objects.order_by('-fecha_fabricacion').first()
+        venta = Venta.objects.order_by('pk').first()
+        concesionario = Concesionario.objects.order_by('pk').first()
+        marca = Marca.objects.order_by('pk').first()
+        if not (coche and venta and concesionario and marca):
+            raise CommandError('La BD no tiene datos: lanza antes manage.py generar_datos.')
+        return [
+            ('coche_list', {}, {}),
+            ('coches_por_fecha', {'anio': coche.fecha_fabricacion.year, 'mes': coche.fecha_fabricacion.month}, {}),
+            ('coches_transmision', {'tipo': 'AT'}, {}),
+            ('coches_concesionario_texto', {'id_concesionario': concesionario.pk, 'texto': coche.modelo[:3]}, {}),
+            ('ultimo_cliente_coche', {'id_coche': venta.coche_id}, {}),
+            ('coches_sin_ventas', {}, {}),
+            ('concesionario_detail', {'id_concesionario': concesionario.pk}, {}),
+            ('marca_detail', {'id_marca': marca.pk}, {}),
+            ('lista_concesionarios', {}, {}),
+            ('lista_marcas', {}, {}),
+            ('lista_empleados', {}, {}),
+            ('lista_clientes', {}, {}),
+            ('lista_aseguradoras', {}, {}),
+            ('lista_ventas', {}, {}),
+            ('resumen_ventas', {}, {'agrupar': 'concesionario'}),
+            ('buscar_ventas', {}, {'metodo_pago': venta.metodo_pago}),
+        ]
+
+    def capturar(self, usuario, nombre, kwargs, parametros):
+        """SELECTs que lanza la vista (sin caché del catálogo, para ver las consultas reales)."""
+        url = reverse(f'AlphaAutos:{nombre}', kwargs=kwargs)
+        request = RequestFactory().get(url, parametros)
+        request.user = usuario
+        coincidencia = resolve(url)
+        cache_catalogo().clear()
+        with CaptureQueriesContext(connection) as contexto:
+            coincidencia.func(request, *coincidencia.args, **coincidencia.kwargs)
+        return [q['sql'] for q in contexto.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')]
+
+    def plan(self, sql):
+        prefijo = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefijo + sql)
+            filas = cursor.fetchall()
+        return [fila[-1] for fila in filas]
+
+    def tiempo(self, sql, repeticiones):
+        mejor = None
+        with connection.cursor() as cursor:
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                cursor.execute(sql)
+                cursor.fetchall()
+                transcurrido = time.perf_counter() - inicio
+                mejor = transcurrido if mejor is None else min(mejor, transcurrido)
+        return mejor * 1000
+
+    def medir(self, consultas, repeticiones):
+        return {
+            nombre: [(self.plan(sql), self.tiempo(sql, repeticiones)) for sql in sqls]
+            for nombre, sqls in consultas.items()
+        }
+
+    def medir_sin_indices(self, consultas, repeticiones):
+        indices = [
+            index.name
+            for modelo in apps.get_app_config('AlphaAutos').get_models()
+            for index in modelo._meta.indexes
+        ]
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for nombre in indices:
+                    cursor.execute(f'DROP INDEX IF EXISTS "{nombre}"')
+            resultado = self.medir(consultas, repeticiones)
+            # Se deshace el DROP INDEX
+            transaction.set_rollback(True)
+        return resultado
+
+    def handle(self, *args, **options):
+        usuario = Usuario.objects.filter(is_superuser=True, is_active=True).first()
+        if usuario is None:
+            raise CommandError('Hace falta un superusuario activo (manage.py createsuperuser).')
+
+        listados = self.listados()
+        if options['vistas']:
+            desconocidas = set(options['vistas']) - {nombre for nombre, _, _ in listados}
+            if desconocidas:
+                raise CommandError(f"Vistas desconocidas: {', '.join(sorted(desconocidas))}")
+            listados = [listado for listado in listados if listado[0] in options['vistas']]
+
+        if options['analizar']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        consultas = {nombre: self.capturar(usuario, nombre, kwargs, parametros) for nombre, kwargs, parametros in listados}
+        repeticiones = max(1, options['repeticiones'])
+        antes = self.medir_sin_indices(consultas, repeticiones)
+        despues = self.medir(consultas, repeticiones)
+
+        for nombre, sqls in consultas.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"== {nombre}"))
+            for i, sql in enumerate(sqls):
+                (plan_antes, ms_antes), (plan_despues, ms_despues) = antes[nombre][i], despues[nombre][i]
+                self.stdout.write(f"  {sql[:160]}{'...' if len(sql) > 160 else ''}")
+                self.stdout.write(f"    antes ({ms_antes:.2f} ms):")
+                for linea in plan_antes:
+                    self.stdout.write(f"      {linea}")
+                self.stdout.write(f"    después ({ms_despues:.2f} ms):")
+                for linea in plan_despues:
+                    self.stdout.write(f"      {linea}")
@@ -1,138 +1,173 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from faker import Faker
-import random
-
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from AlphaAutos import autocompletar
+from AlphaAutos.cache import cache_catalogo
+from AlphaAutos.generacion import generar_lote, iniciar_proceso
 from AlphaAutos.models import *
 
-fake = Faker('es_ES')
-
+# -------------------------------------------------------------------
+# Generador de datos de prueba a escala
+# -------------------------------------------------------------------
+# Las filas se generan con Faker en un pool de procesos, por lotes, y se
+# insertan con bulk_create (las tablas intermedias ManyToMany también).
+# Con la misma --semilla y el mismo --lote el resultado es idéntico,
+# se use el número de procesos que se use: cada lote tiene su propia
+# semilla derivada de (semilla, modelo, número de lote).
+#
+# Cantidades con --escala E:
+#   - catálogo (concesionarios, marcas, aseguradoras): base * ceil(sqrt(E))
+#   - resto: base * E  (E=1 -> 10 coches ... E=100000 -> 1M coches, 5M ventas)
+
+CATALOGO = {
+    'concesionario': 10,
+    'marca': 10,
+    'aseguradora': 10,
+}
+
+POR_ESCALA = {
+    'coche': 10,
+    'empleado': 10,
+    'usuario': 10,       # un usuario comprador por cada Comprador
+    'comprador': 10,
+    'datos_cliente': 10,
+    'seguro': 10,        # OneToOne con Coche: como mucho uno por coche
+    'mantenimiento': 5,
+    'venta': 50,
+}
+
+MODELOS = {
+    'concesionario': Concesionario,
+    'marca': Marca,
+    'aseguradora': Aseguradora,
+    'coche': Coche,
+    'empleado': Empleado,
+    'usuario': Usuario,
+    'comprador': Comprador,
+    'datos_cliente': Datos_Cliente,
+    'seguro': Seguro,
+    'mantenimiento': Mantenimiento,
+    'venta': Venta,
+    'aseguradora_seguros': Aseguradora.seguros.through,
+    'mantenimiento_coches': Mantenimiento.coches.through,
+}
+
+# Orden de inserción (los padres antes que los hijos)
+ORDEN = [
+    'concesionario', 'marca', 'aseguradora', 'coche', 'empleado', 'usuario',
+    'comprador', 'datos_cliente', 'seguro', 'mantenimiento', 'venta',
+    'aseguradora_seguros', 'mantenimiento_coches',
+]
+
+# -------------------------------------------------------------------
+# Comando
+# -------------------------------------------------------------------
 class Command(BaseCommand):
     help = 'Genera datos de prueba para todos los modelos del concesionario AlphaAutos'
 
-    def handle(self, *args, **kwargs):
-        self.stdout.write(self.style.WARNING('Creando datos de prueba...'))
-
-        # Crear Concesionarios
-        concesionarios = []
-        for _ in range(10):
-            c = Concesionario.objects.create(
-                nombre=f"Concesionario {fake.company()}",
-                direccion=fake.address(),
-                telefono=fake.phone_number(),
-                ciudad=fake.city()
-            )
-            concesionarios.append(c)
-
-        # Crear Marcas
-        marcas = []
-        for _ in range(10):
-            m = Marca.objects.create(
-                nombre=fake.company(),
-                pais_origen=fake.country(),
-                año_fundacion=random.randint(1950, 2020),
-                descripcion=fake.text(100)
-            )
-            marcas.append(m)
-
-        # Crear Coches
-        coches = []
-        for _ in range(10):
-            c = Coche.objects.create(
-                marca=random.choice(marcas),
-                concesionario=random.choice(concesionarios),
-                modelo=fake.word().capitalize(),
-                precio=round(random.uniform(8000, 60000), 2),
-                transmision=random.choice(['MT', 'AT']),
-                fecha_fabricacion=fake.date_between(start_date='-5y', end_date='today')
-            )
-            coches.append(c)
-
-        # Crear Clientes
-        clientes = []
-        for _ in range(10):
-            cl = Cliente.objects.create(
-                nombre=fake.name(),
-                email=fake.unique.email(),
-                telefono=fake.phone_number(),
-                fecha_registro=timezone.now()
-            )
-            clientes.append(cl)
-
-        # Crear DatosCliente (OneToOne con Cliente)
-        for cliente in clientes:
-            Datos_Cliente.objects.create(
-                cliente=cliente,
-                direccion=fake.address(),
-                dni=fake.unique.bothify(text='########A'),
-                puntos_fidelidad=random.uniform(0, 100)
-            )
-
-        # Crear Empleados
-        empleados = []
-        for _ in range(10):
-            e = Empleado.objects.create(
-                concesionario=random.choice(concesionarios),
-                nombre=fake.name(),
-                puesto=random.choice(['Vendedor', 'Mecánico', 'Gerente', 'Administrativo']),
-                salario=round(random.uniform(1200, 3000), 2),
-                fecha_contratacion=fake.date_between(start_date='-10y', end_date='today')
-            )
-            empleados.append(e)
-
-        # Crear UsuarioEmpleado (OneToOne con Empleado)
-        for empleado in empleados:
-            Usuario_Empleado.objects.create(
-                empleado=empleado,
-                direccion=fake.address(),
-                telefono=fake.phone_number(),
-                experiencia=random.randint(0, 20)
-            )
-
-        # Crear Aseguradoras
-        aseguradoras = []
-        for _ in range(10):
-            a = Aseguradora.objects.create(
-                nombre=fake.company(),
-                pais=fake.country(),
-                telefono=fake.phone_number(),
-                web=fake.url()
-            )
-            aseguradoras.append(a)
-
-        # Crear Seguros (OneToOne con Coche)
-        seguros = []
-        for coche in coches:
-            s = Seguro.objects.create(
-                coche=coche,
-                tipo_seguro=random.choice(['Básico', 'Completo', 'Premium']),
-                precio_mensual=round(random.uniform(30, 200), 2),
-                duracion=random.randint(6, 36)
-            )
-            s.aseguradora_set.add(random.choice(aseguradoras))
-            seguros.append(s)
-
-        # Crear Mantenimientos
-        mantenimientos = []
-        for _ in range(10):
-            m = Mantenimiento.objects.create(
-                fecha_revision=fake.date_between(start_date='-2y', end_date='today'),
-                kilometros=random.randint(5000, 120000),
-                comentarios=fake.sentence(),
-                coste=round(random.uniform(100, 1000), 2)
-            )
-            # Añadimos coches aleatorios
-            m.coches.add(random.choice(coches))
-            mantenimientos.append(m)
-
-        # Crear Ventas (ManyToMany con tabla intermedia)
-        for _ in range(10):
-            Venta.objects.create(
-                cliente=random.choice(clientes),
-                coche=random.choice(coches),
-                fecha_venta=fake.date_between(start_date='-2y', end_date='today'),
-                precio_final=round(random.uniform(9000, 50000), 2),
-                metodo_pago=random.choice(['Transferencia', 'Efectivo', 'Financiación'])
-            )
-
-        self.stdout.write(self.style.SUCCESS('Datos de prueba creados correctamente.'))
+    def add_arguments(self, parser):
+        parser.add_argument('--escala', '--scale', type=int, default=1,
+                            help='Multiplicador de filas (1 = 10 coches, 100000 = 1M coches y 5M ventas).')
+        parser.add_argument('--lote', '--batch-size', type=int, default=5000,
+                            help='Filas por lote de generación y por bulk_create.')
+        parser.add_argument('--semilla', '--seed', type=int, default=0,
+                            help='Semilla para que la generación sea reproducible.')
+        parser.add_argument('--procesos', '--workers', type=int, default=None,
+                            help='Procesos generadores (por defecto, uno por CPU).')
+
+    def cantidades(self, escala):
+        raiz = math.ceil(math.sqrt(escala))
+        total = {nombre: base * raiz for nombre, base in CATALOGO.items()}
+        total.update({nombre: base * escala for nombre, base in POR_ESCALA.items()})
+        # Relaciones 1:1 y tablas intermedias
+        total['comprador'] = total['datos_cliente'] = total['usuario']
+        total['seguro'] = min(total['seguro'], total['coche'])
+        total['aseguradora_seguros'] = total['seguro']
+        total['mantenimiento_coches'] = total['mantenimiento']
+        return total
+
+    def handle(self, *args, **options):
+        escala, lote = options['escala'], options['lote']
+        if escala < 1 or lote < 1:
+            raise CommandError('--escala y --lote deben ser mayores que 0.')
+
+        total = self.cantidades(escala)
+        self.password = make_password('alphaautos')
+        self.ids = {}
+        self.stdout.write(self.style.WARNING(f'Creando datos de prueba (escala {escala})...'))
+
+        inicio_total = time.monotonic()
+        self.en_vuelo = max(1, options['procesos'] or os.cpu_count() or 1) * 2
+        with ProcessPoolExecutor(max_workers=options['procesos'], initializer=iniciar_proceso) as pool:
+            for nombre in ORDEN:
+                inicio = time.monotonic()
+                self.insertar(pool, nombre, total, lote, options['semilla'])
+                segundos = time.monotonic() - inicio
+                self.stdout.write(f"  {nombre}: {total[nombre]} filas en {segundos:.1f} s")
+
+        # bulk_create no lanza señales: se rehacen los datos derivados
+        call_command('reconstruir_indice_busqueda', stdout=self.stdout)
+        call_command('reconstruir_resumenes', stdout=self.stdout)
+        call_command('reconciliar_stock', stdout=self.stdout)
+        cache_catalogo().clear()
+        autocompletar.reiniciar()
+
+        segundos = time.monotonic() - inicio_total
+        self.stdout.write(self.style.SUCCESS(f'Datos de prueba creados correctamente en {segundos:.1f} s.'))
+
+    def insertar(self, pool, nombre, total, lote, semilla):
+        modelo = MODELOS[nombre]
+        cantidad = total[nombre]
+        for filas in self.generar(pool, nombre, cantidad, lote, semilla, total):
+            objetos = [modelo(**self.resolver(fila)) for fila in filas]
+            if nombre == 'usuario':
+                for usuario in objetos:
+                    usuario.password = self.password
+                    usuario.rol = Usuario.COMPRADOR
+            with transaction.atomic():
+                modelo.objects.bulk_create(objetos, batch_size=lote)
+
+        if nombre in MODELOS and nombre not in ('aseguradora_seguros', 'mantenimiento_coches'):
+            # Ids reales de lo recién insertado, para resolver las claves de los hijos
+            ids = list(modelo.objects.order_by('-pk').values_list('pk', flat=True)[:cantidad])
+            self.ids[nombre] = ids[::-1]
+
+    def generar(self, pool, nombre, cantidad, lote, semilla, total):
+        """
+        Lotes de filas en orden. pool.map() encargaría todos de golpe y, como
+        los procesos generan más rápido de lo que se inserta, las filas se
+        acumularían en memoria. Aquí hay como mucho `self.en_vuelo` lotes
+        encargados y cada lote que sale para insertarse encarga otro.
+        """
+        inicios = iter(range(0, cantidad, lote))
+        pendientes = deque()
+
+        def encargar():
+            inicio = next(inicios, None)
+            if inicio is not None:
+                pendientes.append(pool.submit(generar_lote, nombre, inicio, min(lote, cantidad - inicio), semilla, total))
+
+        for _ in range(self.en_vuelo):
+            encargar()
+        while pendientes:
+            filas = pendientes.popleft().result()
+            encargar()
+            yield filas
+
+    def resolver(self, fila):
+        campos = {}
+        for campo, valor in fila.items():
+            if campo.endswith('_idx'):
+                relacion = campo[:-4]
+                campos[f"{relacion}_id"] = self.ids[relacion][valor]
+            else:
+                campos[campo] = valor
+        return campos
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from AlphaAutos.cache import cache_catalogo
+from AlphaAutos.imagenes import generar_rendiciones, marcar_rendida
+from AlphaAutos.models import Coche
+
+
+class Command(BaseCommand):
+    help = 'Genera las rendiciones (miniatura, grande) que falten de las imágenes de los coches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forzar', action='store_true',
+                            help='Rehace también las que ya existen (p. ej. tras cambiar RENDICIONES).')
+
+    def handle(self, *args, **options):
+        nombres = (
+            Coche.objects.exclude(imagen='').exclude(imagen__isnull=True)
+            .order_by().values_list('imagen', flat=True).distinct()
+        )
+        generadas = marcados = errores = 0
+        for nombre in nombres.iterator(chunk_size=2000):
+            try:
+                generadas += generar_rendiciones(nombre, forzar=options['forzar'])
+            except (OSError, ValueError) as error:
+                errores += 1
+                self.stderr.write(f"{nombre}: {error}")
+                continue
+            marcados += marcar_rendida(nombre)
+        if generadas or marcados:
+            # Las páginas cacheadas apuntaban a los originales
+            cache_catalogo().clear()
+        self.stdout.write(self.style.SUCCESS(f"Rendiciones generadas: {generadas} ({errores} imágenes con error)."))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from AlphaAutos.importacion import COLUMNAS, importar_coches
+
+
+class Command(BaseCommand):
+    help = f"Importa coches desde un CSV con las columnas: {', '.join(COLUMNAS)}"
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichero', help='Ruta del CSV (UTF-8, con cabecera).')
+        parser.add_argument('--delimitador', default=',', help="Separador de columnas (p. ej. ';').")
+        parser.add_argument('--simular', '--dry-run', action='store_true',
+                            help='Solo valida las filas, sin guardar nada.')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            with open(options['fichero'], encoding='utf-8-sig', newline='') as fichero:
+                resultado = importar_coches(fichero, simular=options['simular'], delimitador=options['delimitador'])
+        except OSError as error:
+            raise CommandError(f"No se puede leer el fichero: {error}")
+        transcurrido = time.perf_counter() - inicio
+
+        for linea, mensaje in resultado.errores:
+            self.stderr.write(f"Fila {linea}: {mensaje}")
+        if resultado.total_errores > len(resultado.errores):
+            self.stderr.write(f"... y {resultado.total_errores - len(resultado.errores)} errores más.")
+        accion = 'válidos (simulación, no se ha guardado nada)' if options['simular'] else 'importados'
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado.creados} coches {accion} de {resultado.filas} filas, "
+            f"{resultado.total_errores} con errores, en {transcurrido:.1f} s "
+            f"({resultado.filas / max(transcurrido, 1e-6):.0f} filas/s)."
+        ))
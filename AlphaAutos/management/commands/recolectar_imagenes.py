@@ -0,0 +1,47 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from AlphaAutos import imagenes
+from AlphaAutos.almacen import almacen_imagenes
+from AlphaAutos.cache import cache_catalogo
+
+
+class Command(BaseCommand):
+    help = 'Recuenta las referencias de las imágenes de coches y borra los ficheros que no usa nadie'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--migrar', action='store_true',
+                            help='Pasa antes las imágenes antiguas (coches/3_JentJLk.jpg...) a su nombre por contenido.')
+        parser.add_argument('--simular', '--dry-run', action='store_true',
+                            help='Solo cuenta lo que se haría, sin tocar la BD ni el disco.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            migradas = imagenes.migrar_antiguas() if options['migrar'] and not options['simular'] else 0
+            sin_referencias = imagenes.recontar()
+            if options['simular']:
+                transaction.set_rollback(True)
+        originales, rendiciones = imagenes.huerfanos()
+
+        if options['simular']:
+            self.stdout.write(
+                f"Ficheros sin referencias: {len(sin_referencias)}\n"
+                f"Imágenes huérfanas en disco: {len(originales)}\n"
+                f"Rendiciones huérfanas: {len(rendiciones)}"
+            )
+            return
+
+        borrados = imagenes.recolectar(sin_referencias)
+        almacen = almacen_imagenes()
+        for nombre in originales:
+            almacen.delete(nombre)
+        for nombre in rendiciones:
+            default_storage.delete(nombre)
+        if migradas:
+            # Las páginas cacheadas apuntaban a los nombres antiguos
+            cache_catalogo().clear()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imágenes migradas: {migradas}. Borradas: {borrados + len(originales)} imágenes "
+            f"y {len(rendiciones)} rendiciones."
+        ))
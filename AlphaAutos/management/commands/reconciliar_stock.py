@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from AlphaAutos import stock
+
+
+class Command(BaseCommand):
+    help = 'Corrige Coche.vendido en los coches que no cuadren con sus ventas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', '--dry-run', action='store_true',
+                            help='Solo cuenta los descuadres, sin corregirlos.')
+
+    def handle(self, *args, **options):
+        if options['simular']:
+            sobrantes, faltantes = stock.descuadres()
+            self.stdout.write(
+                f"Marcados como vendidos sin ventas: {sobrantes.count()}\n"
+                f"Con ventas y marcados como disponibles: {faltantes.count()}"
+            )
+            return
+
+        with transaction.atomic():
+            corregidos = stock.reconciliar()
+        self.stdout.write(self.style.SUCCESS(f"Stock reconciliado: {corregidos} coches corregidos."))
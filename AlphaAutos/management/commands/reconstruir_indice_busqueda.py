@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from AlphaAutos.buscador import INDICES, obtener_buscador
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda de texto (todo o solo los tipos indicados)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipos', nargs='*', help=f"Tipos a reconstruir: {', '.join(INDICES)}")
+
+    def handle(self, *args, **options):
+        tipos = options['tipos'] or list(INDICES)
+        desconocidos = set(tipos) - set(INDICES)
+        if desconocidos:
+            raise CommandError(f"Tipos desconocidos: {', '.join(sorted(desconocidos))}")
+
+        buscador = obtener_buscador()
+        for tipo in tipos:
+            self.stdout.write(f"Reindexando {tipo}...")
+            buscador.reconstruir(INDICES[tipo])
+        self.stdout.write(self.style.SUCCESS('Índice de búsqueda reconstruido.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from AlphaAutos import resumenes
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los resúmenes de ventas desde la tabla Venta (todas o solo las dimensiones indicadas)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dimensiones', nargs='*', help=f"Dimensiones: {', '.join(resumenes.FILTROS)}")
+
+    def handle(self, *args, **options):
+        dimensiones = options['dimensiones'] or list(resumenes.FILTROS)
+        desconocidas = set(dimensiones) - set(resumenes.FILTROS)
+        if desconocidas:
+            raise CommandError(f"Dimensiones desconocidas: {', '.join(sorted(desconocidas))}")
+
+        resumenes.reconstruir(dimensiones)
+        self.stdout.write(self.style.SUCCESS(f"Resúmenes de ventas reconstruidos: {', '.join(dimensiones)}."))
@@ -0,0 +1,53 @@
+import json
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Agrega el log de consultas lentas y N+1 (líneas JSON de AlphaAutos/vigilancia_sql.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ficheros', nargs='*', help='Ficheros .jsonl (sin ficheros, lee la entrada estándar).')
+        parser.add_argument('--top', type=int, default=20, help='Cuántas consultas mostrar de cada tipo.')
+
+    def eventos(self, ficheros):
+        for fichero in ficheros or ['-']:
+            entrada = sys.stdin if fichero == '-' else open(fichero, encoding='utf-8')
+            with entrada:
+                for linea in entrada:
+                    try:
+                        yield json.loads(linea)
+                    except ValueError:
+                        # Otras líneas del log (trazas, avisos de Django...)
+                        continue
+
+    def handle(self, *args, **options):
+        # (evento, huella) -> acumulados
+        grupos = defaultdict(lambda: {'eventos': 0, 'ms': 0.0, 'repeticiones': 0, 'vistas': set(), 'sitios': set()})
+        for evento in self.eventos(options['ficheros']):
+            if evento.get('evento') not in ('consulta_lenta', 'n_mas_1'):
+                continue
+            grupo = grupos[evento['evento'], evento['huella']]
+            grupo['eventos'] += 1
+            grupo['ms'] += evento.get('ms') or evento.get('ms_total') or 0
+            grupo['repeticiones'] += evento.get('repeticiones', 1)
+            grupo['vistas'].add(evento.get('vista') or evento.get('ruta') or '-')
+            grupo['sitios'].add(evento.get('plantilla') or evento.get('codigo') or '-')
+            grupo['sql'] = evento['sql']
+
+        for tipo, titulo in (('n_mas_1', 'Consultas repetidas (N+1)'), ('consulta_lenta', 'Consultas lentas')):
+            filas = sorted(
+                ((huella, grupo) for (evento, huella), grupo in grupos.items() if evento == tipo),
+                key=lambda fila: -fila[1]['ms'],
+            )[:options['top']]
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{titulo}: {len(filas)}"))
+            for huella, grupo in filas:
+                self.stdout.write(
+                    f"  {huella}  {grupo['ms']:.0f} ms en {grupo['eventos']} peticiones "
+                    f"({grupo['repeticiones']} ejecuciones)\n"
+                    f"    vistas: {', '.join(sorted(grupo['vistas']))}\n"
+                    f"    desde:  {', '.join(sorted(grupo['sitios']))}\n"
+                    f"    {grupo['sql'][:300]}"
+                )
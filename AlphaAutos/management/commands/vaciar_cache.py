@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from AlphaAutos.cache import cache_catalogo
+
+
+class Command(BaseCommand):
+    help = 'Vacía la caché del catálogo (tras cargar datos sin pasar por el ORM)'
+
+    def handle(self, *args, **options):
+        cache_catalogo().clear()
+        self.stdout.write(self.style.SUCCESS('Caché del catálogo vaciada.'))
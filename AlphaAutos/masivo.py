@@ -0,0 +1,239 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least, Round
+
+from . import autocompletar, imagenes, resumenes, stock
+from .buscador import INDICES, obtener_buscador
+from .cache import invalidar
+from .form import PRECIO_MAXIMO, SALARIO_MAXIMO
+from .models import *
+from .paginacion import _bloques
+
+# -------------------------------------------------------------------
+# Operaciones masivas sobre coches, empleados y ventas
+# -------------------------------------------------------------------
+# Cambiar el precio de toda una marca era una petición por coche, y cada
+# borrado pasaba por el recolector de Django, que con las señales
+# conectadas carga en memoria cada objeto de la cascada.
+#
+# Aquí las modificaciones son un único QuerySet.update() y los borrados
+# siguen un plan de cascada explícito: un DELETE por tabla y por lote de
+# LOTE ids, cada lote en su transacción. Antes de ejecutar, plan_*()
+# devuelve cuántas filas de cada tabla se van a tocar (la vista lo
+# enseña para confirmar).
+#
+# Como no hay save() ni delete() por objeto, tampoco hay señales: cada
+# operación hace a mano lo mismo que signals.py (índice de búsqueda,
+# caché del catálogo, resúmenes de ventas, Coche.vendido, imágenes).
+
+LOTE = 1000
+
+SeguroAseguradora = Aseguradora.seguros.through
+CocheMantenimiento = Mantenimiento.coches.through
+
+
+def _borrar(queryset):
+    """DELETE ... WHERE pk IN (SELECT ...) sin pasar por el recolector de Django."""
+    ops = connection.ops
+    modelo = queryset.model
+    sql, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {ops.quote_name(modelo._meta.db_table)} "
+            f"WHERE {ops.quote_name(modelo._meta.pk.column)} IN ({sql})",
+            params,
+        )
+        return cursor.rowcount
+
+
+def _lotes_ids(queryset):
+    """Ids de la selección de LOTE en LOTE. Para borrar: cada lote se vuelve a pedir tras borrar el anterior."""
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:LOTE])
+        if not ids:
+            return
+        yield ids
+
+
+def _reindexar(tipo, ids):
+    indice = INDICES[tipo]
+    obtener_buscador().indexar(indice, indice.queryset().filter(pk__in=ids))
+
+
+# -------------------------------------------------------------------
+# Coches
+# -------------------------------------------------------------------
+def plan_borrado_coches(coches):
+    return [
+        ('Coches', coches.count()),
+        ('Ventas', Venta.objects.filter(coche__in=coches).count()),
+        ('Seguros', Seguro.objects.filter(coche__in=coches).count()),
+        ('Seguros en aseguradoras', SeguroAseguradora.objects.filter(seguro__coche__in=coches).count()),
+        ('Coches en mantenimientos', CocheMantenimiento.objects.filter(coche__in=coches).count()),
+    ]
+
+
+def borrar_coches(coches):
+    """Borra los coches con sus ventas, seguros y enlaces a mantenimientos. Devuelve {tabla: filas}."""
+    borrados = Counter()
+    for ids in _lotes_ids(coches):
+        with transaction.atomic():
+            filas = list(Coche.objects.filter(pk__in=ids).values_list('marca_id', 'concesionario_id', 'imagen'))
+            ventas = Venta.objects.filter(coche_id__in=ids)
+            grupos = resumenes.grupos_de(ventas)
+            aseguradoras = set(
+                SeguroAseguradora.objects.filter(seguro__coche_id__in=ids).values_list('aseguradora_id', flat=True)
+            )
+
+            # Primero lo que apunta a los coches, después los coches
+            borrados['Seguros en aseguradoras'] += _borrar(SeguroAseguradora.objects.filter(seguro__coche_id__in=ids))
+            borrados['Seguros'] += _borrar(Seguro.objects.filter(coche_id__in=ids))
+            borrados['Ventas'] += _borrar(ventas)
+            borrados['Coches en mantenimientos'] += _borrar(CocheMantenimiento.objects.filter(coche_id__in=ids))
+            borrados['Coches'] += _borrar(Coche.objects.filter(pk__in=ids))
+
+            resumenes.recalcular_grupos(grupos)
+            obtener_buscador().eliminar(INDICES['coche'], ids)
+            autocompletar.al_confirmar('modelo', [(pk, None) for pk in ids])
+            for nombre, veces in Counter(imagen for _, _, imagen in filas if imagen).items():
+                imagenes.quitar_referencia(nombre, veces)
+            invalidar(
+                *(f"coche:{pk}" for pk in ids),
+                *{f"marca:{marca}:coches" for marca, _, _ in filas},
+                *{f"concesionario:{concesionario}:coches" for _, concesionario, _ in filas},
+                *((['seguros', 'lista:aseguradora'] + [f"aseguradora:{pk}" for pk in aseguradoras]) if aseguradoras else []),
+            )
+    return dict(borrados)
+
+
+def plan_precio_coches(coches):
+    return [('Coches', coches.count())]
+
+
+def cambiar_precio_coches(coches, precio=None, porcentaje=None):
+    """Fija `precio` o lo ajusta un `porcentaje` (p. ej. -5) en un solo UPDATE."""
+    ids = list(coches.order_by().values_list('pk', flat=True))
+    with transaction.atomic():
+        if precio is not None:
+            actualizados = coches.update(precio=precio)
+        else:
+            # CochesMasivoForm ya rechaza los porcentajes que sacan algún precio de rango; por si
+            # los precios han cambiado desde la vista previa, el UPDATE los deja entre 0,01 y el máximo
+            factor = 1 + porcentaje / 100
+            precio = Round(F('precio') * factor, 2)
+            actualizados = coches.update(precio=Least(Greatest(precio, Value(Decimal('0.01'))), Value(PRECIO_MAXIMO)))
+        _invalidar_coches(ids)
+    return actualizados
+
+
+def plan_concesionario_coches(coches):
+    return [
+        ('Coches', coches.count()),
+        ('Ventas de esos coches (se recalculan sus resúmenes)', Venta.objects.filter(coche__in=coches).count()),
+    ]
+
+
+def cambiar_concesionario_coches(coches, concesionario):
+    ids = list(coches.order_by().values_list('pk', flat=True))
+    with transaction.atomic():
+        antes = set(coches.order_by().values_list('concesionario_id', flat=True).distinct())
+        grupos = resumenes.grupos_de(Venta.objects.filter(coche__in=coches))
+        actualizados = coches.update(concesionario=concesionario)
+        # Los grupos de destino, ya con el concesionario nuevo
+        grupos |= {
+            (dimension, fecha, str(concesionario.pk) if dimension == 'concesionario' else clave)
+            for dimension, fecha, clave in grupos
+        }
+        resumenes.recalcular_grupos(grupos)
+        for lote in _bloques(ids, LOTE):
+            _reindexar('coche', lote)
+        _invalidar_coches(ids, concesionarios=antes | {concesionario.pk})
+    return actualizados
+
+
+def _invalidar_coches(ids, concesionarios=()):
+    for lote in _bloques(ids, LOTE):
+        filas = Coche.objects.filter(pk__in=lote).values_list('marca_id', 'concesionario_id')
+        invalidar(
+            *(f"coche:{pk}" for pk in lote),
+            *{f"marca:{marca}:coches" for marca, _ in filas},
+            *{f"concesionario:{concesionario}:coches" for _, concesionario in filas},
+        )
+    invalidar(*(f"concesionario:{pk}:coches" for pk in concesionarios))
+
+
+# -------------------------------------------------------------------
+# Empleados
+# -------------------------------------------------------------------
+def plan_borrado_empleados(empleados):
+    return [
+        ('Empleados', empleados.count()),
+        ('Usuarios de empleado', Usuario_Empleado.objects.filter(empleado__in=empleados).count()),
+    ]
+
+
+def borrar_empleados(empleados):
+    borrados = Counter()
+    for ids in _lotes_ids(empleados):
+        with transaction.atomic():
+            concesionarios = set(Empleado.objects.filter(pk__in=ids).values_list('concesionario_id', flat=True))
+            borrados['Usuarios de empleado'] += _borrar(Usuario_Empleado.objects.filter(empleado_id__in=ids))
+            borrados['Empleados'] += _borrar(Empleado.objects.filter(pk__in=ids))
+            obtener_buscador().eliminar(INDICES['empleado'], ids)
+            invalidar(*(f"concesionario:{pk}:empleados" for pk in concesionarios))
+    return dict(borrados)
+
+
+def plan_cambio_empleados(empleados):
+    return [('Empleados', empleados.count())]
+
+
+def cambiar_empleados(empleados, puesto=None, salario=None, porcentaje=None):
+    """Cambia el puesto y/o el salario (fijo o en porcentaje) con un solo UPDATE."""
+    cambios = {}
+    if puesto:
+        cambios['puesto'] = puesto
+    if salario is not None:
+        cambios['salario'] = salario
+    elif porcentaje is not None:
+        # Como en cambiar_precio_coches: EmpleadosMasivoForm ya valida el rango y el UPDATE lo asegura
+        salario = Round(F('salario') * (1 + porcentaje / 100), 2)
+        cambios['salario'] = Least(Greatest(salario, Value(Decimal('0.01'))), Value(SALARIO_MAXIMO))
+    ids = list(empleados.order_by().values_list('pk', flat=True))
+    with transaction.atomic():
+        actualizados = empleados.update(**cambios)
+        if puesto:
+            # El puesto está en el índice de búsqueda
+            for lote in _bloques(ids, LOTE):
+                _reindexar('empleado', lote)
+        concesionarios = set()
+        for lote in _bloques(ids, LOTE):
+            concesionarios |= set(Empleado.objects.filter(pk__in=lote).values_list('concesionario_id', flat=True))
+        invalidar(*(f"concesionario:{pk}:empleados" for pk in concesionarios))
+    return actualizados
+
+
+# -------------------------------------------------------------------
+# Ventas
+# -------------------------------------------------------------------
+def plan_borrado_ventas(ventas):
+    return [
+        ('Ventas', ventas.count()),
+        ('Coches vendidos afectados (se recalcula su stock)', Coche.objects.filter(venta__in=ventas).distinct().count()),
+    ]
+
+
+def borrar_ventas(ventas):
+    borrados = Counter()
+    for ids in _lotes_ids(ventas):
+        with transaction.atomic():
+            lote = Venta.objects.filter(pk__in=ids)
+            grupos = resumenes.grupos_de(lote)
+            coches = set(lote.values_list('coche_id', flat=True))
+            borrados['Ventas'] += _borrar(lote)
+            resumenes.recalcular_grupos(grupos)
+            stock.actualizar_vendido(coches)
+    return dict(borrados)
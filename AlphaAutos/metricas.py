@@ -0,0 +1,265 @@
+import bisect
+import contextvars
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+# -------------------------------------------------------------------
+# Métricas por vista
+# -------------------------------------------------------------------
+# MetricasMiddleware mide cada petición muestreada y la anota con el
+# nombre de la vista resuelta ('AlphaAutos:coche_list'):
+#
+#   tiempo_ms          tiempo total de la petición
+#   consultas          número de consultas SQL (connection.execute_wrapper)
+#   tiempo_bd_ms       tiempo dentro de esas consultas
+#   tiempo_plantillas_ms  tiempo de render() de las plantillas
+#   bytes              tamaño de la respuesta (no en las de streaming)
+#
+# Cada medida va a un histograma de cubetas fijas, como los de
+# Prometheus: memoria constante, sin guardar muestras, y de ahí salen los
+# percentiles (interpolando dentro de la cubeta). Se ven en /metricas/
+# (staff) y en /metricas/prometheus/ (formato de texto de Prometheus).
+#
+# ALPHAAUTOS_METRICAS_MUESTREO es la fracción de peticiones que se mide
+# (0.1 = una de cada diez); las demás solo pagan un random(). Los datos
+# son del proceso: con varios procesos, cada uno tiene los suyos.
+
+CUBETAS = {
+    'tiempo_ms': (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+    'consultas': (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144),
+    'tiempo_bd_ms': (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+    'tiempo_plantillas_ms': (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000),
+    'bytes': (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+}
+
+PERCENTILES = (50, 90, 99)
+
+# Medición de la petición en curso (cada hilo / tarea asyncio la suya)
+_medicion = contextvars.ContextVar('medicion', default=None)
+
+
+class Histograma:
+    """Cubetas acumulativas de límite superior fijo, más suma, cuenta y máximo."""
+
+    def __init__(self, limites):
+        self.limites = tuple(limites)
+        # Una más para lo que pasa del último límite (+Inf)
+        self.cubetas = [0] * (len(self.limites) + 1)
+        self.suma = 0
+        self.cuenta = 0
+        self.maximo = 0
+
+    def anotar(self, valor):
+        self.cubetas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.cuenta += 1
+        self.maximo = max(self.maximo, valor)
+
+    def percentil(self, p):
+        """Estimación del percentil `p` (0-100) interpolando dentro de su cubeta."""
+        if not self.cuenta:
+            return None
+        objetivo = self.cuenta * p / 100
+        acumulado = 0
+        for i, n in enumerate(self.cubetas):
+            if n and acumulado + n >= objetivo:
+                inferior = self.limites[i - 1] if i else 0
+                superior = self.limites[i] if i < len(self.limites) else self.maximo
+                # Nunca por encima de lo que realmente se ha visto
+                return min(inferior + (superior - inferior) * (objetivo - acumulado) / n, self.maximo)
+            acumulado += n
+        return self.maximo
+
+    def acumuladas(self):
+        """[(límite, peticiones <= límite)], terminando en ('+Inf', cuenta)."""
+        resultado = []
+        acumulado = 0
+        for limite, n in zip(self.limites + ('+Inf',), self.cubetas):
+            acumulado += n
+            resultado.append((limite, acumulado))
+        return resultado
+
+
+class Registro:
+    """Histogramas por vista y contadores por código de estado."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.limpiar()
+
+    def limpiar(self):
+        with self._lock:
+            self._vistas = {}
+            self._estados = {}
+
+    def anotar(self, vista, estado, medidas):
+        with self._lock:
+            histogramas = self._vistas.get(vista)
+            if histogramas is None:
+                histogramas = self._vistas[vista] = {nombre: Histograma(l) for nombre, l in CUBETAS.items()}
+            for nombre, valor in medidas.items():
+                histogramas[nombre].anotar(valor)
+            clave = (vista, estado)
+            self._estados[clave] = self._estados.get(clave, 0) + 1
+
+    def resumen(self):
+        """[{vista, peticiones, <medida>: {p50, p90, p99, media, max}}] de la más lenta (p90) a la más rápida."""
+        with self._lock:
+            filas = []
+            for vista, histogramas in self._vistas.items():
+                fila = {'vista': vista, 'peticiones': histogramas['tiempo_ms'].cuenta}
+                for nombre, histograma in histogramas.items():
+                    fila[nombre] = {f"p{p}": histograma.percentil(p) for p in PERCENTILES}
+                    fila[nombre]['media'] = histograma.suma / histograma.cuenta if histograma.cuenta else None
+                    fila[nombre]['max'] = histograma.maximo if histograma.cuenta else None
+                filas.append(fila)
+        return sorted(filas, key=lambda fila: -(fila['tiempo_ms']['p90'] or 0))
+
+    def prometheus(self):
+        """Texto en el formato de exposición de Prometheus (0.0.4)."""
+        lineas = []
+        with self._lock:
+            for nombre in CUBETAS:
+                metrica = f"alphaautos_{nombre}"
+                lineas.append(f"# TYPE {metrica} histogram")
+                for vista, histogramas in sorted(self._vistas.items()):
+                    histograma = histogramas[nombre]
+                    if not histograma.cuenta:
+                        continue
+                    etiqueta = f'vista="{_escapar(vista)}"'
+                    for limite, acumulado in histograma.acumuladas():
+                        lineas.append(f'{metrica}_bucket{{{etiqueta},le="{limite}"}} {acumulado}')
+                    lineas.append(f"{metrica}_sum{{{etiqueta}}} {histograma.suma}")
+                    lineas.append(f"{metrica}_count{{{etiqueta}}} {histograma.cuenta}")
+            lineas.append("# TYPE alphaautos_peticiones_total counter")
+            for (vista, estado), total in sorted(self._estados.items()):
+                lineas.append(f'alphaautos_peticiones_total{{vista="{_escapar(vista)}",estado="{estado}"}} {total}')
+        return '\n'.join(lineas) + '\n'
+
+
+def _escapar(texto):
+    return texto.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registro = Registro()
+
+
+def prometheus_cache(estadisticas):
+    """Los contadores de cache.estadisticas() en formato Prometheus."""
+    lineas = ["# TYPE alphaautos_cache_obtener_total counter"]
+    for clave, total in sorted(estadisticas['obtener'].items()):
+        tipo, resultado = clave.rsplit('.', 1)
+        lineas.append(f'alphaautos_cache_obtener_total{{tipo="{_escapar(tipo)}",resultado="{resultado}"}} {total}')
+    if 'backend' in estadisticas:
+        lineas.append("# TYPE alphaautos_cache_backend gauge")
+        for campo, valor in sorted(estadisticas['backend'].items()):
+            lineas.append(f'alphaautos_cache_backend{{campo="{campo}"}} {valor}')
+    return '\n'.join(lineas) + '\n'
+
+
+class _Medicion:
+
+    def __init__(self):
+        self.consultas = 0
+        self.tiempo_bd = 0.0
+        self.tiempo_plantillas = 0.0
+        self.plantillas_abiertas = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper: envuelve cada consulta de la conexión
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tiempo_bd += time.perf_counter() - inicio
+            self.consultas += 1
+
+
+def muestreo():
+    return getattr(settings, 'ALPHAAUTOS_METRICAS_MUESTREO', 0.1)
+
+
+class MetricasMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tasa = muestreo()
+        if tasa <= 0 or (tasa < 1 and random.random() >= tasa):
+            return self.get_response(request)
+
+        medicion = _Medicion()
+        token = _medicion.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            with ExitStack() as pila:
+                for conexion in connections.all():
+                    pila.enter_context(conexion.execute_wrapper(medicion))
+                response = self.get_response(request)
+        finally:
+            _medicion.reset(token)
+        tiempo = time.perf_counter() - inicio
+
+        medidas = {
+            'tiempo_ms': tiempo * 1000,
+            'consultas': medicion.consultas,
+            'tiempo_bd_ms': medicion.tiempo_bd * 1000,
+            'tiempo_plantillas_ms': medicion.tiempo_plantillas * 1000,
+        }
+        if not response.streaming:
+            medidas['bytes'] = len(response.content)
+        match = getattr(request, 'resolver_match', None)
+        registro.anotar(match.view_name if match else '<sin ruta>', response.status_code, medidas)
+        return response
+
+
+# -------------------------------------------------------------------
+# Tiempo de render de plantillas
+# -------------------------------------------------------------------
+# Backend de plantillas de Django que mide cada render() (el de render()
+# y TemplateResponse, no los {% include %} de dentro). Se activa en
+# settings.TEMPLATES en lugar de DjangoTemplates (y jinja.PlantillasJinja
+# hace lo mismo con Jinja2).
+
+class _PlantillaMedida:
+
+    def __init__(self, plantilla):
+        self._plantilla = plantilla
+
+    def __getattr__(self, nombre):
+        return getattr(self._plantilla, nombre)
+
+    def render(self, context=None, request=None):
+        medicion = _medicion.get()
+        if medicion is None:
+            return self._plantilla.render(context, request)
+        # Un render() dentro de otro (p. ej. un fragmento) no se cuenta dos veces
+        medicion.plantillas_abiertas += 1
+        inicio = time.perf_counter()
+        try:
+            return self._plantilla.render(context, request)
+        finally:
+            medicion.plantillas_abiertas -= 1
+            if not medicion.plantillas_abiertas:
+                medicion.tiempo_plantillas += time.perf_counter() - inicio
+
+
+class MedirPlantillas:
+    """Mixin para un backend de plantillas: mide el render() de lo que devuelve."""
+
+    def from_string(self, template_code):
+        return _PlantillaMedida(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _PlantillaMedida(super().get_template(template_name))
+
+
+class PlantillasMedidas(MedirPlantillas, DjangoTemplates):
+    pass
@@ -0,0 +1,89 @@
+from django.db import migrations
+
+# Índices de texto para las vistas buscar_* (ver AlphaAutos/buscador.py).
+# Las columnas y las consultas de relleno quedan fijadas aquí para que la
+# migración no dependa del código actual de la aplicación.
+INDICES = {
+    'coche': (
+        ('marca', 'modelo', 'concesionario'),
+        'SELECT c.id, m.nombre, c.modelo, k.nombre FROM "AlphaAutos_coche" c '
+        'JOIN "AlphaAutos_marca" m ON m.id = c.marca_id '
+        'JOIN "AlphaAutos_concesionario" k ON k.id = c.concesionario_id',
+    ),
+    'marca': (
+        ('nombre', 'pais_origen'),
+        'SELECT id, nombre, pais_origen FROM "AlphaAutos_marca"',
+    ),
+    'concesionario': (
+        ('nombre', 'ciudad', 'telefono'),
+        'SELECT id, nombre, ciudad, telefono FROM "AlphaAutos_concesionario"',
+    ),
+    'empleado': (
+        ('nombre', 'puesto'),
+        'SELECT id, nombre, puesto FROM "AlphaAutos_empleado"',
+    ),
+    'comprador': (
+        ('usuario', 'telefono', 'email'),
+        'SELECT c.id, u.username, COALESCE(c.telefono, \'\'), u.email FROM "AlphaAutos_comprador" c '
+        'LEFT JOIN "AlphaAutos_usuario" u ON u.id = c.usuario_id',
+    ),
+    'aseguradora': (
+        ('nombre', 'pais', 'telefono'),
+        'SELECT id, nombre, pais, telefono FROM "AlphaAutos_aseguradora"',
+    ),
+}
+
+PESOS = 'ABC'
+
+
+def crear_indices(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for tipo, (campos, consulta) in INDICES.items():
+            tabla = f'alphaautos_busqueda_{tipo}'
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {tabla} USING fts5({', '.join(campos)}, "
+                f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+            schema_editor.execute(f"INSERT INTO {tabla} (rowid, {', '.join(campos)}) {consulta}")
+    elif vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+        schema_editor.execute("CREATE TEXT SEARCH CONFIGURATION alphaautos_es (COPY = spanish)")
+        schema_editor.execute(
+            "ALTER TEXT SEARCH CONFIGURATION alphaautos_es "
+            "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem"
+        )
+        for tipo, (campos, consulta) in INDICES.items():
+            tabla = f'alphaautos_busqueda_{tipo}'
+            documento = ' || '.join(
+                f"setweight(to_tsvector('alphaautos_es'::regconfig, coalesce({campo}, '')), '{peso}')"
+                for campo, peso in zip(campos, PESOS)
+            )
+            columnas = ', '.join(f"{campo} text" for campo in campos)
+            schema_editor.execute(
+                f"CREATE TABLE {tabla} (objeto_id bigint PRIMARY KEY, {columnas}, "
+                f"documento tsvector GENERATED ALWAYS AS ({documento}) STORED)"
+            )
+            schema_editor.execute(f"CREATE INDEX {tabla}_documento ON {tabla} USING gin (documento)")
+            schema_editor.execute(f"INSERT INTO {tabla} (objeto_id, {', '.join(campos)}) {consulta}")
+
+
+def borrar_indices(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('sqlite', 'postgresql'):
+        return
+    for tipo in INDICES:
+        schema_editor.execute(f'DROP TABLE IF EXISTS alphaautos_busqueda_{tipo}')
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP TEXT SEARCH CONFIGURATION IF EXISTS alphaautos_es")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AlphaAutos', '0004_alter_venta_comprador'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, borrar_indices),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:28
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+# Relleno inicial de los resúmenes con las ventas que ya existan
+# (misma lógica que resumenes.reconstruir, fijada aquí).
+FILTROS = {
+    'dia': None,
+    'concesionario': 'coche__concesionario_id',
+    'marca': 'coche__marca_id',
+    'metodo_pago': 'metodo_pago',
+}
+
+
+def rellenar_resumenes(apps, schema_editor):
+    Venta = apps.get_model('AlphaAutos', 'Venta')
+    ResumenVentas = apps.get_model('AlphaAutos', 'ResumenVentas')
+    for dimension, filtro in FILTROS.items():
+        campos = ['fecha_venta'] + ([filtro] if filtro else [])
+        grupos = Venta.objects.values(*campos).order_by().annotate(
+            total_ventas=Count('id'), suma_importes=Sum('precio_final'),
+            precio_min=Min('precio_final'), precio_max=Max('precio_final'),
+        )
+        ResumenVentas.objects.bulk_create((
+            ResumenVentas(
+                dimension=dimension,
+                fecha=grupo.pop('fecha_venta'),
+                clave=str(grupo.pop(filtro)) if filtro else '',
+                **grupo,
+            )
+            for grupo in grupos.iterator(chunk_size=2000)
+        ), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AlphaAutos', '0005_indice_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenVentas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('dia', 'Día'), ('concesionario', 'Concesionario'), ('marca', 'Marca'), ('metodo_pago', 'Método de pago')], max_length=20)),
+                ('fecha', models.DateField()),
+                ('clave', models.CharField(blank=True, max_length=50)),
+                ('total_ventas', models.PositiveIntegerField(default=0)),
+                ('suma_importes', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('precio_min', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('precio_max', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'fecha', 'clave'), name='resumen_ventas_unico')],
+            },
+        ),
+        migrations.RunPython(rellenar_resumenes, migrations.RunPython.noop),
+    ]
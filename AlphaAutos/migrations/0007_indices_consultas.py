@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AlphaAutos', '0006_resumen_ventas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coche',
+            index=models.Index(fields=['-fecha_fabricacion', 'id'], name='coche_fecha_fab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coche',
+            index=models.Index(fields=['transmision', 'marca'], name='coche_transmision_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='marca',
+            index=models.Index(fields=['nombre', 'id'], name='marca_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['coche', '-fecha_venta'], name='venta_coche_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['fecha_venta', 'metodo_pago'], name='venta_fecha_pago_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:35
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def marcar_vendidos(apps, schema_editor):
+    Coche = apps.get_model('AlphaAutos', 'Coche')
+    Venta = apps.get_model('AlphaAutos', 'Venta')
+    Coche.objects.filter(Exists(Venta.objects.filter(coche_id=OuterRef('pk')))).update(vendido=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AlphaAutos', '0007_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coche',
+            name='vendido',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(marcar_vendidos, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='coche',
+            index=models.Index(condition=models.Q(('vendido', False)), fields=['marca', 'id'], name='coche_disponible_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:39
+
+import AlphaAutos.almacen
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def contar_referencias(apps, schema_editor):
+    Coche = apps.get_model('AlphaAutos', 'Coche')
+    ArchivoImagen = apps.get_model('AlphaAutos', 'ArchivoImagen')
+    filas = Coche.objects.exclude(imagen='').exclude(imagen__isnull=True).values('imagen').order_by().annotate(total=Count('id'))
+    ArchivoImagen.objects.bulk_create(
+        [ArchivoImagen(nombre=fila['imagen'], referencias=fila['total']) for fila in filas], batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AlphaAutos', '0008_coche_vendido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivoImagen',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255, unique=True)),
+                ('referencias', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='coche',
+            name='imagen',
+            field=models.ImageField(blank=True, null=True, storage=AlphaAutos.almacen.almacen_imagenes, upload_to='coches/'),
+        ),
+        migrations.RunPython(contar_referencias, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum
+
+# Las BD de antes podían tener varias ventas del mismo coche (generar_datos
+# las repartía al azar). Se deja activa la más reciente de cada coche y el
+# resto se marca como anulada; los resúmenes se rehacen sin las anuladas
+# (misma lógica que resumenes.reconstruir, fijada aquí).
+FILTROS = {
+    'dia': None,
+    'concesionario': 'coche__concesionario_id',
+    'marca': 'coche__marca_id',
+    'metodo_pago': 'metodo_pago',
+}
+
+
+def anular_duplicadas(apps, schema_editor):
+    Venta = apps.get_model('AlphaAutos', 'Venta')
+    ResumenVentas = apps.get_model('AlphaAutos', 'ResumenVentas')
+    ultima = Venta.objects.filter(coche_id=OuterRef('coche_id')).order_by('-fecha_venta', '-id').values('id')[:1]
+    if not Venta.objects.exclude(id=Subquery(ultima)).update(anulada=True):
+        return
+    ResumenVentas.objects.all().delete()
+    for dimension, filtro in FILTROS.items():
+        campos = ['fecha_venta'] + ([filtro] if filtro else [])
+        grupos = Venta.objects.filter(anulada=False).values(*campos).order_by().annotate(
+            total_ventas=Count('id'), suma_importes=Sum('precio_final'),
+            precio_min=Min('precio_final'), precio_max=Max('precio_final'),
+        )
+        ResumenVentas.objects.bulk_create((
+            ResumenVentas(
+                dimension=dimension,
+                fecha=grupo.pop('fecha_venta'),
+                clave=str(grupo.pop(filtro)) if filtro else '',
+                **grupo,
+            )
+            for grupo in grupos.iterator(chunk_size=2000)
+        ), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AlphaAutos', '0009_archivos_imagen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coche',
+            name='reservado_hasta',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='coche',
+            name='reservado_por',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='venta',
+            name='anulada',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(anular_duplicadas, migrations.RunPython.noop),
+    ]
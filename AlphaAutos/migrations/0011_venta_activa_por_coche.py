@@ -0,0 +1,20 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Aparte de 0010: en PostgreSQL, crear el índice en la misma transacción
+    # que el UPDATE de las ventas anuladas puede fallar con 'pending trigger events'
+
+    dependencies = [
+        ('AlphaAutos', '0010_reservas_venta_activa'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='venta',
+            constraint=models.UniqueConstraint(condition=models.Q(('anulada', False)), fields=('coche',), name='venta_activa_por_coche'),
+        ),
+    ]
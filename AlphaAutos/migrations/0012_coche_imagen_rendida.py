@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AlphaAutos', '0011_venta_activa_por_coche'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coche',
+            name='imagen_rendida',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='coche',
+            index=models.Index(fields=['imagen'], name='coche_imagen_idx'),
+        ),
+    ]
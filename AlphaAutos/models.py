@@ -2,6 +2,8 @@ from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
+from .almacen import almacen_imagenes
+
 # Definicion de los tipos de usuairios
 class Usuario(AbstractUser):
     ADMINISTRADOR = 1
@@ -73,6 +75,12 @@ class Marca(models.Model):
     anio_fundacion = models.IntegerField(null=True)
     descripcion = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # Listados de coches ordenados por marca (ORDEN_MARCA)
+            models.Index(fields=['nombre', 'id'], name='marca_nombre_idx'),
+        ]
+
     def __str__(self):
         return self.nombre
 
@@ -90,7 +98,29 @@ class Coche(models.Model):
     transmision = models.CharField(max_length=2, choices=TRANSMISIONES, default='MT')
     fecha_fabricacion = models.DateField()
     #Nuevo campo para la imagen del coche
-    imagen = models.ImageField(upload_to='coches/', null=True, blank=True)
+    imagen = models.ImageField(upload_to='coches/', storage=almacen_imagenes, null=True, blank=True)
+    # Nombre de la imagen cuyas rendiciones ya están generadas (ver imagenes.py): si no es
+    # el de `imagen`, el filtro |rendicion sirve el original sin preguntar al almacenamiento
+    imagen_rendida = models.CharField(max_length=100, blank=True, default='', editable=False)
+    # Copia de "tiene alguna venta", mantenida por las señales de Venta (ver stock.py)
+    vendido = models.BooleanField(default=False, editable=False)
+    # Reserva mientras alguien rellena la venta (ver reservas.py); caduca sola
+    reservado_por = models.ForeignKey(
+        Usuario, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+'
+    )
+    reservado_hasta = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Coches disponibles (coches_sin_ventas y VentaModelForm), por marca
+            models.Index(fields=['marca', 'id'], condition=models.Q(vendido=False), name='coche_disponible_idx'),
+            # coches_por_fecha: rango de fechas ordenado por (-fecha_fabricacion, id)
+            models.Index(fields=['-fecha_fabricacion', 'id'], name='coche_fecha_fab_idx'),
+            # coches_transmision: transmision IN (...)
+            models.Index(fields=['transmision', 'marca'], name='coche_transmision_idx'),
+            # Coches con una imagen dada (rendiciones listas, referencias de ArchivoImagen)
+            models.Index(fields=['imagen'], name='coche_imagen_idx'),
+        ]
 
     def __str__(self):
         return f"{self.marca.nombre} {self.modelo} - {self.precio} €"
@@ -113,6 +143,20 @@ class Venta(models.Model):
     fecha_venta = models.DateField(default=timezone.now)
     precio_final = models.DecimalField(max_digits=10, decimal_places=2)
     metodo_pago = models.CharField(max_length=50)
+    # Una venta anulada no cuenta: ni deja el coche vendido ni entra en los resúmenes
+    anulada = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            # Un coche solo puede tener una venta activa (ver reservas.py)
+            models.UniqueConstraint(fields=['coche'], condition=models.Q(anulada=False), name='venta_activa_por_coche'),
+        ]
+        indexes = [
+            # ultimo_cliente_coche: última venta de un coche
+            models.Index(fields=['coche', '-fecha_venta'], name='venta_coche_fecha_idx'),
+            # Recalcular un grupo de ResumenVentas: un día (y un método de pago)
+            models.Index(fields=['fecha_venta', 'metodo_pago'], name='venta_fecha_pago_idx'),
+        ]
 
     def __str__(self):
         nombre_comprador = self.comprador.usuario.username if self.comprador else "Anónimo"
@@ -153,3 +197,38 @@ class Mantenimiento(models.Model):
     def __str__(self):
         return f"Mantenimiento general - {self.fecha_revision}"
 
+
+
+# ResumenVentas (tabla de agregados de Venta, mantenida por señales)
+class ResumenVentas(models.Model):
+    DIMENSIONES = [
+        ('dia', 'Día'),
+        ('concesionario', 'Concesionario'),
+        ('marca', 'Marca'),
+        ('metodo_pago', 'Método de pago'),
+    ]
+    dimension = models.CharField(max_length=20, choices=DIMENSIONES)
+    fecha = models.DateField()
+    # Id del concesionario o de la marca, el método de pago, o '' para 'dia'
+    clave = models.CharField(max_length=50, blank=True)
+    total_ventas = models.PositiveIntegerField(default=0)
+    suma_importes = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    precio_min = models.DecimalField(max_digits=10, decimal_places=2)
+    precio_max = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'fecha', 'clave'], name='resumen_ventas_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_dimension_display()} {self.clave} {self.fecha}: {self.total_ventas} ventas"
+
+
+# ArchivoImagen (cuántos coches usan cada fichero de imagen, ver imagenes.py)
+class ArchivoImagen(models.Model):
+    nombre = models.CharField(max_length=255, unique=True)
+    referencias = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.nombre} ({self.referencias})"
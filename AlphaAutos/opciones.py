@@ -0,0 +1,66 @@
+from . import buscador, reservas
+from .models import *
+from .paginacion import ORDEN_MARCA
+
+# -------------------------------------------------------------------
+# Desplegables con búsqueda remota
+# -------------------------------------------------------------------
+# Los <select> de coche, comprador, marca y concesionario de los
+# formularios pintaban una <option> por fila de la tabla: en crear_venta,
+# todos los coches (para un superusuario) y todos los compradores. Ahora
+# usan SelectRemoto (form.py), que solo pinta la opción elegida; el resto
+# las pide script.js a /opciones/<relacion>/?q=...&despues=<cursor>, de
+# 20 en 20, con la paginación por cursor de paginacion.py y la búsqueda
+# del índice de texto (buscador.py).
+#
+# Al validar, ModelChoiceField ya solo busca el id enviado en el queryset
+# de la relación (un SELECT ... WHERE id = X): no hace falta traer las
+# opciones. consulta() es la misma para el formulario y para la API, así
+# que la API no ofrece nada que el formulario vaya a rechazar.
+
+
+class Relacion:
+    """
+    Opciones de un desplegable: `consulta(usuario)` da el queryset (con lo
+    que necesita el __str__ de cada opción), `orden` el orden estable para
+    el cursor, `tipo` el índice de buscador.py y `permisos` los que valen
+    para pedirlas (basta uno; vacío = cualquiera con sesión).
+    """
+
+    def __init__(self, consulta, orden, tipo, permisos=()):
+        self.consulta = consulta
+        self.orden = orden
+        self.tipo = tipo
+        self.permisos = permisos
+
+    def puede(self, usuario):
+        return not self.permisos or any(usuario.has_perm(permiso) for permiso in self.permisos)
+
+    def buscar(self, usuario, texto):
+        """Queryset de las opciones de `usuario` que coinciden con `texto` (todas si no hay texto)."""
+        # La búsqueda va como subconsulta de la misma consulta: el filtro de
+        # consulta() y el cursor se aplican sobre todas las coincidencias
+        return buscador.buscar(self.consulta(usuario), self.tipo, {None: texto})
+
+
+def coches_venta(usuario):
+    # El superusuario puede elegir cualquier coche (vendido o no); el resto, los que puede vender
+    coches = Coche.objects.all() if usuario and usuario.is_superuser else reservas.disponibles(usuario)
+    return coches.select_related('marca')
+
+
+RELACIONES = {
+    'coche_venta': Relacion(
+        coches_venta, ORDEN_MARCA, 'coche', ('AlphaAutos.add_venta', 'AlphaAutos.change_venta'),
+    ),
+    'comprador': Relacion(
+        lambda usuario: Comprador.objects.select_related('usuario'), ('usuario__username', 'id'), 'comprador',
+        ('AlphaAutos.add_venta', 'AlphaAutos.change_venta'),
+    ),
+    'marca': Relacion(
+        lambda usuario: Marca.objects.all(), ('nombre', 'id'), 'marca',
+        ('AlphaAutos.add_coche', 'AlphaAutos.change_coche'),
+    ),
+    # También en el buscador de empleados, abierto a cualquiera con sesión
+    'concesionario': Relacion(lambda usuario: Concesionario.objects.all(), ('nombre', 'id'), 'concesionario'),
+}
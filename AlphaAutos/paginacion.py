@@ -0,0 +1,274 @@
+import base64
+import json
+from functools import reduce
+
+from django.db.models import F, Q
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template
+
+from . import buscador
+from .replicas import alias_lectura
+
+# -------------------------------------------------------------------
+# Paginación por cursor (keyset / seek)
+# -------------------------------------------------------------------
+# En lugar de OFFSET, cada página se pide "a partir de" los valores de
+# ordenación de la última fila vista. Así el coste de cada página es el
+# mismo sea la primera o la diezmilésima, y los cursores son estables
+# aunque se inserten filas nuevas mientras se navega.
+
+# Órdenes estables usados por los listados de coches (el id desempata)
+ORDEN_MARCA = ('marca__nombre', 'id')
+ORDEN_FECHA = ('-fecha_fabricacion', 'id')
+# Y por los resultados de los buscadores
+ORDEN_NOMBRE = ('nombre', 'id')
+ORDEN_USUARIO = ('usuario__username', 'id')
+ORDEN_VENTA = ('-fecha_venta', 'id')
+
+TAMANIO_PAGINA = 50
+TAMANIO_PAGINA_MAX = 500
+
+# Filas que se renderizan de golpe en el modo streaming
+FILAS_POR_BLOQUE = 200
+
+
+def _codificar_cursor(valores):
+    texto = json.dumps(valores, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def _decodificar_cursor(cursor, num_campos):
+    # Un cursor manipulado o de otro listado no debe romper la vista:
+    # simplemente se vuelve a la primera página.
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(valores, list) or len(valores) != num_campos:
+        return None
+    return valores
+
+
+def _valor_campo(objeto, campo):
+    # 'marca__nombre' -> objeto.marca.nombre (None si la relación está vacía)
+    for parte in campo.split('__'):
+        if objeto is None:
+            return None
+        objeto = getattr(objeto, parte)
+    return objeto
+
+
+def _admite_nulos(modelo, campo):
+    # 'usuario__username' admite NULL si lo admite la FK usuario o el propio username
+    for parte in campo.split('__'):
+        definicion = modelo._meta.get_field(parte)
+        if definicion.null:
+            return True
+        modelo = definicion.related_model
+    return False
+
+
+def _igual(nombre, valor):
+    return Q(**{f"{nombre}__isnull": True}) if valor is None else Q(**{nombre: valor})
+
+
+def _siguientes(nombre, valor, descendente, nulos, hacia_atras):
+    # Filas que van detrás de `valor` en este campo. Los NULL van siempre al
+    # final (NULLS LAST): detrás de un valor también están los NULL, y
+    # detrás de un NULL no hay nada; hacia atrás, al revés
+    if valor is None:
+        return Q(**{f"{nombre}__isnull": False}) if hacia_atras else None
+    condicion = Q(**{f"{nombre}__lt" if descendente else f"{nombre}__gt": valor})
+    if nulos and not hacia_atras:
+        condicion |= Q(**{f"{nombre}__isnull": True})
+    return condicion
+
+
+def _filtro_seek(orden, valores, nulos=(), hacia_atras=False):
+    # (a, b) > (x, y)  ==>  a > x  OR  (a = x AND b > y)
+    condiciones = []
+    for i, campo in enumerate(orden):
+        nombre = campo.lstrip('-')
+        descendente = campo.startswith('-') != hacia_atras
+        siguientes = _siguientes(nombre, valores[i], descendente, nombre in nulos, hacia_atras)
+        if siguientes is not None:
+            iguales = [_igual(orden[j].lstrip('-'), valores[j]) for j in range(i)]
+            condiciones.append(reduce(lambda a, b: a & b, iguales, Q()) & siguientes)
+    return reduce(lambda a, b: a | b, condiciones)
+
+
+def _ordenar(orden, nulos=(), hacia_atras=False):
+    # Los campos que admiten NULL los llevan al final (al principio hacia atrás)
+    expresiones = []
+    for campo in orden:
+        nombre = campo.lstrip('-')
+        descendente = campo.startswith('-') != hacia_atras
+        if nombre not in nulos:
+            expresiones.append(f"-{nombre}" if descendente else nombre)
+            continue
+        expresion = F(nombre).desc if descendente else F(nombre).asc
+        expresiones.append(expresion(nulls_first=True) if hacia_atras else expresion(nulls_last=True))
+    return expresiones
+
+
+class PaginaKeyset:
+    """Página de resultados con los cursores para moverse a la anterior/siguiente."""
+
+    def __init__(self, request, objetos, orden, cursor_siguiente, cursor_anterior):
+        self.request = request
+        self.objetos = objetos
+        self.orden = orden
+        self.cursor_siguiente = cursor_siguiente
+        self.cursor_anterior = cursor_anterior
+
+    def __getstate__(self):
+        # Para poder guardarla en caché: la request se vuelve a asignar al leerla
+        estado = self.__dict__.copy()
+        estado['request'] = None
+        return estado
+
+    def __iter__(self):
+        return iter(self.objetos)
+
+    def __len__(self):
+        return len(self.objetos)
+
+    def __bool__(self):
+        return bool(self.objetos)
+
+    def _url(self, parametro=None, cursor=None):
+        # Los demás parámetros (filtros, tamanio, formato...) se mantienen
+        query = self.request.GET.copy()
+        query.pop('despues', None)
+        query.pop('antes', None)
+        if parametro:
+            query[parametro] = cursor
+        return f"?{query.urlencode()}"
+
+    @property
+    def tiene_siguiente(self):
+        return self.cursor_siguiente is not None
+
+    @property
+    def tiene_anterior(self):
+        return self.cursor_anterior is not None
+
+    @property
+    def url_siguiente(self):
+        return self._url('despues', self.cursor_siguiente) if self.tiene_siguiente else None
+
+    @property
+    def url_anterior(self):
+        return self._url('antes', self.cursor_anterior) if self.tiene_anterior else None
+
+    @property
+    def url_primera(self):
+        return self._url()
+
+    # Solo las páginas por relevancia (PaginaRelevancia) enlazan al listado completo
+    url_todas = None
+
+
+class PaginaRelevancia(PaginaKeyset):
+    """Primera página de una búsqueda, por relevancia: sin cursores, con enlace al listado completo."""
+
+    def __init__(self, request, objetos, orden, completa):
+        super().__init__(request, objetos, orden, None, None)
+        self.completa = completa
+
+    @property
+    def url_todas(self):
+        return None if self.completa else self._url('orden', 'lista')
+
+
+def _tamanio_pagina(request):
+    try:
+        tamanio = int(request.GET.get('tamanio', TAMANIO_PAGINA))
+    except ValueError:
+        return TAMANIO_PAGINA
+    return max(1, min(tamanio, TAMANIO_PAGINA_MAX))
+
+
+def paginar_keyset(request, queryset, orden):
+    """
+    Devuelve una PaginaKeyset con las filas de `queryset` ordenadas por `orden`.
+    Lee los cursores ?despues= / ?antes= del querystring.
+    """
+    orden = list(orden)
+    nulos = {campo.lstrip('-') for campo in orden if _admite_nulos(queryset.model, campo.lstrip('-'))}
+    tamanio = _tamanio_pagina(request)
+    despues = _decodificar_cursor(request.GET.get('despues', ''), len(orden))
+    antes = _decodificar_cursor(request.GET.get('antes', ''), len(orden)) if despues is None else None
+
+    if antes is not None:
+        # Página anterior: se recorre el orden al revés y se da la vuelta al resultado
+        qs = queryset.filter(_filtro_seek(orden, antes, nulos, hacia_atras=True)).order_by(*_ordenar(orden, nulos, hacia_atras=True))
+        filas = list(qs[:tamanio + 1])
+        hay_mas = len(filas) > tamanio
+        filas = filas[:tamanio][::-1]
+        hay_anterior, hay_siguiente = hay_mas, True
+    else:
+        qs = queryset
+        if despues is not None:
+            qs = qs.filter(_filtro_seek(orden, despues, nulos))
+        filas = list(qs.order_by(*_ordenar(orden, nulos))[:tamanio + 1])
+        hay_siguiente = len(filas) > tamanio
+        filas = filas[:tamanio]
+        hay_anterior = despues is not None
+
+    def cursor(fila):
+        return _codificar_cursor([_valor_campo(fila, campo.lstrip('-')) for campo in orden])
+
+    cursor_siguiente = cursor(filas[-1]) if filas and hay_siguiente else None
+    cursor_anterior = cursor(filas[0]) if filas and hay_anterior else None
+    return PaginaKeyset(request, filas, orden, cursor_siguiente, cursor_anterior)
+
+
+def paginar_busqueda(request, queryset, tipo, criterios, orden):
+    """
+    Resultados de un buscador (buscador.py). Con texto, las coincidencias
+    más relevantes, tantas como una página; ?orden=lista da todas por
+    `orden`, paginadas por cursor. Sin texto, o si el backend no ordena
+    por relevancia, directamente el listado.
+    """
+    if request.GET.get('orden') != 'lista':
+        tamanio = _tamanio_pagina(request)
+        relevantes = buscador.mas_relevantes(queryset, tipo, criterios, tamanio + 1)
+        if relevantes is not None:
+            return PaginaRelevancia(request, relevantes[:tamanio], orden, completa=len(relevantes) <= tamanio)
+    return paginar_keyset(request, buscador.buscar(queryset, tipo, criterios), orden)
+
+
+# -------------------------------------------------------------------
+# Modo streaming para listados de coches (?formato=stream)
+# -------------------------------------------------------------------
+def _bloques(iterable, tamanio):
+    bloque = []
+    for elemento in iterable:
+        bloque.append(elemento)
+        if len(bloque) == tamanio:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def streaming_coches(request, queryset, titulo):
+    """
+    Devuelve los coches como StreamingHttpResponse, renderizando
+    'for_row_coche.html' por bloques. La memoria no depende del tamaño de la tabla.
+    """
+    inicio = get_template('concesionario/coches_stream_inicio.html')
+    filas = get_template('concesionario/filas_coche.html')
+    fin = get_template('concesionario/coches_stream_fin.html')
+    # generar() corre cuando la vista ya ha terminado: la BD (réplica o primario) se fija aquí
+    queryset = queryset.using(alias_lectura())
+
+    def generar():
+        yield inicio.render({'titulo': titulo}, request)
+        for bloque in _bloques(queryset.iterator(chunk_size=FILAS_POR_BLOQUE), FILAS_POR_BLOQUE):
+            yield filas.render({'coches': bloque}, request)
+        yield fin.render({}, request)
+
+    return StreamingHttpResponse(generar(), content_type='text/html; charset=utf-8')
@@ -0,0 +1,147 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.base import Node, TokenType
+
+# -------------------------------------------------------------------
+# Perfil del render de plantillas
+# -------------------------------------------------------------------
+# metricas.py da el tiempo total de render de cada vista; esto dice en qué
+# se va: cuánto tarda cada etiqueta ({% for %}, {% include %},
+# {% fila_coche %}...) y cada variable ({{ coche.marca.nombre|upper }}),
+# con su plantilla y línea.
+#
+# Con ALPHAAUTOS_PERFIL_PLANTILLAS (por defecto, en DEBUG) instalar()
+# envuelve Node.render_annotated, que Django llama para cada nodo. Fuera
+# de un perfil, el coste es un ContextVar.get() por nodo (el texto fijo
+# no pasa por ahí). Para perfilar:
+#
+#   - en el navegador, como staff: cualquier página con ?perfil_plantillas
+#     (PerfilPlantillasMiddleware) devuelve el informe en texto en vez de
+#     la página;
+#   - en código: with perfilar() as perfil: ... ; perfil.informe().
+#
+# Por cada nodo se anotan llamadas, tiempo total (con lo de dentro) y
+# tiempo propio (sin lo que tardan sus nodos hijos).
+
+PARAMETRO = 'perfil_plantillas'
+
+_perfil = contextvars.ContextVar('perfil_plantillas', default=None)
+
+_original = Node.render_annotated
+
+
+class Perfil:
+
+    def __init__(self):
+        # {(plantilla, línea, etiqueta): [llamadas, total, propio]}
+        self.nodos = {}
+        self._claves = {}
+        # Tiempo de los hijos de cada nodo abierto
+        self._pila = []
+
+    def clave(self, nodo):
+        clave = self._claves.get(nodo)
+        if clave is None:
+            token = nodo.token
+            if token.token_type == TokenType.VAR:
+                etiqueta = f"{{{{ {token.contents} }}}}"
+            else:
+                etiqueta = f"{{% {token.contents.split()[0]} %}}"
+            origen = nodo.origin.template_name if nodo.origin else None
+            clave = self._claves[nodo] = (origen or '<cadena>', token.lineno, etiqueta)
+        return clave
+
+    def anotar(self, nodo, total, hijos):
+        clave = self.clave(nodo)
+        datos = self.nodos.get(clave)
+        if datos is None:
+            datos = self.nodos[clave] = [0, 0.0, 0.0]
+        datos[0] += 1
+        datos[1] += total
+        datos[2] += total - hijos
+
+    def por_plantilla(self):
+        """[(plantilla, tiempo propio)] de la más cara a la más barata."""
+        tiempos = {}
+        for (plantilla, _, _), (_, _, propio) in self.nodos.items():
+            tiempos[plantilla] = tiempos.get(plantilla, 0.0) + propio
+        return sorted(tiempos.items(), key=lambda par: -par[1])
+
+    def por_nodo(self):
+        """[(plantilla, línea, etiqueta, llamadas, total, propio)] por tiempo propio."""
+        filas = [clave + tuple(datos) for clave, datos in self.nodos.items()]
+        return sorted(filas, key=lambda fila: -fila[5])
+
+    def informe(self, limite=40):
+        total = sum(propio for _, propio in self.por_plantilla())
+        lineas = [f"Render de plantillas: {total * 1000:.1f} ms", '', 'Por plantilla (tiempo propio):']
+        for plantilla, propio in self.por_plantilla():
+            lineas.append(f"  {propio * 1000:9.2f} ms  {plantilla}")
+        lineas += ['', f"Por etiqueta y variable (las {limite} más caras):",
+                   f"  {'propio ms':>10}{'total ms':>10}{'llamadas':>10}  sitio"]
+        for plantilla, linea, etiqueta, llamadas, total_nodo, propio in self.por_nodo()[:limite]:
+            lineas.append(
+                f"  {propio * 1000:10.2f}{total_nodo * 1000:10.2f}{llamadas:10d}  {plantilla}:{linea} {etiqueta}"
+            )
+        return '\n'.join(lineas) + '\n'
+
+
+def _render_annotated(self, context):
+    perfil = _perfil.get()
+    if perfil is None:
+        return _original(self, context)
+    perfil._pila.append(0.0)
+    inicio = time.perf_counter()
+    try:
+        return _original(self, context)
+    finally:
+        total = time.perf_counter() - inicio
+        hijos = perfil._pila.pop()
+        if perfil._pila:
+            perfil._pila[-1] += total
+        perfil.anotar(self, total, hijos)
+
+
+@contextmanager
+def perfilar():
+    """Perfila los render de plantillas del bloque (hace falta instalar())."""
+    perfil = Perfil()
+    token = _perfil.set(perfil)
+    try:
+        yield perfil
+    finally:
+        _perfil.reset(token)
+
+
+def instalado():
+    return Node.render_annotated is _render_annotated
+
+
+def instalar():
+    """Se llama desde AlphaautosConfig.ready(). Solo si ALPHAAUTOS_PERFIL_PLANTILLAS."""
+    if getattr(settings, 'ALPHAAUTOS_PERFIL_PLANTILLAS', False):
+        Node.render_annotated = _render_annotated
+
+
+def desinstalar():
+    Node.render_annotated = _original
+
+
+class PerfilPlantillasMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if PARAMETRO not in request.GET or not instalado() or not request.user.is_staff:
+            return self.get_response(request)
+        with perfilar() as perfil:
+            response = self.get_response(request)
+            # El streaming se pinta al consumirlo: dentro del perfil
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return HttpResponse(perfil.informe(), content_type='text/plain; charset=utf-8')
@@ -0,0 +1,143 @@
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+# -------------------------------------------------------------------
+# Lecturas en la réplica
+# -------------------------------------------------------------------
+# Si settings.DATABASES tiene un alias de réplica (ALPHAAUTOS_REPLICA en
+# settings.py), las vistas marcadas con @solo_lectura (listados,
+# búsquedas y detalles) leen de ella y todo lo demás va al primario.
+#
+#   - RouterReplicas: las lecturas de modelos de AlphaAutos dentro de una
+#     vista @solo_lectura van a la réplica. Sesiones, permisos y Usuario
+#     siempre al primario: con retraso en la réplica, un usuario recién
+#     registrado o logueado no existiría todavía.
+#   - ReplicaMiddleware: lectura de lo propio. Si una petición escribe
+#     (POST, o cualquier save()/delete() de un modelo de AlphaAutos que
+#     pase por el router, como los eliminar_* por GET), el navegador recibe la cookie
+#     'alphaautos_primario' y durante ALPHAAUTOS_REPLICA_FIJAR_S segundos
+#     todas sus peticiones leen del primario. Así, tras crear_venta, la
+#     redirección a lista_ventas ya ve la venta nueva.
+#   - Las cargas de la caché del catálogo van siempre al primario (ver
+#     cache.obtener): lo que se cachea tras una invalidación nunca es la
+#     versión antigua que aún tenga la réplica.
+
+COOKIE = 'alphaautos_primario'
+
+METODOS_SEGUROS = {'GET', 'HEAD', 'OPTIONS'}
+
+# ¿Leer de la réplica? Lo activa @solo_lectura mientras dura la vista
+_leer_replica = contextvars.ContextVar('leer_replica', default=False)
+# Estado de la petición en curso (lo crea ReplicaMiddleware)
+_peticion = contextvars.ContextVar('peticion_replica', default=None)
+
+
+def alias_replica():
+    """Alias de la réplica, o None si no hay (y entonces todo va al primario)."""
+    alias = getattr(settings, 'ALPHAAUTOS_REPLICA_ALIAS', None)
+    return alias if alias and alias in settings.DATABASES else None
+
+
+def alias_lectura():
+    """Dónde leería ahora el router (para fijar .using() en lo que se evalúa después, como el streaming)."""
+    return (alias_replica() if _leer_replica.get() else None) or 'default'
+
+
+@contextmanager
+def en_primario():
+    """Dentro del bloque, las lecturas van al primario aunque la vista sea @solo_lectura."""
+    token = _leer_replica.set(False)
+    try:
+        yield
+    finally:
+        _leer_replica.reset(token)
+
+
+def solo_lectura(vista):
+    """Marca una vista que no escribe: sus lecturas van a la réplica si la hay y la petición no está fijada."""
+
+    def a_replica(request):
+        estado = _peticion.get()
+        return request.method in METODOS_SEGUROS and not (estado is not None and estado['fijada'])
+
+    if iscoroutinefunction(vista):
+        # Vistas async: sync_to_async copia el contexto, así que el router lo ve desde el hilo del ORM
+        @functools.wraps(vista)
+        async def envoltura(request, *args, **kwargs):
+            if not a_replica(request):
+                return await vista(request, *args, **kwargs)
+            token = _leer_replica.set(True)
+            try:
+                return await vista(request, *args, **kwargs)
+            finally:
+                _leer_replica.reset(token)
+    else:
+        @functools.wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if not a_replica(request):
+                return vista(request, *args, **kwargs)
+            token = _leer_replica.set(True)
+            try:
+                return vista(request, *args, **kwargs)
+            finally:
+                _leer_replica.reset(token)
+
+    envoltura.solo_lectura = True
+    return envoltura
+
+
+class RouterReplicas:
+
+    @staticmethod
+    def replicable(model):
+        """Modelos que pueden leerse de la réplica: los de AlphaAutos salvo Usuario."""
+        return model._meta.app_label == 'AlphaAutos' and model._meta.label != settings.AUTH_USER_MODEL
+
+    def db_for_read(self, model, **hints):
+        if not _leer_replica.get() or not self.replicable(model):
+            return None
+        return alias_replica()
+
+    def db_for_write(self, model, **hints):
+        # Solo fija la petición lo que luego podría leerse atrasado: guardar la
+        # sesión (index cuenta visitas) o el last_login no cuenta
+        estado = _peticion.get()
+        if estado is not None and self.replicable(model):
+            estado['escribe'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primario y réplica tienen los mismos datos
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # La réplica recibe el esquema por la replicación (o por manage.py copiar_replica)
+        return db == 'default'
+
+
+class ReplicaMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            fijada = float(request.COOKIES.get(COOKIE, 0)) > time.time()
+        except ValueError:
+            fijada = False
+        estado = {'fijada': fijada, 'escribe': False}
+        token = _peticion.set(estado)
+        try:
+            response = self.get_response(request)
+        finally:
+            _peticion.reset(token)
+
+        if alias_replica() and (estado['escribe'] or request.method not in METODOS_SEGUROS):
+            segundos = settings.ALPHAAUTOS_REPLICA_FIJAR_S
+            response.set_cookie(COOKIE, str(time.time() + segundos), max_age=segundos, httponly=True, samesite='Lax')
+        return response
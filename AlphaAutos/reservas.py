@@ -0,0 +1,94 @@
+import threading
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import *
+
+# -------------------------------------------------------------------
+# Reservas y venta de un coche sin vender dos veces
+# -------------------------------------------------------------------
+# Antes, dos compradores podían vender el mismo coche a la vez: el
+# formulario solo lista los coches con vendido=False y nada más lo
+# comprobaba al guardar. Ahora:
+#
+#   - Reclamar un coche es un UPDATE condicional sobre su fila
+#     ("WHERE id = X AND vendido = false AND (sin reserva, caducada o
+#     mía)"). Si devuelve 0 filas, otro se lo ha llevado. En PostgreSQL
+#     solo bloquea esa fila hasta el COMMIT; quien llegue después espera
+#     y vuelve a evaluar el WHERE, ya con vendido = true.
+#   - El POST de reservar_coche (botón Vender) deja el coche reservado
+#     ALPHAAUTOS_RESERVA_S segundos para ese usuario. Las reservas no
+#     hay que limpiarlas: caducan solas.
+#   - En SQLite los escritores de un proceso hacen cola en un Lock en vez
+#     de esperar con el busy_timeout (ver _turno_escritura). Por eso
+#     crear_venta y editar_venta no van en transaction.atomic.
+#   - La restricción única 'venta_activa_por_coche' (una venta no anulada
+#     por coche) es la última barrera si vendido estuviera desincronizado.
+
+
+# Transacciones de escritura de vender() en este proceso, en SQLite
+_escritores_sqlite = threading.Lock()
+
+
+def _libre_para(usuario, ahora):
+    """Coches que `usuario` puede reclamar ahora: sin vender y sin reserva vigente de otro."""
+    return Q(vendido=False) & (
+        Q(reservado_hasta__isnull=True) | Q(reservado_hasta__lte=ahora) | Q(reservado_por=usuario)
+    )
+
+
+def disponibles(usuario):
+    """Coches que puede elegir `usuario` en el formulario de venta."""
+    return Coche.objects.filter(_libre_para(usuario, timezone.now()))
+
+
+def reservar(coche_id, usuario):
+    """Reserva (o renueva) el coche para `usuario`. False si está vendido o reservado por otro."""
+    ahora = timezone.now()
+    return bool(Coche.objects.filter(Q(pk=coche_id) & _libre_para(usuario, ahora)).update(
+        reservado_por=usuario, reservado_hasta=ahora + timedelta(seconds=settings.ALPHAAUTOS_RESERVA_S),
+    ))
+
+
+def liberar(coche_id, usuario):
+    """Quita la reserva de `usuario` sobre el coche (si es suya)."""
+    Coche.objects.filter(pk=coche_id, reservado_por=usuario).update(reservado_por=None, reservado_hasta=None)
+
+
+def _turno_escritura():
+    """
+    En SQLite solo escribe una transacción a la vez en toda la BD. Las que
+    esperan lo hacen con el busy_timeout, que duerme y reintenta con pausas
+    de hasta 100 ms: con cientos esperando, la BD pasa ratos parada. Los
+    hilos de este proceso hacen cola en un Lock, que despierta al siguiente
+    en cuanto se libera. En PostgreSQL no hace falta: bloquea solo la fila.
+    Dentro de otra transacción tampoco: podría tener ya el bloqueo de
+    SQLite y esperar al Lock de quien espera a ese bloqueo.
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        return nullcontext()
+    return _escritores_sqlite
+
+
+def vender(venta, usuario):
+    """
+    Guarda `venta` reclamando antes su coche. Devuelve False, sin guardar
+    nada, si el coche ya está vendido o reservado por otro usuario.
+    """
+    with _turno_escritura(), transaction.atomic():
+        if not reservar(venta.coche_id, usuario):
+            return False
+        try:
+            with transaction.atomic():
+                venta.save()
+        except IntegrityError:
+            # Otra venta activa del coche (vendido desincronizado)
+            return False
+        # Vendido: las señales ya han puesto vendido=True; la reserva sobra
+        Coche.objects.filter(pk=venta.coche_id).update(reservado_por=None, reservado_hasta=None)
+    return True
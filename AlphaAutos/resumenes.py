@@ -0,0 +1,255 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import Greatest, Least, TruncMonth
+
+from .models import *
+
+# -------------------------------------------------------------------
+# Resúmenes de ventas (agregados materializados)
+# -------------------------------------------------------------------
+# resumen_ventas ya no agrega la tabla Venta entera en cada visita. Se
+# guarda una fila de ResumenVentas por día y por:
+#
+#   - 'dia':           todas las ventas del día (clave '')
+#   - 'concesionario': concesionario del coche vendido (clave = id)
+#   - 'marca':         marca del coche vendido (clave = id)
+#   - 'metodo_pago':   método de pago (clave = el texto)
+#
+# Las señales de AlphaAutos/signals.py las actualizan con cada alta,
+# edición o borrado de una Venta. Sumar es siempre incremental; al restar,
+# si la venta quitada era el mínimo o el máximo del grupo, ese grupo se
+# recalcula desde Venta (un solo día y un solo grupo). Las ventas
+# anuladas no cuentan: anular una venta la resta como si se borrase.
+#
+# Para cargas sin señales (bulk_create, SQL): manage.py reconstruir_resumenes
+
+# Filtro sobre Venta de cada dimensión, para recalcular un grupo
+FILTROS = {
+    'dia': None,
+    'concesionario': 'coche__concesionario_id',
+    'marca': 'coche__marca_id',
+    'metodo_pago': 'metodo_pago',
+}
+
+# Agrupaciones que acepta la vista (además de las dimensiones, 'mes')
+AGRUPACIONES = ['dia', 'mes', 'concesionario', 'marca', 'metodo_pago']
+
+
+def estado_venta(pk):
+    """Fecha, precio y claves de una venta tal y como están en la BD (None si no existe o está anulada)."""
+    if pk is None:
+        return None
+    fila = Venta.objects.filter(pk=pk, anulada=False).values(
+        'fecha_venta', 'precio_final', 'metodo_pago', 'coche_id', 'coche__concesionario_id', 'coche__marca_id'
+    ).first()
+    if fila is None:
+        return None
+    return {
+        'coche_id': fila['coche_id'],
+        'fecha': fila['fecha_venta'],
+        'precio': fila['precio_final'],
+        'claves': {
+            'dia': '',
+            'concesionario': str(fila['coche__concesionario_id']),
+            'marca': str(fila['coche__marca_id']),
+            'metodo_pago': fila['metodo_pago'],
+        },
+    }
+
+
+def _grupo(dimension, fecha, clave):
+    return ResumenVentas.objects.filter(dimension=dimension, fecha=fecha, clave=clave)
+
+
+def _sumar(dimension, fecha, clave, precio):
+    actualizadas = _grupo(dimension, fecha, clave).update(
+        total_ventas=F('total_ventas') + 1,
+        suma_importes=F('suma_importes') + precio,
+        precio_min=Least('precio_min', precio),
+        precio_max=Greatest('precio_max', precio),
+    )
+    if actualizadas:
+        return
+    try:
+        with transaction.atomic():
+            ResumenVentas.objects.create(
+                dimension=dimension, fecha=fecha, clave=clave, total_ventas=1,
+                suma_importes=precio, precio_min=precio, precio_max=precio,
+            )
+    except IntegrityError:
+        # Otra petición ha creado el grupo entre medias
+        _sumar(dimension, fecha, clave, precio)
+
+
+def recalcular(dimension, fecha, clave):
+    """Rehace un grupo desde la tabla Venta (o lo borra si ya no tiene ventas)."""
+    ventas = Venta.objects.filter(fecha_venta=fecha, anulada=False)
+    if FILTROS[dimension]:
+        ventas = ventas.filter(**{FILTROS[dimension]: clave})
+    datos = ventas.aggregate(
+        total_ventas=Count('id'), suma_importes=Sum('precio_final'),
+        precio_min=Min('precio_final'), precio_max=Max('precio_final'),
+    )
+    if not datos['total_ventas']:
+        _grupo(dimension, fecha, clave).delete()
+    elif not _grupo(dimension, fecha, clave).update(**datos):
+        ResumenVentas.objects.create(dimension=dimension, fecha=fecha, clave=clave, **datos)
+
+
+def _restar(dimension, fecha, clave, precio):
+    """Quita una venta de su grupo. Devuelve True si el grupo se ha recalculado."""
+    # Solo se puede restar sin más si no se va el último, el mínimo ni el máximo
+    actualizadas = _grupo(dimension, fecha, clave).filter(
+        total_ventas__gt=1, precio_min__lt=precio, precio_max__gt=precio,
+    ).update(
+        total_ventas=F('total_ventas') - 1,
+        suma_importes=F('suma_importes') - precio,
+    )
+    if actualizadas:
+        return False
+    recalcular(dimension, fecha, clave)
+    return True
+
+
+def aplicar_cambio(anterior, nuevo):
+    """
+    Actualiza los resúmenes al pasar una venta del estado `anterior` al
+    `nuevo` (cualquiera de los dos puede ser None: alta o borrado).
+    """
+    if anterior is None and nuevo is None:
+        return
+    with transaction.atomic():
+        for dimension in FILTROS:
+            mismo_grupo = (
+                anterior is not None and nuevo is not None
+                and anterior['fecha'] == nuevo['fecha']
+                and anterior['claves'][dimension] == nuevo['claves'][dimension]
+            )
+            if mismo_grupo and anterior['precio'] == nuevo['precio']:
+                continue
+            recalculado = False
+            if anterior is not None:
+                recalculado = _restar(dimension, anterior['fecha'], anterior['claves'][dimension], anterior['precio'])
+            # Si el grupo se ha recalculado ya incluye la venta en su estado nuevo
+            if nuevo is not None and not (mismo_grupo and recalculado):
+                _sumar(dimension, nuevo['fecha'], nuevo['claves'][dimension], nuevo['precio'])
+
+
+def claves_coche(pk):
+    """Concesionario, marca e imagen actuales de un coche (None si no existe)."""
+    if pk is None:
+        return None
+    return Coche.objects.filter(pk=pk).values('concesionario_id', 'marca_id', 'imagen').first()
+
+
+def mover_coche(pk, anterior, nuevo):
+    """Si un coche ya vendido cambia de concesionario o marca, recalcula los grupos afectados."""
+    if anterior is None or nuevo is None:
+        return
+    cambios = [
+        (dimension, str(anterior[campo]), str(nuevo[campo]))
+        for dimension, campo in (('concesionario', 'concesionario_id'), ('marca', 'marca_id'))
+        if anterior[campo] != nuevo[campo]
+    ]
+    if not cambios:
+        return
+    fechas = Venta.objects.filter(coche_id=pk, anulada=False).values_list('fecha_venta', flat=True).distinct()
+    with transaction.atomic():
+        for fecha in fechas:
+            for dimension, clave_anterior, clave_nueva in cambios:
+                recalcular(dimension, fecha, clave_anterior)
+                recalcular(dimension, fecha, clave_nueva)
+
+
+def grupos_de(ventas):
+    """Grupos (dimension, fecha, clave) de ResumenVentas en los que entran las `ventas`."""
+    grupos = set()
+    filas = ventas.values_list(
+        'fecha_venta', 'coche__concesionario_id', 'coche__marca_id', 'metodo_pago'
+    ).order_by().distinct()
+    for fecha, concesionario, marca, metodo_pago in filas.iterator(chunk_size=2000):
+        grupos.update({
+            ('dia', fecha, ''),
+            ('concesionario', fecha, str(concesionario)),
+            ('marca', fecha, str(marca)),
+            ('metodo_pago', fecha, metodo_pago),
+        })
+    return grupos
+
+
+def recalcular_grupos(grupos):
+    """Para operaciones masivas sin señales (masivo.py): rehace cada grupo afectado."""
+    with transaction.atomic():
+        for dimension, fecha, clave in sorted(grupos):
+            recalcular(dimension, fecha, clave)
+
+
+def reconstruir(dimensiones=None):
+    """Vacía y vuelve a calcular los resúmenes con un GROUP BY por dimensión."""
+    dimensiones = dimensiones or list(FILTROS)
+    with transaction.atomic():
+        ResumenVentas.objects.filter(dimension__in=dimensiones).delete()
+        for dimension in dimensiones:
+            campos = ['fecha_venta'] + ([FILTROS[dimension]] if FILTROS[dimension] else [])
+            grupos = Venta.objects.filter(anulada=False).values(*campos).order_by().annotate(
+                total_ventas=Count('id'), suma_importes=Sum('precio_final'),
+                precio_min=Min('precio_final'), precio_max=Max('precio_final'),
+            )
+            ResumenVentas.objects.bulk_create((
+                ResumenVentas(
+                    dimension=dimension,
+                    fecha=grupo.pop('fecha_venta'),
+                    clave=str(grupo.pop(FILTROS[dimension])) if FILTROS[dimension] else '',
+                    **grupo,
+                )
+                for grupo in grupos.iterator(chunk_size=2000)
+            ), batch_size=2000)
+
+
+# -------------------------------------------------------------------
+# Consultas para la vista
+# -------------------------------------------------------------------
+def _totales(queryset):
+    datos = queryset.aggregate(
+        total_ventas=Sum('total_ventas'), suma_importes=Sum('suma_importes'),
+        precio_min=Min('precio_min'), precio_max=Max('precio_max'),
+    )
+    datos['total_ventas'] = datos['total_ventas'] or 0
+    datos['precio_medio'] = (
+        datos['suma_importes'] / datos['total_ventas'] if datos['total_ventas'] else None
+    )
+    return datos
+
+
+def consultar(desde=None, hasta=None, agrupar=None):
+    """
+    Totales del periodo y, si se pide, el desglose por `agrupar`. Solo lee
+    ResumenVentas: el coste depende del número de grupos, no de ventas.
+    """
+    filtro = {}
+    if desde:
+        filtro['fecha__gte'] = desde
+    if hasta:
+        filtro['fecha__lte'] = hasta
+
+    resumen = _totales(ResumenVentas.objects.filter(dimension='dia', **filtro))
+    grupos = []
+    if agrupar:
+        dimension = 'dia' if agrupar == 'mes' else agrupar
+        columna = TruncMonth('fecha') if agrupar == 'mes' else F('fecha') if agrupar == 'dia' else F('clave')
+        filas = list(ResumenVentas.objects.filter(dimension=dimension, **filtro).annotate(
+            grupo=columna
+        ).values('grupo').order_by('grupo').annotate(
+            total_ventas=Sum('total_ventas'), suma_importes=Sum('suma_importes'),
+            precio_min=Min('precio_min'), precio_max=Max('precio_max'),
+        ))
+        nombres = {}
+        if agrupar in ('concesionario', 'marca'):
+            modelo = Concesionario if agrupar == 'concesionario' else Marca
+            ids = [int(fila['grupo']) for fila in filas]
+            nombres = {str(pk): nombre for pk, nombre in modelo.objects.filter(pk__in=ids).values_list('pk', 'nombre')}
+        for fila in filas:
+            fila['nombre'] = nombres.get(fila['grupo'], fila['grupo'])
+            fila['precio_medio'] = fila['suma_importes'] / fila['total_ventas']
+            grupos.append(fila)
+    return resumen, grupos
@@ -0,0 +1,103 @@
+import atexit
+import secrets
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import caches
+
+# -------------------------------------------------------------------
+# Sesiones sin escrituras en la home
+# -------------------------------------------------------------------
+# index guardaba cuatro claves en la sesión y sumaba 'visitas_home' en
+# cada visita: con sesiones en BD, un UPDATE de django_session por cada
+# carga de la home. Ahora:
+#
+#   - 'fecha_inicio', 'id_usuario' y 'rol_texto' se guardan al hacer
+#     login (señal user_logged_in). Ese login ya guarda la sesión, así que
+#     no cuestan una escritura más. index solo las rellena si faltan (sesiones
+#     de antes de este cambio), una vez por sesión.
+#   - Las visitas se cuentan en memoria, por la clave 'id_visitas' de la
+#     sesión, y cada ALPHAAUTOS_VISITAS_VOLCADO_S segundos se suman de
+#     golpe a la caché ALPHAAUTOS_VISITAS_CACHE con incr(). Con 'locmem'
+#     cada proceso lleva su cuenta; con varios procesos hace falta una
+#     caché compartida (Redis, memcached...).
+#
+# El backend de sesiones se elige con ALPHAAUTOS_SESIONES (settings.py).
+
+# Visitas aún no volcadas a la caché: {id_visitas: n}
+_pendientes = Counter()
+_lock = threading.Lock()
+_ultimo_volcado = time.monotonic()
+
+
+def _clave(id_visitas):
+    return f"visitas_home:{id_visitas}"
+
+
+def _cache():
+    return caches[settings.ALPHAAUTOS_VISITAS_CACHE]
+
+
+def iniciar_sesion(sender, request, user, **kwargs):
+    """Datos de sesión del menú, guardados en la escritura que ya hace el login."""
+    request.session.update(datos_sesion(user))
+
+
+def datos_sesion(user):
+    return {
+        "fecha_inicio": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "id_usuario": user.id,
+        "rol_texto": user.get_rol_display(),
+        "id_visitas": secrets.token_hex(8),
+    }
+
+
+def anotar_visita(id_visitas):
+    """Suma una visita en memoria; vuelca a la caché si ha pasado el intervalo."""
+    global _ultimo_volcado
+    with _lock:
+        _pendientes[id_visitas] += 1
+        toca = time.monotonic() - _ultimo_volcado >= settings.ALPHAAUTOS_VISITAS_VOLCADO_S
+        if toca:
+            _ultimo_volcado = time.monotonic()
+    if toca:
+        volcar()
+
+
+def volcar():
+    """Pasa las visitas pendientes a la caché (una operación por sesión, no por visita)."""
+    with _lock:
+        pendientes = dict(_pendientes)
+        _pendientes.clear()
+    cache = _cache()
+    for id_visitas, n in pendientes.items():
+        try:
+            cache.incr(_clave(id_visitas), n)
+        except ValueError:
+            # Primera vez (o expulsada): si otro proceso la crea a la vez, add falla y se suma encima
+            if not cache.add(_clave(id_visitas), n, timeout=settings.SESSION_COOKIE_AGE):
+                cache.incr(_clave(id_visitas), n)
+
+
+def visitas(id_visitas):
+    """Visitas a la home de una sesión: lo volcado más lo pendiente de este proceso."""
+    if not id_visitas:
+        return 0
+    with _lock:
+        pendientes = _pendientes[id_visitas]
+    return (_cache().get(_clave(id_visitas)) or 0) + pendientes
+
+
+def contexto_visitas(request):
+    """'visitas_home' para el menú. Es una función: solo se calcula si la plantilla la pinta."""
+    return {'visitas_home': lambda: visitas(request.session.get("id_visitas"))}
+
+
+def instalar():
+    user_logged_in.connect(iniciar_sesion, dispatch_uid='alphaautos_datos_sesion')
+    # Lo que quede pendiente al parar el proceso
+    atexit.register(volcar)
@@ -0,0 +1,302 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
+
+from . import autocompletar, imagenes, resumenes, stock
+from .buscador import INDICES, obtener_buscador
+from .cache import invalidar
+from .models import Aseguradora, Coche, Concesionario, Empleado, Marca, Seguro, Usuario, Venta
+
+# -------------------------------------------------------------------
+# Señales: mantener el índice de búsqueda sincronizado
+# -------------------------------------------------------------------
+# Se registran desde AlphaautosConfig.ready() (apps.py).
+
+
+def _indexar(indice, objetos):
+    obtener_buscador().indexar(indice, objetos)
+
+
+def conectar_indice(indice):
+    """Conecta las señales del modelo indexado y de los modelos de los que saca texto."""
+
+    def al_guardar(sender, instance, **kwargs):
+        _indexar(indice, [instance])
+
+    def al_borrar(sender, instance, **kwargs):
+        obtener_buscador().eliminar(indice, [instance.pk])
+
+    post_save.connect(al_guardar, sender=indice.modelo, weak=False, dispatch_uid=f"busqueda_{indice.tipo}_save")
+    post_delete.connect(al_borrar, sender=indice.modelo, weak=False, dispatch_uid=f"busqueda_{indice.tipo}_delete")
+
+    # Si cambia el nombre de una Marca hay que reindexar sus coches, etc.
+    for relacionado, fk, campos in indice.dependencias():
+        def al_guardar_relacionado(sender, instance, update_fields=None, created=False, fk=fk, campos=campos, **kwargs):
+            if created:
+                return
+            # Ej.: el login solo actualiza last_login del usuario
+            if update_fields is not None and not campos & set(update_fields):
+                return
+            objetos = indice.queryset().filter(**{fk: instance}).order_by('pk')
+            lote = []
+            for objeto in objetos.iterator(chunk_size=2000):
+                lote.append(objeto)
+                if len(lote) == 2000:
+                    _indexar(indice, lote)
+                    lote = []
+            _indexar(indice, lote)
+
+        post_save.connect(
+            al_guardar_relacionado, sender=relacionado, weak=False,
+            dispatch_uid=f"busqueda_{indice.tipo}_{relacionado._meta.model_name}_save",
+        )
+
+
+# -------------------------------------------------------------------
+# Señales: mantener los resúmenes de ventas (AlphaAutos/resumenes.py)
+# y la columna Coche.vendido (AlphaAutos/stock.py)
+# -------------------------------------------------------------------
+# El estado anterior se lee de la BD en pre_save/pre_delete y se guarda en
+# la propia instancia; en post_save/post_delete se aplica la diferencia.
+
+def _venta_antes(sender, instance, **kwargs):
+    instance._resumen_anterior = resumenes.estado_venta(instance.pk)
+
+
+def _venta_guardada(sender, instance, **kwargs):
+    anterior = getattr(instance, '_resumen_anterior', None)
+    nuevo = resumenes.estado_venta(instance.pk)
+    resumenes.aplicar_cambio(anterior, nuevo)
+    # Stock: el coche nuevo queda vendido y, si se ha cambiado de coche, el anterior puede quedar libre
+    if anterior is None or nuevo is None or anterior['coche_id'] != nuevo['coche_id']:
+        stock.actualizar_vendido([instance.coche_id, anterior and anterior['coche_id']])
+
+
+def _venta_borrada(sender, instance, **kwargs):
+    anterior = getattr(instance, '_resumen_anterior', None)
+    resumenes.aplicar_cambio(anterior, None)
+    stock.actualizar_vendido([anterior['coche_id'] if anterior else instance.coche_id])
+
+
+def _coche_antes(sender, instance, update_fields=None, **kwargs):
+    # También lo usan la caché (_invalidar_coche) y las referencias de imagen (_contar_imagen)
+    if update_fields is not None and not {'concesionario', 'marca', 'imagen'} & set(update_fields):
+        instance._resumen_claves = None
+        return
+    instance._resumen_claves = resumenes.claves_coche(instance.pk)
+
+
+def _coche_guardado(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    nuevo = {'concesionario_id': instance.concesionario_id, 'marca_id': instance.marca_id}
+    resumenes.mover_coche(instance.pk, getattr(instance, '_resumen_claves', None), nuevo)
+
+
+def conectar_resumenes():
+    pre_save.connect(_venta_antes, sender=Venta, dispatch_uid='resumen_venta_pre_save')
+    post_save.connect(_venta_guardada, sender=Venta, dispatch_uid='resumen_venta_save')
+    pre_delete.connect(_venta_antes, sender=Venta, dispatch_uid='resumen_venta_pre_delete')
+    post_delete.connect(_venta_borrada, sender=Venta, dispatch_uid='resumen_venta_delete')
+    pre_save.connect(_coche_antes, sender=Coche, dispatch_uid='resumen_coche_pre_save')
+    post_save.connect(_coche_guardado, sender=Coche, dispatch_uid='resumen_coche_save')
+
+
+# -------------------------------------------------------------------
+# Señales: invalidar la caché del catálogo (AlphaAutos/cache.py)
+# -------------------------------------------------------------------
+# Cada modelo invalida sus propios tokens y los de las listas en las que
+# aparece. Para los coches y empleados que cambian de concesionario o
+# marca también se invalida la lista de la que salen.
+
+def _invalidar_marca(sender, instance, **kwargs):
+    invalidar(f"marca:{instance.pk}", 'lista:marca')
+
+
+def _invalidar_concesionario(sender, instance, **kwargs):
+    invalidar(f"concesionario:{instance.pk}", 'lista:concesionario')
+
+
+def _invalidar_aseguradora(sender, instance, **kwargs):
+    invalidar(f"aseguradora:{instance.pk}", 'lista:aseguradora')
+
+
+def _invalidar_seguros(sender, **kwargs):
+    # Las aseguradoras muestran sus seguros; cambian poco, basta un token común
+    invalidar('seguros', 'lista:aseguradora')
+
+
+def _invalidar_seguros_aseguradora(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # seguro.aseguradora_set.add(...): pk_set son aseguradoras (None en clear)
+        invalidar('seguros', 'lista:aseguradora', *(f"aseguradora:{pk}" for pk in pk_set or ()))
+    else:
+        invalidar(f"aseguradora:{instance.pk}", 'lista:aseguradora')
+
+
+def _invalidar_coche(sender, instance, **kwargs):
+    # Concesionario y marca anteriores: los guarda _coche_antes en pre_save
+    anterior = getattr(instance, '_resumen_claves', None) or {}
+    invalidar(
+        f"coche:{instance.pk}",
+        f"marca:{instance.marca_id}:coches",
+        f"concesionario:{instance.concesionario_id}:coches",
+        *([f"marca:{anterior['marca_id']}:coches"] if anterior.get('marca_id') else []),
+        *([f"concesionario:{anterior['concesionario_id']}:coches"] if anterior.get('concesionario_id') else []),
+    )
+
+
+def _empleado_antes(sender, instance, **kwargs):
+    instance._concesionario_anterior = (
+        Empleado.objects.filter(pk=instance.pk).values_list('concesionario_id', flat=True).first()
+        if instance.pk else None
+    )
+
+
+def _invalidar_empleado(sender, instance, **kwargs):
+    anterior = getattr(instance, '_concesionario_anterior', None)
+    invalidar(
+        f"concesionario:{instance.concesionario_id}:empleados",
+        *([f"concesionario:{anterior}:empleados"] if anterior else []),
+    )
+
+
+def _invalidar_permisos_usuario(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # grupo.user_set.add(...) o permiso.user_set.add(...): afecta a varios usuarios
+        invalidar('permisos')
+    else:
+        invalidar(f"permisos:{instance.pk}")
+
+
+def _invalidar_permisos(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidar('permisos')
+
+
+def conectar_cache():
+    for modelo, funcion in (
+        (Marca, _invalidar_marca),
+        (Concesionario, _invalidar_concesionario),
+        (Aseguradora, _invalidar_aseguradora),
+        (Seguro, _invalidar_seguros),
+        (Coche, _invalidar_coche),
+        (Empleado, _invalidar_empleado),
+    ):
+        nombre = modelo._meta.model_name
+        post_save.connect(funcion, sender=modelo, dispatch_uid=f"cache_{nombre}_save")
+        post_delete.connect(funcion, sender=modelo, dispatch_uid=f"cache_{nombre}_delete")
+    pre_save.connect(_empleado_antes, sender=Empleado, dispatch_uid='cache_empleado_pre_save')
+    m2m_changed.connect(_invalidar_seguros_aseguradora, sender=Aseguradora.seguros.through,
+                        dispatch_uid='cache_aseguradora_seguros')
+    m2m_changed.connect(_invalidar_permisos_usuario, sender=Usuario.groups.through,
+                        dispatch_uid='cache_permisos_grupos')
+    m2m_changed.connect(_invalidar_permisos_usuario, sender=Usuario.user_permissions.through,
+                        dispatch_uid='cache_permisos_usuario')
+    m2m_changed.connect(_invalidar_permisos, sender=Group.permissions.through,
+                        dispatch_uid='cache_permisos_grupo')
+
+
+# -------------------------------------------------------------------
+# Señales: rendiciones y referencias de Coche.imagen (AlphaAutos/imagenes.py)
+# -------------------------------------------------------------------
+# La petición no toca el disco: el hilo comprueba si faltan rendiciones,
+# las genera, apunta Coche.imagen_rendida e invalida las páginas del coche.
+# La imagen anterior la guarda _coche_antes en pre_save.
+
+def _encolar_rendiciones(sender, instance, **kwargs):
+    if instance.imagen:
+        imagenes.encolar(instance.imagen.name, [
+            f"coche:{instance.pk}",
+            f"marca:{instance.marca_id}:coches",
+            f"concesionario:{instance.concesionario_id}:coches",
+        ])
+
+
+def _imagen_antes(sender, instance, **kwargs):
+    # Un fichero recién subido se guarda después de este pre_save y la subida ya suma su referencia
+    instance._imagen_subida = bool(instance.imagen) and not instance.imagen._committed
+
+
+def _contar_imagen(sender, instance, created=False, **kwargs):
+    nueva = instance.imagen.name or ''
+    subida = instance.__dict__.pop('_imagen_subida', False)
+    if created:
+        anterior = ''
+    elif getattr(instance, '_resumen_claves', None) is not None:
+        anterior = instance._resumen_claves['imagen'] or ''
+    else:
+        # save(update_fields=...) sin la imagen
+        return
+    if anterior == nueva:
+        if subida:
+            # Se ha vuelto a subir la misma foto: la subida la ha contado otra vez
+            imagenes.quitar_referencia(nueva)
+        return
+    if not subida:
+        imagenes.sumar_referencia(nueva)
+    imagenes.quitar_referencia(anterior)
+    if instance.imagen_rendida:
+        # Las rendiciones de la imagen anterior pueden borrarse; las de la nueva las apunta el hilo
+        instance.imagen_rendida = ''
+        Coche.objects.filter(pk=instance.pk).update(imagen_rendida='')
+
+
+def _soltar_imagen(sender, instance, **kwargs):
+    imagenes.quitar_referencia(instance.imagen.name)
+
+
+def conectar_imagenes():
+    pre_save.connect(_imagen_antes, sender=Coche, dispatch_uid='imagenes_coche_pre_save')
+    post_save.connect(_encolar_rendiciones, sender=Coche, dispatch_uid='imagenes_coche_save')
+    post_save.connect(_contar_imagen, sender=Coche, dispatch_uid='imagenes_coche_referencias')
+    post_delete.connect(_soltar_imagen, sender=Coche, dispatch_uid='imagenes_coche_delete')
+
+
+# -------------------------------------------------------------------
+# Señales: índices de autocompletado (AlphaAutos/autocompletar.py)
+# -------------------------------------------------------------------
+# Se aplican al confirmar la transacción, y solo si el índice está cargado.
+
+def conectar_fuente(fuente):
+    def al_guardar(sender, instance, **kwargs):
+        autocompletar.al_confirmar(fuente.tipo, [(instance.pk, fuente.texto(instance))])
+
+    def al_borrar(sender, instance, **kwargs):
+        autocompletar.al_confirmar(fuente.tipo, [(instance.pk, None)])
+
+    post_save.connect(al_guardar, sender=fuente.modelo, weak=False, dispatch_uid=f"autocompletar_{fuente.tipo}_save")
+    post_delete.connect(al_borrar, sender=fuente.modelo, weak=False, dispatch_uid=f"autocompletar_{fuente.tipo}_delete")
+
+    relacion = fuente.relacion()
+    if relacion is None:
+        return
+    relacionado, fk, campo = relacion
+
+    # Ej.: cambia el username de un usuario comprador
+    def al_guardar_relacionado(sender, instance, update_fields=None, created=False, **kwargs):
+        if created or not fuente.en_uso():
+            return
+        if update_fields is not None and campo not in update_fields:
+            return
+        ids = fuente.modelo.objects.filter(**{fk: instance}).values_list('pk', flat=True)
+        texto = getattr(instance, campo)
+        autocompletar.al_confirmar(fuente.tipo, [(pk, texto) for pk in ids])
+
+    post_save.connect(
+        al_guardar_relacionado, sender=relacionado, weak=False,
+        dispatch_uid=f"autocompletar_{fuente.tipo}_{relacionado._meta.model_name}_save",
+    )
+
+
+def conectar_senales():
+    for indice in INDICES.values():
+        conectar_indice(indice)
+    conectar_resumenes()
+    conectar_cache()
+    conectar_imagenes()
+    for fuente in autocompletar.FUENTES.values():
+        conectar_fuente(fuente)
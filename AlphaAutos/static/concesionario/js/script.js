@@ -17,4 +17,94 @@ function eliminar(){
         return true;
     else
         return false;
-}
\ No newline at end of file
+}
+
+// Autocompletado de los buscadores: <input data-autocompletar="/autocompletar/modelo/">
+// Las sugerencias van a un <datalist> y se piden al dejar de escribir un momento
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('input[data-autocompletar]').forEach((input, i) => {
+        const lista = document.createElement('datalist');
+        lista.id = `autocompletar-${i}`;
+        input.after(lista);
+        input.setAttribute('list', lista.id);
+
+        let espera;
+        input.addEventListener('input', () => {
+            clearTimeout(espera);
+            const texto = input.value.trim();
+            if (!texto) {
+                lista.replaceChildren();
+                return;
+            }
+            espera = setTimeout(async () => {
+                const respuesta = await fetch(`${input.dataset.autocompletar}?q=${encodeURIComponent(texto)}`);
+                // Sin permiso (403) o si ya ha escrito otra cosa, no se toca la lista
+                if (!respuesta.ok || input.value.trim() !== texto) return;
+                const datos = await respuesta.json();
+                lista.replaceChildren(...datos.sugerencias.map(sugerencia => new Option(sugerencia.texto)));
+            }, 120);
+        });
+    });
+});
+
+
+// Desplegables remotos: <select data-opciones="/opciones/marca/"> solo trae la opción elegida.
+// Al abrirlo se piden las demás de 20 en 20; la caja de búsqueda de encima las filtra
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('select[data-opciones]').forEach(select => {
+        const buscar = document.createElement('input');
+        buscar.type = 'search';
+        buscar.className = 'form-control form-control-sm mb-1';
+        buscar.placeholder = 'Buscar...';
+        buscar.setAttribute('aria-label', 'Buscar opciones');
+        select.before(buscar);
+
+        const mas = new Option('Más resultados...', '');
+        mas.dataset.mas = '1';
+        let siguiente = null;
+        let cargadas = false;
+        let peticion = 0;
+
+        async function cargar(desdeCero) {
+            const numero = ++peticion;
+            const parametros = new URLSearchParams({q: buscar.value.trim(), tamanio: 20});
+            if (!desdeCero && siguiente) parametros.set('despues', siguiente);
+            const respuesta = await fetch(`${select.dataset.opciones}?${parametros}`);
+            // Sin permiso, o ya hay otra búsqueda en marcha
+            if (!respuesta.ok || numero !== peticion) return;
+            const datos = await respuesta.json();
+            const elegido = select.value;
+            mas.remove();
+            if (desdeCero) {
+                // Se quedan la opción vacía y la elegida
+                [...select.options].forEach(opcion => {
+                    if (opcion.value && opcion.value !== elegido) opcion.remove();
+                });
+            }
+            const presentes = new Set([...select.options].map(opcion => opcion.value));
+            datos.resultados
+                .filter(resultado => !presentes.has(String(resultado.id)))
+                .forEach(resultado => select.add(new Option(resultado.texto, resultado.id)));
+            siguiente = datos.siguiente;
+            if (siguiente) select.add(mas);
+            select.value = elegido;
+            cargadas = true;
+        }
+
+        select.addEventListener('focus', () => { if (!cargadas) cargar(true); });
+        let anterior = select.value;
+        select.addEventListener('change', () => {
+            if (select.selectedOptions[0] === mas) {
+                select.value = anterior;
+                cargar(false);
+            } else {
+                anterior = select.value;
+            }
+        });
+        let espera;
+        buscar.addEventListener('input', () => {
+            clearTimeout(espera);
+            espera = setTimeout(() => cargar(true), 200);
+        });
+    });
+});
@@ -0,0 +1,44 @@
+from django.db.models import Exists, OuterRef
+
+from .cache import invalidar
+from .models import *
+
+# -------------------------------------------------------------------
+# Stock disponible: columna Coche.vendido
+# -------------------------------------------------------------------
+# "Coches sin ventas" era un LEFT JOIN contra toda la tabla Venta
+# (venta__isnull=True). Ahora cada coche guarda si está vendido y hay un
+# índice parcial con los disponibles.
+#
+# Las señales de Venta (AlphaAutos/signals.py) recalculan la columna de
+# los coches afectados al crear, cambiar de coche o borrar una venta; si
+# se hace dentro de transaction.atomic() va en la misma transacción.
+# El UPDATE no lanza señales: la caché del detalle de cada coche
+# (coche:<id>) se invalida aquí.
+# Si algo se desincroniza: manage.py reconciliar_stock
+
+
+def _tiene_ventas():
+    # Las ventas anuladas no cuentan
+    return Exists(Venta.objects.filter(coche_id=OuterRef('pk'), anulada=False))
+
+
+def actualizar_vendido(ids_coches):
+    """Recalcula Coche.vendido de los coches indicados a partir de sus ventas."""
+    ids_coches = {pk for pk in ids_coches if pk is not None}
+    if ids_coches:
+        Coche.objects.filter(pk__in=ids_coches).update(vendido=_tiene_ventas())
+        invalidar(*(f"coche:{pk}" for pk in ids_coches))
+
+
+def descuadres():
+    """Coches cuyo `vendido` no coincide con sus ventas: (marcados de más, marcados de menos)."""
+    sobrantes = Coche.objects.filter(vendido=True).exclude(_tiene_ventas())
+    faltantes = Coche.objects.filter(vendido=False).filter(_tiene_ventas())
+    return sobrantes, faltantes
+
+
+def reconciliar():
+    """Corrige los descuadres con dos UPDATE y devuelve cuántos coches se han arreglado."""
+    sobrantes, faltantes = descuadres()
+    return sobrantes.update(vendido=False) + faltantes.update(vendido=True)
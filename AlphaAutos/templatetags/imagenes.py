@@ -0,0 +1,13 @@
+from django import template
+
+from AlphaAutos.imagenes import RENDICIONES, url_rendicion
+
+register = template.Library()
+
+
+@register.filter
+def rendicion(imagen, nombre):
+    """{{ coche.imagen|rendicion:"miniatura" }}: URL de la rendición, o del original si aún no existe."""
+    if nombre not in RENDICIONES:
+        raise template.TemplateSyntaxError(f"Rendición desconocida: {nombre}")
+    return url_rendicion(imagen, nombre)
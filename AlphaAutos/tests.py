@@ -1,3 +1,1319 @@
-from django.test import TestCase
+import gzip
+import html
+import io
+import json
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import Permission
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from django.template import engines
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from PIL import Image
+
+from .models import *
+from . import autocompletar, buscador, imagenes, metricas, perfil_plantillas, reservas, resumenes, sesiones, stock, urls as alphaautos_urls, vigilancia_sql
+from .almacen import almacen_imagenes
+from .cache import LRUCache, cache_catalogo, invalidar, obtener
+from .paginacion import PaginaKeyset
+
+
+# -------------------------------------------------------------------
+# Presupuesto de consultas por ruta
+# -------------------------------------------------------------------
+# Número máximo de consultas SQL que puede costar cada página, con la
+# base de datos sembrada con FILAS filas por tabla. Como FILAS es mayor
+# que cualquier presupuesto, un N+1 (una consulta extra por fila) hace
+# fallar el test. Cualquier ruta nueva de AlphaAutos/urls.py tiene que
+# añadirse aquí.
+FILAS = 60
+
+PRESUPUESTOS = {
+    'index': 5,
+    'coche_list': 4,
+    'coche_detail': 4,
+    'coches_por_fecha': 4,
+    'coches_transmision': 4,
+    'coches_concesionario_texto': 5,
+    'ultimo_cliente_coche': 4,
+    'coches_sin_ventas': 4,
+    'concesionario_detail': 6,
+    'resumen_ventas': 5,
+    'lista_concesionarios': 4,
+    'lista_marcas': 4,
+    # Los desplegables solo piden la opción elegida (SelectRemoto, opciones.py)
+    'crear_coche': 3,
+    'importar_coches': 3,
+    'crear_concesionario': 3,
+    'crear_marca': 3,
+    'marca_detail': 5,
+    'editar_marca': 4,
+    'lista_empleados': 4,
+    'crear_empleados': 3,
+    'empleado_detail': 4,
+    'editar_empleado': 5,
+    'lista_clientes': 4,
+    'crear_cliente': 4,
+    'cliente_detail': 4,
+    'editar_cliente': 5,
+    'cambiar_password_cliente': 4,
+    'lista_aseguradoras': 4,
+    'crear_aseguradora': 4,
+    'aseguradora_detail': 5,
+    'editar_aseguradora': 6,
+    'buscar_coches': 4,
+    'buscar_concesionarios': 4,
+    'buscar_marcas': 4,
+    'buscar_empleados': 4,
+    'buscar_clientes': 4,
+    'buscar_aseguradoras': 4,
+    'editar_coche': 6,
+    'editar_concesionario': 4,
+    'registrar_usuario': 2,
+    'lista_ventas': 4,
+    'venta_detail': 4,
+    # crear_venta y editar_venta ya no van en transaction.atomic: un GET no abre transacción
+    'crear_venta': 3,
+    # Sesión, usuario y el UPDATE condicional de la reserva (solo POST)
+    'reservar_coche': 3,
+    'buscar_ventas': 4,
+    'editar_venta': 5,
+    'password_change': 3,
+    'password_reset': 2,
+    'password_reset_done': 2,
+    'password_reset_confirm': 3,
+    # Los borrados arrastran la cascada de Django; se miden aparte
+    'eliminar_coche': 14,
+    'eliminar_concesionario': 20,
+    'eliminar_marca': 14,
+    'eliminar_empleado': 10,
+    'eliminar_cliente': 14,
+    'eliminar_aseguradora': 10,
+    # + hasta 3 por dimensión de ResumenVentas si era el mínimo o el máximo,
+    # el UPDATE de Coche.vendido y la transacción
+    'eliminar_venta': 23,
+    'exportar': 3,
+    # Sesión y la primera carga del índice de modelos; después, ninguna (AutocompletarTests)
+    'autocompletar': 2,
+    # Usuario y la página, con la búsqueda de texto como subconsulta
+    'opciones': 2,
+    # Sesión y usuario (los desplegables son remotos)
+    'operacion_masiva': 3,
+    'metricas': 2,
+    'metricas_prometheus': 2,
+}
+
+# Rutas que solo aceptan POST: se miden con un POST
+RUTAS_POST = {'reservar_coche'}
+
+
+class PresupuestoConsultasMixin:
+    """Añade assertMaxConsultas: como assertNumQueries pero con un máximo."""
+
+    @contextmanager
+    def assertMaxConsultas(self, maximo, etiqueta=''):
+        with CaptureQueriesContext(connection) as contexto:
+            yield contexto
+        consultas = len(contexto.captured_queries)
+        if consultas > maximo:
+            detalle = '\n'.join(q['sql'] for q in contexto.captured_queries)
+            self.fail(f"{etiqueta}: {consultas} consultas (máximo {maximo})\n{detalle}")
+
+    def assertPresupuestoUrl(self, maximo, url, metodo='get', **kwargs):
+        with self.assertMaxConsultas(maximo, url):
+            respuesta = getattr(self.client, metodo)(url, **kwargs)
+            # El contenido en streaming también se consume dentro del presupuesto
+            if respuesta.streaming:
+                b''.join(respuesta.streaming_content)
+        self.assertLess(respuesta.status_code, 400, url)
+        return respuesta
+
+
+def sembrar_datos(filas=FILAS):
+    """Crea un juego de datos con `filas` filas en cada tabla principal."""
+    concesionarios = Concesionario.objects.bulk_create([
+        Concesionario(nombre=f"Concesionario {i}", direccion="Calle Mayor", telefono="954000000", ciudad="Sevilla")
+        for i in range(filas)
+    ])
+    marcas = Marca.objects.bulk_create([
+        Marca(nombre=f"Marca {i}", pais_origen="España", anio_fundacion=1990, descripcion="Marca de prueba")
+        for i in range(filas)
+    ])
+    coches = Coche.objects.bulk_create([
+        Coche(
+            marca=marcas[i % 3],
+            concesionario=concesionarios[i % 2],
+            modelo=f"Golf {i}",
+            precio=Decimal('15000.00') + i,
+            transmision='AT' if i % 2 else 'MT',
+            fecha_fabricacion=date(2024, 12, 1 + i % 28),
+        )
+        for i in range(filas)
+    ])
+    empleados = Empleado.objects.bulk_create([
+        Empleado(
+            concesionario=concesionarios[i % 2], nombre=f"Empleado {i}", puesto="Vendedor",
+            salario=Decimal('1500.00'), fecha_contratacion=date(2020, 1, 1),
+        )
+        for i in range(filas)
+    ])
+    usuarios = Usuario.objects.bulk_create([
+        Usuario(username=f"comprador{i}", email=f"c{i}@alphaautos.es", rol=Usuario.COMPRADOR)
+        for i in range(filas)
+    ])
+    compradores = Comprador.objects.bulk_create([
+        Comprador(usuario=usuario, telefono="600000000") for usuario in usuarios
+    ])
+    # Solo se venden la mitad de los coches para que haya stock disponible
+    ventas = Venta.objects.bulk_create([
+        Venta(
+            comprador=compradores[i], coche=coches[i], fecha_venta=date(2025, 1, 1 + i % 28),
+            precio_final=coches[i].precio, metodo_pago="Efectivo",
+        )
+        for i in range(filas // 2)
+    ])
+    seguros = Seguro.objects.bulk_create([
+        Seguro(coche=coche, tipo_seguro="Completo", precio_mensual=Decimal('50.00'), duracion=12)
+        for coche in coches
+    ])
+    aseguradoras = Aseguradora.objects.bulk_create([
+        Aseguradora(nombre=f"Aseguradora {i}", pais="España", telefono="900000000", web="www.seguros.es")
+        for i in range(filas)
+    ])
+    Aseguradora.seguros.through.objects.bulk_create([
+        Aseguradora.seguros.through(aseguradora_id=aseguradoras[0].id, seguro_id=seguro.id)
+        for seguro in seguros
+    ])
+    # bulk_create no lanza señales: los resúmenes y el stock se calculan de una vez
+    resumenes.reconstruir()
+    stock.reconciliar()
+    return {
+        'concesionarios': concesionarios, 'marcas': marcas, 'coches': coches, 'empleados': empleados,
+        'compradores': compradores, 'ventas': ventas, 'aseguradoras': aseguradoras,
+    }
+
+
+class PresupuestoConsultasTests(PresupuestoConsultasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos()
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    def setUp(self):
+        # La caché del catálogo no se deshace con la transacción de cada test
+        cache_catalogo().clear()
+        self.client.force_login(self.admin)
+
+    def argumentos_ruta(self, nombre):
+        d = self.datos
+        # Los borrados usan los últimos objetos para no afectar a los demás
+        argumentos = {
+            'coche_detail': {'id_coche': d['coches'][0].id},
+            'coches_por_fecha': {'anio': 2024, 'mes': 12},
+            'coches_transmision': {'tipo': 'AT'},
+            'coches_concesionario_texto': {'id_concesionario': d['concesionarios'][0].id, 'texto': 'Golf'},
+            'ultimo_cliente_coche': {'id_coche': d['coches'][0].id},
+            'concesionario_detail': {'id_concesionario': d['concesionarios'][0].id},
+            'marca_detail': {'id_marca': d['marcas'][0].id},
+            'editar_marca': {'id_marca': d['marcas'][0].id},
+            'empleado_detail': {'id_empleado': d['empleados'][0].id},
+            'editar_empleado': {'id_empleado': d['empleados'][0].id},
+            'cliente_detail': {'id_cliente': d['compradores'][0].id},
+            'editar_cliente': {'id_cliente': d['compradores'][0].id},
+            'cambiar_password_cliente': {'id_cliente': d['compradores'][0].id},
+            'aseguradora_detail': {'id_aseguradora': d['aseguradoras'][0].id},
+            'editar_aseguradora': {'id_aseguradora': d['aseguradoras'][0].id},
+            'editar_coche': {'id_coche': d['coches'][0].id},
+            'editar_concesionario': {'id_concesionario': d['concesionarios'][0].id},
+            'venta_detail': {'id_venta': d['ventas'][0].id},
+            'editar_venta': {'id_venta': d['ventas'][0].id},
+            'reservar_coche': {'id_coche': d['coches'][-1].id},
+            'password_reset_confirm': {'uidb64': 'MQ', 'token': 'token-invalido'},
+            'eliminar_coche': {'id_coche': d['coches'][-1].id},
+            'eliminar_concesionario': {'id_concesionario': d['concesionarios'][-1].id},
+            'eliminar_marca': {'id_marca': d['marcas'][-1].id},
+            'eliminar_empleado': {'id_empleado': d['empleados'][-1].id},
+            'eliminar_cliente': {'id_cliente': d['compradores'][-1].id},
+            'eliminar_aseguradora': {'id_aseguradora': d['aseguradoras'][-1].id},
+            'eliminar_venta': {'id_venta': d['ventas'][-1].id},
+            'exportar': {'tipo': 'ventas'},
+            'autocompletar': {'tipo': 'modelo'},
+            'opciones': {'relacion': 'coche_venta'},
+            'operacion_masiva': {'tipo': 'coches'},
+        }
+        return argumentos.get(nombre, {})
+
+    def parametros_ruta(self, nombre):
+        # Las vistas de búsqueda solo consultan la base de datos con criterios;
+        # el resumen de ventas, con desglose
+        parametros = {
+            'buscar_coches': {'modelo': 'Golf'},
+            'buscar_concesionarios': {'nombre': 'Concesionario'},
+            'buscar_marcas': {'nombre': 'Marca'},
+            'buscar_empleados': {'nombre': 'Empleado'},
+            'buscar_clientes': {'usuario': 'comprador'},
+            'buscar_aseguradoras': {'nombre': 'Aseguradora'},
+            'buscar_ventas': {'metodo_pago': 'Efectivo'},
+            'resumen_ventas': {'desde': '2025-01-01', 'agrupar': 'concesionario'},
+            'autocompletar': {'q': 'Golf'},
+            'opciones': {'q': 'Golf'},
+        }
+        return parametros.get(nombre, {})
+
+    def test_todas_las_rutas_tienen_presupuesto(self):
+        nombres = {p.name for p in alphaautos_urls.urlpatterns if isinstance(p, URLPattern) and p.name}
+        self.assertEqual(nombres - set(PRESUPUESTOS), set(), "Rutas sin presupuesto de consultas")
+        self.assertEqual(set(PRESUPUESTOS) - nombres, set(), "Presupuestos de rutas que ya no existen")
+
+    def test_presupuesto_por_ruta(self):
+        for nombre, maximo in PRESUPUESTOS.items():
+            with self.subTest(ruta=nombre):
+                url = reverse(f'AlphaAutos:{nombre}', kwargs=self.argumentos_ruta(nombre))
+                metodo = 'post' if nombre in RUTAS_POST else 'get'
+                self.assertPresupuestoUrl(maximo, url, metodo, data=self.parametros_ruta(nombre))
+
+    def test_lista_ventas_comprador_sin_n_mas_1(self):
+        comprador = self.datos['compradores'][0]
+        self.client.force_login(comprador.usuario)
+        self.assertPresupuestoUrl(PRESUPUESTOS['lista_ventas'] + 2, reverse('AlphaAutos:lista_ventas'))
+
+    def test_streaming_coches_sin_n_mas_1(self):
+        self.assertPresupuestoUrl(PRESUPUESTOS['coche_list'], reverse('AlphaAutos:coche_list'), data={'formato': 'stream'})
+
+    def test_exportar_respeta_el_rol_y_comprime(self):
+        respuesta = self.client.get(reverse('AlphaAutos:exportar', kwargs={'tipo': 'coches'}))
+        lineas = b''.join(respuesta.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lineas[0].split(',')[:3], ['id', 'marca', 'modelo'])
+        self.assertEqual(len(lineas), FILAS + 1)
+
+        comprador = self.datos['compradores'][0]
+        self.client.force_login(comprador.usuario)
+        respuesta = self.client.get(
+            reverse('AlphaAutos:exportar', kwargs={'tipo': 'ventas'}), {'formato': 'json', 'gzip': '1'},
+        )
+        self.assertEqual(respuesta['Content-Disposition'], 'attachment; filename="ventas.json.gz"')
+        ventas = json.loads(gzip.decompress(b''.join(respuesta.streaming_content)))
+        self.assertEqual(
+            sorted(venta['id'] for venta in ventas),
+            sorted(Venta.objects.filter(comprador=comprador).values_list('pk', flat=True)),
+        )
+        self.assertTrue(all(venta['comprador'] == comprador.usuario.username for venta in ventas))
+
+
+# -------------------------------------------------------------------
+# Paginación por cursor
+# -------------------------------------------------------------------
+class PaginacionTests(TestCase):
+
+    def test_primera_pagina_conserva_los_parametros(self):
+        request = RequestFactory().get('/coches/', {'tamanio': 10, 'formato': 'html', 'despues': 'abc'})
+        pagina = PaginaKeyset(request, [], ('id',), 'xyz', 'abc')
+        self.assertEqual(pagina.url_primera, '?tamanio=10&formato=html')
+        self.assertEqual(pagina.url_siguiente, '?tamanio=10&formato=html&despues=xyz')
+
+    def test_cursor_con_relacion_vacia(self):
+        # Comprador.usuario admite NULL: esos compradores van al final, hacia delante y hacia atrás
+        from .paginacion import ORDEN_USUARIO, paginar_keyset
+        compradores = [
+            Comprador.objects.create(usuario=Usuario.objects.create_user(nombre)) for nombre in ('bea', 'ana')
+        ] + [Comprador.objects.create(telefono=telefono) for telefono in ('600000001', '600000002')]
+        esperados = [compradores[1], compradores[0], compradores[2], compradores[3]]
+        vistos, cursor = [], ''
+        while cursor is not None:
+            pagina = paginar_keyset(RequestFactory().get('/', {'tamanio': 1, 'despues': cursor}), Comprador.objects.all(), ORDEN_USUARIO)
+            vistos += list(pagina)
+            cursor = pagina.cursor_siguiente
+        self.assertEqual(vistos, esperados)
+        vistos, cursor = [], pagina.cursor_anterior
+        while cursor is not None:
+            pagina = paginar_keyset(RequestFactory().get('/', {'tamanio': 1, 'antes': cursor}), Comprador.objects.all(), ORDEN_USUARIO)
+            vistos = list(pagina) + vistos
+            cursor = pagina.cursor_anterior
+        self.assertEqual(vistos, esperados[:-1])
+
+
+# -------------------------------------------------------------------
+# Índice de búsqueda de texto
+# -------------------------------------------------------------------
+def coincidentes(tipo, criterios):
+    """Ids del modelo `tipo` que cumplen los criterios, por id (None si no hay criterios)."""
+    condicion = buscador.filtro(tipo, criterios)
+    if condicion is None:
+        return None
+    return list(buscador.INDICES[tipo].modelo.objects.filter(condicion).order_by('pk').values_list('pk', flat=True))
+
+
+class BuscadorTests(TestCase):
+
+    def setUp(self):
+        cache_catalogo().clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.concesionario = Concesionario.objects.create(nombre="Motor Sur", direccion="Calle Sol", telefono="954123456", ciudad="Sevilla")
+        cls.marca = Marca.objects.create(nombre="Citroën", pais_origen="Francia")
+        cls.coche = Coche.objects.create(
+            marca=cls.marca, concesionario=cls.concesionario, modelo="León Cupra",
+            precio=Decimal('20000.00'), fecha_fabricacion=date(2024, 1, 1),
+        )
+
+    def test_busqueda_sin_tildes_y_por_prefijo(self):
+        self.assertEqual(coincidentes('coche', {'modelo': 'leon cup'}), [self.coche.id])
+        self.assertEqual(coincidentes('coche', {'marca': 'CITROEN'}), [self.coche.id])
+        self.assertEqual(coincidentes('coche', {'marca': 'seat'}), [])
+        self.assertIsNone(coincidentes('coche', {'marca': '', 'modelo': None}))
+
+    def test_indice_sincronizado_por_senales(self):
+        self.marca.nombre = "Cupra"
+        self.marca.save()
+        self.assertEqual(coincidentes('coche', {'marca': 'cupra'}), [self.coche.id])
+        self.coche.delete()
+        self.assertEqual(coincidentes('coche', {'modelo': 'leon'}), [])
+
+    def test_filtros_y_paginas_sobre_todas_las_coincidencias(self):
+        # Los filtros de la vista y los cursores van en la consulta de la búsqueda, sin tope de ids
+        coches = Coche.objects.bulk_create([
+            Coche(marca=self.marca, concesionario=self.concesionario, modelo=f"C3 {i}",
+                  precio=Decimal(10000 + i * 1000), fecha_fabricacion=date(2024, 1, 1))
+            for i in range(5)
+        ])
+        buscador.obtener_buscador().indexar(buscador.INDICES['coche'], Coche.objects.select_related('marca', 'concesionario'))
+        self.client.force_login(Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123'))
+        vistos, cursor = [], ''
+        with CaptureQueriesContext(connection) as consultas:
+            while cursor is not None:
+                respuesta = self.client.get(reverse('AlphaAutos:buscar_coches'), {
+                    'marca': 'citroen', 'precio_max': 12000, 'tamanio': 1, 'orden': 'lista', 'despues': cursor,
+                })
+                vistos += [coche.pk for coche in respuesta.context['coches']]
+                cursor = respuesta.context['pagina'].cursor_siguiente
+        self.assertEqual(vistos, [coche.pk for coche in coches[:3]])
+        busquedas = [c['sql'] for c in consultas.captured_queries if 'alphaautos_busqueda_coche' in c['sql']]
+        self.assertTrue(busquedas and all('"AlphaAutos_coche"' in sql for sql in busquedas), busquedas)
+
+    def test_primera_pagina_por_relevancia(self):
+        # Mismo término en un modelo largo y en uno corto: el corto es más relevante (bm25 / ts_rank)
+        largo, corto, caro = Coche.objects.bulk_create([
+            Coche(marca=self.marca, concesionario=self.concesionario, modelo=modelo,
+                  precio=Decimal(precio), fecha_fabricacion=date(2024, 1, 1))
+            for modelo, precio in (("Berlingo Aircross Shine Pack", 15000), ("Berlingo", 15000), ("Berlingo", 90000))
+        ])
+        buscador.obtener_buscador().indexar(buscador.INDICES['coche'], Coche.objects.select_related('marca', 'concesionario'))
+        self.client.force_login(Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123'))
+        url = reverse('AlphaAutos:buscar_coches')
+        criterios = {'modelo': 'berlingo', 'precio_max': 20000, 'tamanio': 1}
+        pagina = self.client.get(url, criterios).context['pagina']
+        self.assertEqual(list(pagina), [corto])
+        self.assertEqual(pagina.url_todas, '?modelo=berlingo&precio_max=20000&tamanio=1&orden=lista')
+        # El listado completo va por marca e id, con los filtros de la vista
+        pagina = self.client.get(url, {**criterios, 'tamanio': 5, 'orden': 'lista'}).context['pagina']
+        self.assertEqual(list(pagina), [largo, corto])
+
+
+# -------------------------------------------------------------------
+# Importación de coches desde CSV
+# -------------------------------------------------------------------
+class ImportacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(3)
+
+    def setUp(self):
+        cache_catalogo().clear()
+
+    def test_importa_las_filas_validas_y_anota_las_demas(self):
+        from .importacion import importar_coches
+        csv_proveedor = io.StringIO(
+            "Marca;Concesionario;Modelo;Precio;Transmision;Fecha_fabricacion\n"
+            "marca 0;Concesionario 1;Ibiza;15000,50;Automática;31/05/2024\n"
+            "Marca 1;Concesionario 1;Arona;-1;MT;2024-01-01\n"
+            "Marca 9;Concesionario 1;Leon;20000;MT;2099-01-01\n"
+            "Marca 2;Concesionario 2;Ateca;25000;XX;2023-02-01\n"
+        )
+        # Marcas, concesionarios y, por lote: último id, INSERT, ids nuevos, índice y la transacción
+        with self.assertNumQueries(8):
+            resultado = importar_coches(csv_proveedor, delimitador=';')
+
+        self.assertEqual((resultado.filas, resultado.creados, resultado.total_errores), (4, 1, 3))
+        self.assertEqual([linea for linea, _ in resultado.errores], [3, 4, 5])
+        self.assertIn('negativo', resultado.errores[0][1])
+        self.assertIn("'Marca 9' no existe", resultado.errores[1][1])
+        self.assertIn('futura', resultado.errores[1][1])
+        coche = Coche.objects.get(modelo='Ibiza')
+        self.assertEqual(
+            (coche.marca, coche.precio, coche.transmision, coche.fecha_fabricacion),
+            (self.datos['marcas'][0], Decimal('15000.50'), 'AT', date(2024, 5, 31)),
+        )
+        # La importación no pasa por save(): el índice de búsqueda se actualiza aparte
+        self.assertEqual(coincidentes('coche', {'modelo': 'ibiza'}), [coche.pk])
+
+
+# -------------------------------------------------------------------
+# Operaciones masivas
+# -------------------------------------------------------------------
+class MasivoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(12)
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    def setUp(self):
+        cache_catalogo().clear()
+        self.client.force_login(self.admin)
+
+    def test_ajuste_de_precio_por_marca_con_vista_previa(self):
+        marca = self.datos['marcas'][0]
+        coches = Coche.objects.filter(marca=marca)
+        antes = dict(coches.values_list('pk', 'precio'))
+        datos = {'marca': marca.pk, 'accion': 'ajustar_precio', 'porcentaje': '-10'}
+        # Primero solo se enseña el plan, sin tocar nada
+        response = self.client.post(reverse('AlphaAutos:operacion_masiva', args=['coches']), datos)
+        self.assertEqual(response.context['plan'], [('Coches', len(antes))])
+        self.assertEqual(dict(coches.values_list('pk', 'precio')), antes)
+
+        response = self.client.post(
+            reverse('AlphaAutos:operacion_masiva', args=['coches']), {**datos, 'confirmar': '1'}
+        )
+        self.assertRedirects(response, reverse('AlphaAutos:coche_list'))
+        self.assertEqual(
+            dict(coches.values_list('pk', 'precio')),
+            {pk: (precio * Decimal('0.9')).quantize(Decimal('0.01')) for pk, precio in antes.items()},
+        )
+
+    def test_ajuste_que_saca_precios_de_rango(self):
+        from . import masivo
+        barato, caro = self.datos['coches'][:2]
+        Coche.objects.filter(pk=barato.pk).update(precio=Decimal('0.40'))
+        Coche.objects.filter(pk=caro.pk).update(precio=Decimal('50000000.00'))
+        url = reverse('AlphaAutos:operacion_masiva', args=['coches'])
+        for porcentaje in ('-99', '1000'):
+            response = self.client.post(url, {'ids': f"{barato.pk},{caro.pk}", 'accion': 'ajustar_precio', 'porcentaje': porcentaje, 'confirmar': '1'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].has_error('porcentaje'))
+
+        # Si los precios cambian después de validar, el UPDATE los deja dentro de rango
+        masivo.cambiar_precio_coches(Coche.objects.filter(pk=barato.pk), porcentaje=Decimal('-99'))
+        masivo.cambiar_precio_coches(Coche.objects.filter(pk=caro.pk), porcentaje=Decimal('1000'))
+        self.assertEqual(Coche.objects.get(pk=barato.pk).precio, Decimal('0.01'))
+        self.assertEqual(Coche.objects.get(pk=caro.pk).precio, Decimal('99999999.99'))
+
+        # Los salarios, con las reglas de EmpleadoModelForm
+        bajo, alto = self.datos['empleados'][:2]
+        Empleado.objects.filter(pk=bajo.pk).update(salario=Decimal('0.40'))
+        Empleado.objects.filter(pk=alto.pk).update(salario=Decimal('500000.00'))
+        url = reverse('AlphaAutos:operacion_masiva', args=['empleados'])
+        for campo, valor in (('salario', '0'), ('porcentaje', '-99'), ('porcentaje', '1000')):
+            response = self.client.post(url, {'ids': f"{bajo.pk},{alto.pk}", 'accion': 'cambiar', 'confirmar': '1', campo: valor})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].has_error(campo), (campo, valor))
+        masivo.cambiar_empleados(Empleado.objects.filter(pk=alto.pk), porcentaje=Decimal('1000'))
+        self.assertEqual(Empleado.objects.get(pk=alto.pk).salario, Decimal('999999.99'))
+
+    def test_borrado_en_cascada_mantiene_resumenes_e_indice(self):
+        from . import masivo
+        seleccion = Coche.objects.filter(pk__in=[coche.pk for coche in self.datos['coches'][:4]])
+        self.assertEqual(dict(masivo.plan_borrado_coches(seleccion))['Ventas'], 4)
+        borrados = masivo.borrar_coches(seleccion)
+        self.assertEqual(
+            borrados,
+            {'Coches': 4, 'Ventas': 4, 'Seguros': 4, 'Seguros en aseguradoras': 4, 'Coches en mantenimientos': 0},
+        )
+        self.assertFalse(Venta.objects.filter(coche_id__in=[coche.pk for coche in self.datos['coches'][:4]]).exists())
+        self.assertEqual(coincidentes('coche', {'modelo': 'golf 0'}), [])
+        incrementales = sorted(ResumenVentas.objects.values_list('dimension', 'fecha', 'clave', 'total_ventas'))
+        resumenes.reconstruir()
+        self.assertEqual(
+            incrementales, sorted(ResumenVentas.objects.values_list('dimension', 'fecha', 'clave', 'total_ventas'))
+        )
+
+
+# -------------------------------------------------------------------
+# Resúmenes de ventas
+# -------------------------------------------------------------------
+class ResumenVentasTests(TestCase):
+
+    def setUp(self):
+        cache_catalogo().clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(12)
+
+    def resumenes_actuales(self):
+        return sorted(ResumenVentas.objects.values_list(
+            'dimension', 'fecha', 'clave', 'total_ventas', 'suma_importes', 'precio_min', 'precio_max'
+        ))
+
+    def assertResumenesCuadran(self):
+        # Lo mantenido por señales tiene que coincidir con un recálculo completo
+        incrementales = self.resumenes_actuales()
+        resumenes.reconstruir()
+        self.assertEqual(incrementales, self.resumenes_actuales())
+
+    def test_altas_ediciones_y_borrados_incrementales(self):
+        d = self.datos
+        venta = Venta.objects.create(
+            comprador=d['compradores'][7], coche=d['coches'][7], fecha_venta=date(2025, 1, 2),
+            precio_final=Decimal('99999.00'), metodo_pago="Tarjeta",
+        )
+        self.assertResumenesCuadran()
+        # Se edita el máximo del grupo y se mueve de método de pago
+        venta.precio_final = Decimal('100.00')
+        venta.metodo_pago = "Efectivo"
+        venta.save()
+        self.assertResumenesCuadran()
+        # Borrar el mínimo obliga a recalcular ese grupo
+        venta.delete()
+        self.assertResumenesCuadran()
+        coche = d['coches'][0]
+        coche.concesionario = d['concesionarios'][5]
+        coche.save()
+        self.assertResumenesCuadran()
+
+    def test_consulta_por_periodo_y_grupo(self):
+        resumen, grupos = resumenes.consultar(date(2025, 1, 1), date(2025, 1, 3), 'marca')
+        ventas = Venta.objects.filter(fecha_venta__range=(date(2025, 1, 1), date(2025, 1, 3)))
+        self.assertEqual(resumen['total_ventas'], ventas.count())
+        self.assertEqual(sum(g['total_ventas'] for g in grupos), ventas.count())
+        self.assertEqual({g['nombre'] for g in grupos}, set(ventas.values_list('coche__marca__nombre', flat=True)))
+
+
+# -------------------------------------------------------------------
+# Caché del catálogo
+# -------------------------------------------------------------------
+class CacheCatalogoTests(PresupuestoConsultasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    def setUp(self):
+        cache_catalogo().clear()
+        self.client.force_login(self.admin)
+
+    def urls_catalogo(self):
+        d = self.datos
+        return [
+            reverse('AlphaAutos:lista_marcas'),
+            reverse('AlphaAutos:lista_concesionarios'),
+            reverse('AlphaAutos:lista_aseguradoras'),
+            reverse('AlphaAutos:marca_detail', kwargs={'id_marca': d['marcas'][0].id}),
+            reverse('AlphaAutos:concesionario_detail', kwargs={'id_concesionario': d['concesionarios'][0].id}),
+            reverse('AlphaAutos:coche_detail', kwargs={'id_coche': d['coches'][0].id}),
+        ]
+
+    def test_catalogo_en_cache_no_consulta_el_catalogo(self):
+        for url in self.urls_catalogo():
+            self.client.get(url)
+        # Solo quedan la sesión y el usuario
+        for url in self.urls_catalogo():
+            self.assertPresupuestoUrl(2, url)
+
+    def test_editar_una_marca_solo_invalida_lo_suyo(self):
+        marca, otra = self.datos['marcas'][0], self.datos['marcas'][1]
+        url = reverse('AlphaAutos:marca_detail', kwargs={'id_marca': marca.id})
+        url_otra = reverse('AlphaAutos:marca_detail', kwargs={'id_marca': otra.id})
+        url_coche = reverse('AlphaAutos:coche_detail', kwargs={'id_coche': self.datos['coches'][0].id})
+        for direccion in (url, url_otra, url_coche, reverse('AlphaAutos:lista_marcas')):
+            self.client.get(direccion)
+
+        marca.nombre = "Marca renombrada"
+        marca.save()
+        self.assertContains(self.client.get(url), "Marca renombrada")
+        self.assertContains(self.client.get(url_coche), "MARCA RENOMBRADA")
+        self.assertContains(self.client.get(reverse('AlphaAutos:lista_marcas')), "Marca renombrada")
+        self.assertPresupuestoUrl(2, url_otra)
+
+    def test_invalidar_en_una_transaccion_vuelve_a_invalidar_al_confirmar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidar('prueba')
+            # Otra petición aún ve las filas de antes y las guarda con la versión nueva
+            obtener('prueba:1', ['prueba'], lambda: 'antes')
+        self.assertEqual(obtener('prueba:1', ['prueba'], lambda: 'después')[0], 'después')
+
+    def test_lru_expulsa_por_entradas_y_por_tamanio(self):
+        lru = LRUCache('pruebas-lru', {'OPTIONS': {'MAX_ENTRIES': 3, 'MAX_BYTES': 1000}})
+        lru.clear()
+        for clave in 'abc':
+            lru.set(clave, clave)
+        lru.get('a')
+        lru.set('d', 'd')
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 'a')
+        lru.set('grande', 'x' * 950)
+        self.assertEqual(lru.get('grande'), 'x' * 950)
+        self.assertIsNone(lru.get('c'))
+        self.assertLessEqual(lru.estadisticas()['bytes'], 1000)
+
+
+# -------------------------------------------------------------------
+# Stock disponible (Coche.vendido)
+# -------------------------------------------------------------------
+class StockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+
+    def setUp(self):
+        cache_catalogo().clear()
+
+    def vendido(self, coche):
+        coche.refresh_from_db(fields=['vendido'])
+        return coche.vendido
+
+    def test_vendido_sigue_a_las_ventas(self):
+        libre, otro = self.datos['coches'][4], self.datos['coches'][5]
+        self.assertFalse(self.vendido(libre))
+        venta = Venta.objects.create(
+            comprador=self.datos['compradores'][4], coche=libre, precio_final=libre.precio, metodo_pago="Tarjeta",
+        )
+        self.assertTrue(self.vendido(libre))
+        # Se reasigna la venta a otro coche: el primero vuelve a estar disponible
+        venta.coche = otro
+        venta.save()
+        self.assertFalse(self.vendido(libre))
+        self.assertTrue(self.vendido(otro))
+        venta.delete()
+        self.assertFalse(self.vendido(otro))
+
+    def test_reconciliar_corrige_descuadres(self):
+        Coche.objects.filter(pk=self.datos['coches'][0].pk).update(vendido=False)
+        Coche.objects.filter(pk=self.datos['coches'][5].pk).update(vendido=True)
+        self.assertEqual(stock.reconciliar(), 2)
+        self.assertEqual(stock.reconciliar(), 0)
+        self.assertEqual(
+            set(Coche.objects.filter(vendido=False).values_list('pk', flat=True)),
+            set(Coche.objects.filter(venta__isnull=True).values_list('pk', flat=True)),
+        )
+
+
+# -------------------------------------------------------------------
+# Rendiciones de imágenes
+# -------------------------------------------------------------------
+class ImagenesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(3)
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    def setUp(self):
+        cache_catalogo().clear()
+        self.client.force_login(self.admin)
+        self.media = tempfile.mkdtemp()
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+
+    def subida(self, color='red'):
+        contenido = io.BytesIO()
+        Image.new('RGB', (1600, 1000), color).save(contenido, 'PNG')
+        return SimpleUploadedFile('foto.png', contenido.getvalue(), content_type='image/png')
+
+    def test_rendiciones_se_encolan_y_sustituyen_al_original(self):
+        coche = self.datos['coches'][0]
+        coche.imagen = self.subida()
+        # La petición solo deja la tarea pendiente para cuando se confirme la transacción
+        # (junto a la invalidación de la caché del coche al confirmar, ver cache.invalidar)
+        with self.captureOnCommitCallbacks() as pendientes:
+            coche.save()
+        self.assertEqual(len(pendientes), 2)
+
+        self.assertEqual(imagenes.url_rendicion(coche.imagen, 'miniatura'), coche.imagen.url)
+        self.assertEqual(imagenes.generar_rendiciones(coche.imagen.name), 2)
+        self.assertEqual(imagenes.generar_rendiciones(coche.imagen.name), 0)
+        # El filtro no mira el disco: hasta que el coche lo apunta, sigue el original
+        self.assertEqual(imagenes.url_rendicion(coche.imagen, 'miniatura'), coche.imagen.url)
+        self.assertEqual(imagenes.marcar_rendida(coche.imagen.name), 1)
+        coche.refresh_from_db()
+
+        url = imagenes.url_rendicion(coche.imagen, 'miniatura')
+        self.assertTrue(url.endswith('_miniatura.webp'))
+        with default_storage.open(imagenes.ruta_rendicion(coche.imagen.name, 'miniatura')) as fichero:
+            self.assertEqual(Image.open(fichero).size, (160, 100))
+        self.assertContains(self.client.get(reverse('AlphaAutos:coche_list')), url)
+
+    @override_settings(ALPHAAUTOS_IMAGENES_HILOS=0)
+    def test_subida_igual_mientras_se_recolecta(self):
+        primero, segundo, tercero = self.datos['coches'][:3]
+        with self.captureOnCommitCallbacks(execute=True):
+            primero.imagen = self.subida()
+            primero.save()
+        nombre = primero.imagen.name
+
+        # El fichero se queda sin coches y el recolector pasa justo cuando otra subida igual
+        # va a contar su referencia: la subida tiene que acabar con el fichero en disco
+        with self.captureOnCommitCallbacks() as recolecciones:
+            Coche.objects.filter(pk=primero.pk).delete()
+        sumar_referencia = imagenes.sumar_referencia
+
+        def recolectar_y_sumar(nombre):
+            while recolecciones:
+                recolecciones.pop()()
+            sumar_referencia(nombre)
+
+        imagenes.sumar_referencia = recolectar_y_sumar
+        self.addCleanup(setattr, imagenes, 'sumar_referencia', sumar_referencia)
+        with self.captureOnCommitCallbacks(execute=True):
+            segundo.imagen = self.subida()
+            segundo.save()
+        self.assertEqual(segundo.imagen.name, nombre)
+        self.assertTrue(almacen_imagenes().exists(nombre))
+        self.assertEqual(ArchivoImagen.objects.get(nombre=nombre).referencias, 1)
+
+        # Y si la subida llega antes que el recolector, el fichero no se borra
+        with self.captureOnCommitCallbacks() as recolecciones:
+            Coche.objects.filter(pk=segundo.pk).delete()
+        imagenes.sumar_referencia = sumar_referencia
+        with self.captureOnCommitCallbacks(execute=True):
+            tercero.imagen = self.subida()
+            tercero.save()
+        for recolectar in recolecciones:
+            recolectar()
+        self.assertTrue(almacen_imagenes().exists(nombre))
+        self.assertEqual(ArchivoImagen.objects.get(nombre=nombre).referencias, 1)
+
+    @override_settings(ALPHAAUTOS_IMAGENES_HILOS=0)
+    def test_subidas_iguales_comparten_fichero_hasta_quedar_sin_referencias(self):
+        primero, segundo = self.datos['coches'][0], self.datos['coches'][1]
+        with self.captureOnCommitCallbacks(execute=True):
+            primero.imagen = self.subida()
+            primero.save()
+            segundo.imagen = self.subida()
+            segundo.save()
+        nombre = primero.imagen.name
+        self.assertEqual(segundo.imagen.name, nombre)
+        self.assertTrue(imagenes.es_nombre_contenido(nombre))
+        self.assertEqual(ArchivoImagen.objects.get(nombre=nombre).referencias, 2)
+
+        # Se borra un coche: el otro sigue usando el fichero
+        with self.captureOnCommitCallbacks(execute=True):
+            Coche.objects.filter(pk=primero.pk).delete()
+        self.assertTrue(almacen_imagenes().exists(nombre))
+
+        # Se sustituye la imagen del otro: el fichero y sus rendiciones se borran
+        with self.captureOnCommitCallbacks(execute=True):
+            segundo.imagen = self.subida('blue')
+            segundo.save()
+        self.assertFalse(almacen_imagenes().exists(nombre))
+        self.assertFalse(default_storage.exists(imagenes.ruta_rendicion(nombre, 'miniatura')))
+        self.assertFalse(ArchivoImagen.objects.filter(nombre=nombre).exists())
+        self.assertEqual(imagenes.huerfanos(), ([], []))
+
+
+# -------------------------------------------------------------------
+# Métricas por vista
+# -------------------------------------------------------------------
+@override_settings(ALPHAAUTOS_METRICAS_MUESTREO=1, ALPHAAUTOS_METRICAS_TOKEN='secreto')
+class MetricasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    def setUp(self):
+        cache_catalogo().clear()
+        metricas.registro.limpiar()
+
+    def test_percentiles_del_histograma(self):
+        histograma = metricas.Histograma((10, 20, 30))
+        for valor in range(1, 31):
+            histograma.anotar(valor)
+        self.assertEqual(histograma.percentil(50), 15)
+        self.assertEqual(histograma.percentil(100), 30)
+        self.assertEqual(histograma.acumuladas()[-1], ('+Inf', 30))
+
+    def test_mide_consultas_y_plantillas_por_vista(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('AlphaAutos:coche_list'))
+        self.client.get(reverse('AlphaAutos:coche_list'))
+        fila = next(f for f in metricas.registro.resumen() if f['vista'] == 'AlphaAutos:coche_list')
+        self.assertEqual(fila['peticiones'], 2)
+        # Sesión y usuario incluidos: el middleware es el primero de la lista
+        self.assertIn(fila['consultas']['max'], range(2, PRESUPUESTOS['coche_list'] + 1))
+        self.assertGreater(fila['tiempo_plantillas_ms']['max'], 0)
+        self.assertGreater(fila['bytes']['media'], 0)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('AlphaAutos:metricas_prometheus')).status_code, 403)
+        respuesta = self.client.get(
+            reverse('AlphaAutos:metricas_prometheus'), HTTP_AUTHORIZATION='Bearer secreto'
+        )
+        self.assertContains(respuesta, 'alphaautos_tiempo_ms_bucket{vista="AlphaAutos:coche_list",le="+Inf"} 2')
+        self.assertContains(respuesta, 'alphaautos_peticiones_total{vista="AlphaAutos:coche_list",estado="200"} 2')
+
+
+# -------------------------------------------------------------------
+# Consultas lentas y N+1
+# -------------------------------------------------------------------
+class VigilanciaSQLTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(8)
+
+    def test_huella_ignora_los_literales(self):
+        self.assertEqual(
+            vigilancia_sql.normalizar('SELECT * FROM "t1" WHERE id = 3 AND nombre = \'a\' AND x IN (1, 2, 3)'),
+            vigilancia_sql.normalizar('SELECT * FROM "t1" WHERE id = %s AND nombre = \'b\'  AND x IN (%s)'),
+        )
+
+    def test_avisa_del_n_mas_1_con_su_plantilla(self):
+        from django.http import HttpResponse
+        from django.template import engines
+        plantilla = engines['django'].from_string(
+            "{% for aseguradora in aseguradoras %}\n{{ aseguradora.seguros.count }}{% endfor %}"
+        )
+
+        def vista(request):
+            return HttpResponse(plantilla.render({'aseguradoras': Aseguradora.objects.all()}))
+
+        middleware = vigilancia_sql.VigilanciaSQLMiddleware(vista)
+        with self.assertLogs('AlphaAutos.sql') as logs:
+            middleware(RequestFactory().get('/aseguradoras/'))
+        evento = json.loads(logs.records[0].getMessage())
+        self.assertEqual((evento['evento'], evento['repeticiones']), ('n_mas_1', 8))
+        self.assertTrue(evento['plantilla'].endswith(':2'))
+        self.assertIn('?', evento['sql'])
+
+
+# -------------------------------------------------------------------
+# Benchmark
+# -------------------------------------------------------------------
+class BenchmarkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    @override_settings(ALPHAAUTOS_METRICAS_MUESTREO=1)
+    def test_mide_y_detecta_regresiones(self):
+        from . import benchmark
+        escenarios = benchmark.preparar(self.admin)
+        resultado = benchmark.medir_cliente(
+            self.admin, {nombre: escenarios[nombre] for nombre in ('coche_list', 'crear_venta')}, 3, calentamiento=1,
+        )
+        self.assertEqual(resultado['crear_venta']['errores'], 0)
+        self.assertEqual(resultado['coche_list']['peticiones'], 3)
+        self.assertIsNotNone(resultado['coche_list']['consultas_media'])
+
+        actual = {'resultados': {'cliente': {'coche_list': {'p95_ms': 10, 'peticiones_s': 100, 'consultas_media': 4}}}}
+        base = {'resultados': {'cliente': {'coche_list': {'p95_ms': 9, 'peticiones_s': 150, 'consultas_media': 3}}}}
+        self.assertEqual(
+            [(medida, round(cambio, 2)) for _, _, medida, _, _, cambio in benchmark.comparar(actual, base, 0.2)],
+            [('peticiones_s', 0.33), ('consultas_media', 0.33)],
+        )
+
+
+# -------------------------------------------------------------------
+# Perfil de base de datos
+# -------------------------------------------------------------------
+class BaseDatosTests(TestCase):
+
+    def test_pragmas_de_sqlite_en_cada_conexion(self):
+        from . import bd
+        if connection.vendor != 'sqlite':
+            self.skipTest('Solo en el perfil sqlite')
+        pragmas = bd.pragmas_actuales(connection)
+        # La BD de pruebas está en memoria: journal_mode es 'memory' en lugar de WAL
+        self.assertEqual((pragmas['synchronous'], pragmas['busy_timeout'], pragmas['temp_store']), (1, 20000, 2))
+        self.assertEqual(pragmas['cache_size'], -64 * 1024)
+
+
+# -------------------------------------------------------------------
+# Réplica de lectura
+# -------------------------------------------------------------------
+class ReplicaTests(TestCase):
+
+    def setUp(self):
+        from django.conf import settings
+        from django.db import router
+        from django.http import HttpResponse
+        from . import replicas
+
+        # Una vista @solo_lectura que dice a qué BD irían sus lecturas (sin consultar)
+        @replicas.solo_lectura
+        def vista(request):
+            if request.GET.get('escribe'):
+                replicas.RouterReplicas().db_for_write(Coche)
+            return HttpResponse(f"{router.db_for_read(Coche)} {router.db_for_read(Usuario)}")
+
+        self.middleware = replicas.ReplicaMiddleware(vista)
+        self.cookie = replicas.COOKIE
+        ajustes = override_settings(
+            DATABASES={**settings.DATABASES, 'replica': settings.DATABASES['default']},
+            ALPHAAUTOS_REPLICA_ALIAS='replica',
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def test_lecturas_a_la_replica_salvo_usuarios(self):
+        respuesta = self.middleware(RequestFactory().get('/coches/'))
+        self.assertEqual(respuesta.content, b'replica default')
+        self.assertNotIn(self.cookie, respuesta.cookies)
+
+    def test_tras_escribir_lee_del_primario(self):
+        for peticion in (RequestFactory().post('/coches/'), RequestFactory().get('/coches/', {'escribe': 1})):
+            respuesta = self.middleware(peticion)
+            self.assertIn(self.cookie, respuesta.cookies)
+
+        peticion = RequestFactory().get('/coches/')
+        peticion.COOKIES[self.cookie] = respuesta.cookies[self.cookie].value
+        self.assertEqual(self.middleware(peticion).content, b'default default')
+
+
+# -------------------------------------------------------------------
+# Vistas async (ASGI)
+# -------------------------------------------------------------------
+@override_settings(ROOT_URLCONF='mysite.urls_asgi')
+class VistasAsyncTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    async def test_detalle_de_concesionario(self):
+        from django.urls import resolve
+        from . import vistas_async
+        concesionario = self.datos['concesionarios'][0]
+        url = reverse('AlphaAutos:concesionario_detail', kwargs={'id_concesionario': concesionario.pk})
+        self.assertIs(resolve(url).func, vistas_async.concesionario_detail)
+
+        await self.async_client.aforce_login(self.admin)
+        respuesta = await self.async_client.get(url)
+        self.assertContains(respuesta, concesionario.nombre)
+        self.assertContains(respuesta, self.datos['empleados'][0].nombre)
+        self.assertContains(respuesta, self.datos['coches'][0].modelo)
+
+    async def test_index_guarda_la_sesion(self):
+        await self.async_client.aforce_login(self.admin)
+        for _ in range(2):
+            await self.async_client.get(reverse('AlphaAutos:index'))
+        sesion = self.async_client.session
+        self.assertEqual(await sesion.aget('rol_texto'), self.admin.get_rol_display())
+        self.assertEqual(sesiones.visitas(await sesion.aget('id_visitas')), 2)
+
+
+# -------------------------------------------------------------------
+# Sesiones
+# -------------------------------------------------------------------
+class SesionesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    @override_settings(ALPHAAUTOS_VISITAS_VOLCADO_S=0)
+    def test_la_home_no_escribe_en_la_bd(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('AlphaAutos:index'))
+
+        escrituras = []
+
+        def anotar(execute, sql, params, many, context):
+            if not sql.lstrip().upper().startswith(('SELECT', 'SAVEPOINT', 'RELEASE')):
+                escrituras.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(anotar):
+            for _ in range(3):
+                respuesta = self.client.get(reverse('AlphaAutos:index'))
+        self.assertEqual(escrituras, [])
+        # Volcado en cada visita (intervalo 0): la cuenta ya está en la caché
+        self.assertContains(respuesta, 'Visitas Home: 4')
+
+
+# -------------------------------------------------------------------
+# Reservas y venta sin vender dos veces
+# -------------------------------------------------------------------
+class ReservasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+        cls.uno, cls.otro = (comprador.usuario for comprador in cls.datos['compradores'][:2])
+
+    def setUp(self):
+        cache_catalogo().clear()
+
+    def venta(self, coche, comprador=0):
+        return Venta(
+            comprador=self.datos['compradores'][comprador], coche=coche, precio_final=coche.precio,
+            metodo_pago="Tarjeta",
+        )
+
+    def test_un_coche_solo_se_vende_una_vez(self):
+        libre, vendido = self.datos['coches'][4], self.datos['coches'][0]
+        self.assertFalse(reservas.vender(self.venta(vendido), self.uno))
+
+        # Reservado por uno: el otro no puede ni reservarlo ni venderlo
+        self.assertTrue(reservas.reservar(libre.pk, self.uno))
+        self.assertFalse(reservas.reservar(libre.pk, self.otro))
+        self.assertFalse(reservas.vender(self.venta(libre, 1), self.otro))
+        self.assertNotIn(libre, reservas.disponibles(self.otro))
+
+        self.assertTrue(reservas.vender(self.venta(libre), self.uno))
+        self.assertFalse(reservas.vender(self.venta(libre), self.uno))
+        self.assertEqual(Venta.objects.filter(coche=libre, anulada=False).count(), 1)
+        libre.refresh_from_db()
+        self.assertEqual((libre.vendido, libre.reservado_por_id), (True, None))
+
+        # La restricción única es la última barrera aunque vendido esté desincronizado
+        Coche.objects.filter(pk=libre.pk).update(vendido=False)
+        self.assertFalse(reservas.vender(self.venta(libre), self.otro))
+        with self.assertRaises(IntegrityError):
+            self.venta(libre).save()
+
+    def test_reserva_caducada_y_venta_anulada_liberan_el_coche(self):
+        libre, vendido = self.datos['coches'][5], self.datos['coches'][1]
+        Coche.objects.filter(pk=libre.pk).update(
+            reservado_por=self.uno, reservado_hasta=timezone.now() - timedelta(seconds=1),
+        )
+        self.assertTrue(reservas.reservar(libre.pk, self.otro))
+
+        # Al anular la venta, el coche vuelve a estar disponible
+        venta = Venta.objects.get(coche=vendido)
+        venta.anulada = True
+        venta.save()
+        vendido.refresh_from_db()
+        self.assertFalse(vendido.vendido)
+        self.assertTrue(reservas.vender(self.venta(vendido, 1), self.otro))
+
+    def test_reservar_es_un_post_y_vender_se_oculta_al_venderse(self):
+        coche = self.datos['coches'][3]
+        admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+        self.client.force_login(admin)
+        detalle = reverse('AlphaAutos:coche_detail', kwargs={'id_coche': coche.pk})
+        reservar = reverse('AlphaAutos:reservar_coche', kwargs={'id_coche': coche.pk})
+        self.assertContains(self.client.get(detalle), 'form="form-vender"')
+
+        # Un GET (precarga, rastreador) no reserva nada
+        self.client.get(reverse('AlphaAutos:crear_venta'), {'coche': coche.pk})
+        self.assertEqual(self.client.get(reservar).status_code, 405)
+        self.assertTrue(reservas.reservar(coche.pk, self.uno))
+        self.assertRedirects(self.client.post(reservar), detalle, fetch_redirect_response=False)
+
+        # Vendido: el detalle cacheado deja de ofrecer el botón
+        self.assertTrue(reservas.vender(self.venta(coche), self.uno))
+        self.assertNotContains(self.client.get(detalle), 'form-vender')
+
+
+# -------------------------------------------------------------------
+# Filas de coches y perfil del render de plantillas
+# -------------------------------------------------------------------
+class FilasPlantillasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    def setUp(self):
+        cache_catalogo().clear()
+
+    def test_fila_coche_segun_permisos(self):
+        coche = self.datos['coches'][0]
+        self.client.force_login(self.admin)
+        respuesta = self.client.get(reverse('AlphaAutos:coche_list'))
+        for ruta in ('coche_detail', 'editar_coche', 'eliminar_coche'):
+            self.assertContains(respuesta, f'href="{reverse(f"AlphaAutos:{ruta}", args=[coche.pk])}"', count=1)
+        self.assertContains(respuesta, 'name="ids"', count=6)
+
+        # Un comprador no puede editar ni borrar: ni botones ni casillas
+        self.client.force_login(self.datos['compradores'][0].usuario)
+        respuesta = self.client.get(reverse('AlphaAutos:coche_list'))
+        self.assertNotContains(respuesta, reverse('AlphaAutos:editar_coche', args=[coche.pk]))
+        self.assertNotContains(respuesta, 'name="ids"')
+
+    def test_perfil_por_plantilla_y_etiqueta(self):
+        if not perfil_plantillas.instalado():
+            self.skipTest('ALPHAAUTOS_PERFIL_PLANTILLAS desactivado')
+        self.client.force_login(self.admin)
+        with perfil_plantillas.perfilar() as perfil:
+            self.client.get(reverse('AlphaAutos:coche_list'))
+        llamadas = {(plantilla, etiqueta): n for plantilla, _, etiqueta, n, _, _ in perfil.por_nodo()}
+        self.assertEqual(llamadas['concesionario/coche_list.html', '{% fila_coche %}'], 6)
+        self.assertEqual(llamadas['concesionario/for_row_coche.html', '{{ coche.marca.nombre|upper }}'], 6)
+
+        respuesta = self.client.get(reverse('AlphaAutos:coche_list'), {'perfil_plantillas': ''})
+        self.assertEqual(respuesta['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertContains(respuesta, 'concesionario/for_row_coche.html')
+
+
+class JinjaListadosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    def setUp(self):
+        if 'jinja2' not in engines:
+            self.skipTest('jinja2 no está instalado')
+        cache_catalogo().clear()
+
+    def pagina(self, ruta, jinja2):
+        with override_settings(ALPHAAUTOS_JINJA2=jinja2):
+            respuesta = self.client.get(ruta)
+        self.assertEqual(respuesta.status_code, 200)
+        # Mismo HTML salvo el token CSRF (cambia en cada render), entidades y espacios
+        texto = re.sub(r'csrfmiddlewaretoken" value="[^"]+', '', respuesta.content.decode())
+        return ' '.join(html.unescape(texto).split())
+
+    def test_mismo_html_que_django(self):
+        rutas = [
+            reverse('AlphaAutos:coche_list'), reverse('AlphaAutos:lista_ventas'),
+            reverse('AlphaAutos:lista_clientes'), reverse('AlphaAutos:buscar_coches') + '?modelo=a',
+        ]
+        for usuario in (self.admin, self.datos['compradores'][0].usuario):
+            self.client.force_login(usuario)
+            for ruta in rutas:
+                with self.subTest(usuario=usuario.username, ruta=ruta):
+                    self.assertEqual(self.pagina(ruta, True), self.pagina(ruta, False))
+
+
+class AutocompletarTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+        cls.admin = Usuario.objects.create_superuser('admin', 'admin@alphaautos.es', 'clave-segura-123')
+
+    def setUp(self):
+        # Los índices son del proceso: que no queden filas de otras pruebas
+        autocompletar.reiniciar()
+        self.addCleanup(autocompletar.reiniciar)
+
+    def sugerir(self, tipo, q):
+        respuesta = self.client.get(reverse('AlphaAutos:autocompletar', args=[tipo]), {'q': q})
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()['sugerencias']
+
+    def test_prefijos_sin_consultas(self):
+        self.client.force_login(self.datos['compradores'][0].usuario)
+        self.sugerir('modelo', 'g')
+        # Cargado el índice, cada pulsación sale de memoria (la sesión, de la caché)
+        with self.assertNumQueries(0):
+            sugerencias = self.sugerir('modelo', 'GOLF 1')
+        self.assertEqual(sugerencias, [{'texto': 'Golf 1', 'total': 1}])
+        # Cualquier palabra del texto, sin tildes ni mayúsculas
+        self.assertEqual(self.sugerir('ciudad', 'sev'), [{'texto': 'Sevilla', 'total': 6}])
+        self.assertEqual(len(self.sugerir('concesionario', '  conCESIONARIO ')), 6)
+        self.assertEqual([s['texto'] for s in self.sugerir('marca', '2')], ['Marca 2'])
+
+        # Los usuarios de los compradores necesitan view_comprador
+        url = reverse('AlphaAutos:autocompletar', args=['usuario'])
+        self.assertEqual(self.client.get(url, {'q': 'comp'}).status_code, 403)
+        self.client.force_login(self.admin)
+        self.assertEqual(len(self.sugerir('usuario', 'comp')), 6)
+        self.client.logout()
+        self.assertEqual(self.client.get(url, {'q': 'comp'}).status_code, 403)
+
+    def test_senales_al_confirmar(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(self.sugerir('marca', 'sko'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            marca = Marca.objects.create(nombre='Škoda Auto', pais_origen='Chequia')
+        self.assertEqual(self.sugerir('marca', 'sko'), [{'texto': 'Škoda Auto', 'ids': [marca.pk]}])
+        self.assertEqual(self.sugerir('marca', 'auto')[0]['texto'], 'Škoda Auto')
+
+        comprador = self.datos['compradores'][0]
+        with self.captureOnCommitCallbacks(execute=True):
+            comprador.usuario.username = 'zoe'
+            comprador.usuario.save()
+            marca.delete()
+        self.assertEqual(self.sugerir('usuario', 'zo'), [{'texto': 'zoe', 'ids': [comprador.pk]}])
+        self.assertEqual(self.sugerir('marca', 'sko'), [])
+
+        # Si la transacción se deshace, el índice no cambia
+        with self.captureOnCommitCallbacks(execute=False):
+            Marca.objects.create(nombre='Seat', pais_origen='España')
+        self.assertEqual(self.sugerir('marca', 'seat'), [])
+
+
+class OpcionesRemotasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(6)
+        cls.gerente = Usuario.objects.create_user('gerente', 'gerente@alphaautos.es', 'clave-segura-123', rol=Usuario.GERENTE)
+        cls.gerente.user_permissions.add(Permission.objects.get(codename='add_venta'))
+        # bulk_create no indexa: el índice de texto de los coches, de una vez
+        buscador.obtener_buscador().reconstruir(buscador.INDICES['coche'])
+
+    def setUp(self):
+        cache_catalogo().clear()
+        self.client.force_login(self.gerente)
+
+    def opciones(self, relacion, **parametros):
+        respuesta = self.client.get(reverse('AlphaAutos:opciones', args=[relacion]), parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def todas(self, relacion, **parametros):
+        # Recorre todas las páginas del cursor
+        vistos, cursor = [], ''
+        while cursor is not None:
+            pagina = self.opciones(relacion, despues=cursor, **parametros)
+            vistos += [resultado['id'] for resultado in pagina['resultados']]
+            cursor = pagina['siguiente']
+        return vistos
+
+    def test_desplegable_sin_filas_y_api_por_cursor(self):
+        # El formulario no trae los coches ni los compradores: solo la opción vacía
+        respuesta = self.client.get(reverse('AlphaAutos:crear_venta'))
+        self.assertContains(respuesta, f'data-opciones="{reverse("AlphaAutos:opciones", args=["coche_venta"])}"')
+        for campo in ('coche', 'comprador'):
+            desplegable = re.search(rf'<select name="{campo}".*?</select>', respuesta.content.decode(), re.S)
+            self.assertEqual(desplegable.group().count('<option'), 1)
+
+        # Las opciones, de 2 en 2: solo los coches sin vender (la otra mitad está vendida)
+        libres = [coche.pk for coche in self.datos['coches'][3:]]
+        self.assertEqual(sorted(self.todas('coche_venta', tamanio=2)), libres)
+        self.assertEqual([r['id'] for r in self.opciones('coche_venta', q='golf 4')['resultados']], [libres[1]])
+        # Con texto, el cursor recorre todas las coincidencias que el usuario puede vender
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(sorted(self.todas('coche_venta', tamanio=2, q='golf')), libres)
+        # Sin lista de ids aparte: la búsqueda va en la misma consulta que el filtro de disponibles
+        busquedas = [c['sql'] for c in consultas.captured_queries if 'MATCH' in c['sql']]
+        self.assertTrue(busquedas and all('"vendido"' in sql for sql in busquedas), busquedas)
+
+        # Las marcas son para quien puede crear o editar coches
+        self.assertEqual(self.client.get(reverse('AlphaAutos:opciones', args=['marca'])).status_code, 403)
+
+    def test_post_valida_solo_el_id_enviado(self):
+        hoy = date.today()
+        datos = {
+            'comprador': self.datos['compradores'][0].pk, 'metodo_pago': 'Tarjeta',
+            'fecha_venta_day': hoy.day, 'fecha_venta_month': hoy.month, 'fecha_venta_year': hoy.year,
+        }
+        # Un coche vendido no está en el queryset: error, y la página vuelve con la opción elegida sola
+        vendido = self.datos['coches'][0]
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.post(reverse('AlphaAutos:crear_venta'), {**datos, 'coche': vendido.pk})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.context['form'].has_error('coche'))
+        coches = [c['sql'] for c in consultas.captured_queries if 'FROM "AlphaAutos_coche"' in c['sql']]
+        self.assertTrue(coches and all(f'= {vendido.pk}' in sql or 'IN (' in sql for sql in coches), coches)
+
+        libre = self.datos['coches'][4]
+        respuesta = self.client.post(reverse('AlphaAutos:crear_venta'), {**datos, 'coche': libre.pk})
+        self.assertRedirects(respuesta, reverse('AlphaAutos:lista_ventas'), fetch_redirect_response=False)
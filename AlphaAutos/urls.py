@@ -20,6 +20,7 @@ urlpatterns = [
     path('concesionarios/', views.lista_concesionarios, name='lista_concesionarios'),
     path('marcas/', views.lista_marcas, name='lista_marcas'),
     path('coche/nuevo/', views.crear_coche, name='crear_coche'),
+    path('coches/importar/', views.importar_coches, name='importar_coches'),
     path('concesionario/nuevo/', views.crear_concesionario, name='crear_concesionario'),
     path('marca/nuevo/', views.crear_marca, name='crear_marca'),
     path('marca/<int:id_marca>/', views.marca_detail, name='marca_detail'),
@@ -55,9 +56,16 @@ urlpatterns = [
     path('ventas/', views.lista_ventas, name='lista_ventas'),
     path('venta/<int:id_venta>/', views.venta_detail, name='venta_detail'),
     path('venta/nueva/', views.crear_venta, name='crear_venta'),
+    path('coche/<int:id_coche>/reservar/', views.reservar_coche, name='reservar_coche'),
     path('venta/buscar/', views.buscar_ventas, name='buscar_ventas'),
     path('venta/editar/<int:id_venta>/', views.editar_venta, name='editar_venta'),
     path('venta/eliminar/<int:id_venta>/', views.eliminar_venta, name='eliminar_venta'),
+    path('exportar/<str:tipo>/', views.exportar, name='exportar'),
+    path('autocompletar/<str:tipo>/', views.autocompletar_api, name='autocompletar'),
+    path('opciones/<str:relacion>/', views.opciones_api, name='opciones'),
+    path('metricas/', views.ver_metricas, name='metricas'),
+    path('metricas/prometheus/', views.metricas_prometheus, name='metricas_prometheus'),
+    path('masivo/<str:tipo>/', views.operacion_masiva, name='operacion_masiva'),
     path('password_change/', views.CustomPasswordChangeView.as_view(), name='password_change'),
     path('password_reset/', auth_views.PasswordResetView.as_view(
         template_name='concesionario/registration/password_reset_form.html',
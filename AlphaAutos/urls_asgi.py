@@ -0,0 +1,19 @@
+import copy
+
+from . import urls, vistas_async
+
+# Las mismas rutas que urls.py (mismos nombres y parámetros), pero las
+# que tienen versión en vistas_async.py apuntan a ella. Lo usa
+# mysite/urls_asgi.py, el ROOT_URLCONF al servir con ASGI.
+app_name = urls.app_name
+
+
+def _version_async(ruta):
+    if getattr(ruta, 'name', None) not in vistas_async.VISTAS:
+        return ruta
+    ruta = copy.copy(ruta)
+    ruta.callback = vistas_async.VISTAS[ruta.name]
+    return ruta
+
+
+urlpatterns = [_version_async(ruta) for ruta in urls.urlpatterns]
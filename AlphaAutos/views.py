@@ -3,16 +3,29 @@ from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.models import Group
 from django.contrib.auth.decorators import login_required, permission_required
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.conf import settings
+import hmac
+from django.db import transaction
 from django.db.models import Q, Avg, Max, Min, Count, Sum
 from django.contrib.auth.hashers import make_password
-from datetime import datetime
+import io
+from datetime import date, datetime
 from .models import *
 from .form import *
 import AlphaAutos.form as form_module 
 from django.contrib.auth.views import PasswordChangeView, PasswordResetConfirmView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib import messages
-from django.contrib.auth import logout
+from django.contrib.auth import logout, SESSION_KEY
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_POST
+from . import autocompletar, buscador, exportacion, importacion, masivo, metricas, opciones, reservas, resumenes, sesiones
+from . import cache as catalogo
+from .paginacion import paginar_busqueda, paginar_keyset, streaming_coches, ORDEN_MARCA, ORDEN_FECHA, ORDEN_NOMBRE, ORDEN_USUARIO, ORDEN_VENTA
+from .replicas import solo_lectura
 
 # -------------------------------
 # VISTA: Errores
@@ -29,26 +42,28 @@ def mi_error_403(request, exception=None):
 def mi_error_400(request, exception=None):
     return render(request, "errores/400.html", status=400)
 
+# Motor de los listados y búsquedas más pesados: Jinja2 con ALPHAAUTOS_JINJA2 (AlphaAutos/jinja.py)
+def motor_listados():
+    return 'jinja2' if settings.ALPHAAUTOS_JINJA2 else None
+
 # -------------------------------
 # VISTA: Página inicial (Index)
 # -------------------------------
+@solo_lectura
 def index(request):
-    # VARIABLE SESIÓN 1: Fecha inicio (Global)
-    if "fecha_inicio" not in request.session:
-        request.session["fecha_inicio"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-    
-    # LÓGICA SOLO PARA USUARIOS LOGUEADOS (Variables de sesión extra)
+    # VARIABLES DE SESIÓN 1-3: fecha de inicio, ID del usuario y rol en texto.
+    # Se guardan al hacer login (AlphaAutos/sesiones.py); aquí solo se rellenan
+    # si faltan, así que la home no guarda la sesión en cada visita
     if request.user.is_authenticated:
-        # VARIABLE SESIÓN 2: ID del usuario
-        if "id_usuario" not in request.session:
-            request.session["id_usuario"] = request.user.id
-            
-        # VARIABLE SESIÓN 3: Rol en texto
-        if "rol_texto" not in request.session:
-            request.session["rol_texto"] = request.user.get_rol_display()
-            
-        # VARIABLE SESIÓN 4: Contador de visitas a la Home
-        request.session["visitas_home"] = request.session.get("visitas_home", 0) + 1
+        faltan = {
+            clave: valor for clave, valor in sesiones.datos_sesion(request.user).items()
+            if clave not in request.session
+        }
+        if faltan:
+            request.session.update(faltan)
+
+        # VARIABLE SESIÓN 4: Contador de visitas a la Home (en memoria, se vuelca por lotes)
+        sesiones.anotar_visita(request.session["id_visitas"])
 
     return render(request, 'concesionario/index.html')
 
@@ -56,52 +71,74 @@ def index(request):
 # VISTA: Listar todos los coches (Requiere Login)
 # --------------------------------------------------
 @login_required
+@solo_lectura
 def coche_list(request):
-    coches = Coche.objects.select_related('marca', 'concesionario').order_by('marca__nombre')
-    contexto = {'coches': coches}
-    return render(request, 'concesionario/coche_list.html', contexto)
+    coches = Coche.objects.select_related('marca', 'concesionario')
+    if request.GET.get('formato') == 'stream':
+        return streaming_coches(request, coches.order_by(*ORDEN_MARCA), 'Listado de Coches')
+
+    pagina = paginar_keyset(request, coches, ORDEN_MARCA)
+    contexto = {'coches': pagina, 'pagina': pagina}
+    return render(request, 'concesionario/coche_list.html', contexto, using=motor_listados())
 
 # ------------------------------------------------------------
 # VISTA: Detalle Coche (Requiere Login)
 # ------------------------------------------------------------
 @login_required
+@solo_lectura
 def coche_detail(request, id_coche):
-    coche = get_object_or_404(
-        Coche.objects.select_related('marca', 'concesionario'),
-        id=id_coche
+    coche, firma = catalogo.obtener(
+        f"coche:{id_coche}", [f"coche:{id_coche}"],
+        lambda: get_object_or_404(Coche.objects.select_related('marca', 'concesionario'), id=id_coche),
+        dependencias_de=lambda c: [f"marca:{c.marca_id}", f"concesionario:{c.concesionario_id}"],
     )
-    contexto = {'coche': coche}
+    contexto = {'coche': coche, 'firma_cache': firma}
     return render(request, 'concesionario/coche_detail.html', contexto)
 
 # ----------------------------------------------------------------
 # VISTA: Coches por fecha (Requiere Login)
 # ----------------------------------------------------------------
 @login_required
+@solo_lectura
 def coches_por_fecha(request, anio, mes):
-    coches = Coche.objects.filter(
-        fecha_fabricacion__year=anio,
-        fecha_fabricacion__month=mes
-    ).select_related('marca', 'concesionario').order_by('-fecha_fabricacion')
+    # Rango [día 1 del mes, día 1 del mes siguiente): a diferencia de __year/__month
+    # no aplica funciones a la columna, así que puede usar el índice de la fecha
+    if 1 <= mes <= 12 and 1 <= anio < 9999:
+        inicio = date(anio, mes, 1)
+        fin = date(anio + mes // 12, mes % 12 + 1, 1)
+        coches = Coche.objects.filter(fecha_fabricacion__gte=inicio, fecha_fabricacion__lt=fin)
+    else:
+        coches = Coche.objects.none()
+    coches = coches.select_related('marca', 'concesionario')
+    if request.GET.get('formato') == 'stream':
+        return streaming_coches(request, coches.order_by(*ORDEN_FECHA), f'Coches fabricados en {mes}/{anio}')
 
-    contexto = {'coches': coches, 'anio': anio, 'mes': mes}
+    pagina = paginar_keyset(request, coches, ORDEN_FECHA)
+    contexto = {'coches': pagina, 'pagina': pagina, 'anio': anio, 'mes': mes}
     return render(request, 'concesionario/coches_por_fecha.html', contexto)
 
 # -----------------------------------------------------------------
 # VISTA: Coches por transmisión (Requiere Login)
 # -----------------------------------------------------------------
 @login_required
+@solo_lectura
 def coches_transmision(request, tipo):
+    # IN en vez de OR para que use el índice de transmisión
     coches = Coche.objects.filter(
-        Q(transmision=tipo) | Q(transmision='MT')
-    ).select_related('marca', 'concesionario').order_by('marca__nombre')
+        transmision__in=[tipo, 'MT']
+    ).select_related('marca', 'concesionario')
+    if request.GET.get('formato') == 'stream':
+        return streaming_coches(request, coches.order_by(*ORDEN_MARCA), f'Coches con transmisión {tipo} o manual')
 
-    contexto = {'coches': coches, 'tipo': tipo}
+    pagina = paginar_keyset(request, coches, ORDEN_MARCA)
+    contexto = {'coches': pagina, 'pagina': pagina, 'tipo': tipo}
     return render(request, 'concesionario/coches_transmision.html', contexto)
 
 # -------------------------------------------------------------------
 # VISTA: Coches por concesionario y texto (Requiere Login)
 # -------------------------------------------------------------------
 @login_required
+@solo_lectura
 def coches_concesionario_texto(request, id_concesionario, texto):
     coches = Coche.objects.filter(
         concesionario_id=id_concesionario,
@@ -116,8 +153,11 @@ def coches_concesionario_texto(request, id_concesionario, texto):
 # VISTA: Último cliente de un coche (Requiere Login)
 # -------------------------------------------------------------------
 @login_required
+@solo_lectura
 def ultimo_cliente_coche(request, id_coche):
-    ultima_venta = Venta.objects.filter(coche_id=id_coche).order_by('-fecha_venta').first()
+    ultima_venta = Venta.objects.filter(coche_id=id_coche).select_related(
+        'coche__marca', 'comprador__usuario'
+    ).order_by('-fecha_venta').first()
     ultimo_cliente = ultima_venta.comprador if ultima_venta else None # Corregido a .comprador según modelo
 
     contexto = {'venta': ultima_venta, 'ultimo_cliente': ultimo_cliente}
@@ -127,64 +167,99 @@ def ultimo_cliente_coche(request, id_coche):
 # VISTA: Coches sin ventas (Requiere Login)
 # --------------------------------------------------------------------
 @login_required
+@solo_lectura
 def coches_sin_ventas(request):
-    coches = Coche.objects.filter(venta__isnull=True).select_related('marca', 'concesionario').order_by('marca__nombre')
-    contexto = {'coches': coches}
+    # Coche.vendido lo mantienen las señales de Venta: índice parcial, sin anti-join
+    coches = Coche.objects.filter(vendido=False).select_related('marca', 'concesionario')
+    if request.GET.get('formato') == 'stream':
+        return streaming_coches(request, coches.order_by(*ORDEN_MARCA), 'Coches sin ventas registradas')
+
+    pagina = paginar_keyset(request, coches, ORDEN_MARCA)
+    contexto = {'coches': pagina, 'pagina': pagina}
     return render(request, 'concesionario/coches_sin_ventas.html', contexto)
 
 # -------------------------------------------------------------------
 # VISTA: Detalle Concesionario (Requiere Login)
 # -------------------------------------------------------------------
 @login_required
+@solo_lectura
 def concesionario_detail(request, id_concesionario):
-    concesionario = get_object_or_404(Concesionario, id=id_concesionario)
-    empleados = concesionario.empleado_set.all()
-    coches = concesionario.coche_set.select_related('marca').all()
+    concesionario, firma = catalogo.obtener(
+        f"concesionario:{id_concesionario}", [f"concesionario:{id_concesionario}"],
+        lambda: get_object_or_404(Concesionario, id=id_concesionario),
+    )
+    empleados, firma_empleados = catalogo.obtener(
+        f"concesionario:{id_concesionario}:empleados", [f"concesionario:{id_concesionario}:empleados"],
+        lambda: list(concesionario.empleado_set.all()),
+    )
+    # Las filas muestran la marca y el nombre del concesionario
+    coches, firma_coches = catalogo.obtener(
+        f"concesionario:{id_concesionario}:coches",
+        [f"concesionario:{id_concesionario}:coches", f"concesionario:{id_concesionario}"],
+        lambda: list(concesionario.coche_set.select_related('marca', 'concesionario')),
+        dependencias_de=lambda coches: {f"marca:{c.marca_id}" for c in coches},
+    )
 
-    contexto = {'concesionario': concesionario, 'empleados': empleados, 'coches': coches}
+    contexto = {
+        'concesionario': concesionario, 'empleados': empleados, 'coches': coches,
+        'firma_cache': firma + firma_empleados + firma_coches,
+    }
     return render(request, 'concesionario/concesionario_detail.html', contexto)
 
 # -------------------------------------------------------------------
 # VISTA: Resumen Ventas (Requiere Login)
 # -------------------------------------------------------------------
 @login_required
+@solo_lectura
 def resumen_ventas(request):
-    resumen = Venta.objects.aggregate(
-        total_ventas=Count('id'),
-        suma_importes=Sum('precio_final'),
-        precio_medio=Avg('precio_final'),
-        precio_max=Max('precio_final'),
-        precio_min=Min('precio_final')
+    # Se responde desde ResumenVentas (agregados por día), no recorriendo Venta
+    form = ResumenVentasForm(request.GET or None)
+    filtros = form.cleaned_data if form.is_bound and form.is_valid() else {}
+    resumen, grupos = resumenes.consultar(
+        filtros.get('desde'), filtros.get('hasta'), filtros.get('agrupar') or None
     )
-    return render(request, 'concesionario/resumen_ventas.html', {'resumen': resumen})
+    contexto = {'form': form, 'resumen': resumen, 'grupos': grupos, 'agrupar': filtros.get('agrupar')}
+    return render(request, 'concesionario/resumen_ventas.html', contexto)
 
 # -------------------------------------------------------------------
 # VISTA: Listas Generales (Requiere Login)
 # -------------------------------------------------------------------
 @login_required
+@solo_lectura
 def lista_concesionarios(request):
-    concesionarios = Concesionario.objects.all()
-    return render(request, 'concesionario/lista_concesionario.html', {'concesionarios': concesionarios})
+    concesionarios, firma = catalogo.obtener(
+        'lista:concesionario', ['lista:concesionario'], lambda: list(Concesionario.objects.all())
+    )
+    contexto = {'concesionarios': concesionarios, 'firma_cache': firma}
+    return render(request, 'concesionario/lista_concesionario.html', contexto)
 
 @login_required
+@solo_lectura
 def lista_marcas(request):
-    marcas = Marca.objects.all()
-    return render(request, 'concesionario/lista_marcas.html', {'marcas': marcas})
+    marcas, firma = catalogo.obtener('lista:marca', ['lista:marca'], lambda: list(Marca.objects.all()))
+    return render(request, 'concesionario/lista_marcas.html', {'marcas': marcas, 'firma_cache': firma})
 
 @login_required
+@solo_lectura
 def lista_empleados(request):
-    empleados = Empleado.objects.all()
-    return render(request, 'concesionario/lista_empleados.html', {'empleados': empleados})
+    empleados = Empleado.objects.select_related('concesionario').all()
+    return render(request, 'concesionario/lista_empleados.html', {'empleados': empleados}, using=motor_listados())
 
 @login_required
+@solo_lectura
 def lista_clientes(request):
     clientes = Comprador.objects.select_related('usuario').all()
-    return render(request, 'concesionario/lista_clientes.html', {'clientes': clientes})
+    return render(request, 'concesionario/lista_clientes.html', {'clientes': clientes}, using=motor_listados())
 
 @login_required
+@solo_lectura
 def lista_aseguradoras(request):
-    aseguradoras = Aseguradora.objects.all()
-    return render(request, 'concesionario/lista_aseguradoras.html', {'aseguradoras': aseguradoras})
+    aseguradoras, firma = catalogo.obtener(
+        'lista:aseguradora', ['lista:aseguradora', 'seguros'],
+        lambda: list(Aseguradora.objects.prefetch_related('seguros')),
+    )
+    contexto = {'aseguradoras': aseguradoras, 'firma_cache': firma}
+    return render(request, 'concesionario/lista_aseguradoras.html', contexto)
 
 # ===================================================================
 # GESTIÓN DE COCHES (CRUD)
@@ -202,6 +277,29 @@ def crear_coche(request):
         form = CocheModelForm()
     return render(request, 'Crud_Coche/crear_coche.html', {'form': form})
 
+# Alta masiva desde la hoja de un proveedor (mismas reglas que CocheModelForm)
+@permission_required('AlphaAutos.add_coche')
+def importar_coches(request):
+    resultado = None
+    if request.method == 'POST':
+        form = ImportarCochesForm(request.POST, request.FILES)
+        if form.is_valid():
+            # El CSV se lee en streaming, sin cargar el fichero entero
+            lineas = io.TextIOWrapper(form.cleaned_data['fichero'].file, encoding='utf-8-sig', newline='')
+            try:
+                resultado = importacion.importar_coches(
+                    lineas, simular=form.cleaned_data['simular'], delimitador=form.cleaned_data['delimitador']
+                )
+            except UnicodeDecodeError:
+                messages.error(request, "El fichero no está en UTF-8. Los lotes anteriores al error ya se han guardado.")
+            else:
+                if resultado.creados and not form.cleaned_data['simular']:
+                    messages.success(request, f"{resultado.creados} coches importados.")
+    else:
+        form = ImportarCochesForm()
+    contexto = {'form': form, 'resultado': resultado, 'columnas': importacion.COLUMNAS}
+    return render(request, 'Crud_Coche/importar_coches.html', contexto)
+
 @permission_required('AlphaAutos.change_coche')
 def editar_coche(request, id_coche):
     coche = get_object_or_404(Coche, id=id_coche)
@@ -229,17 +327,17 @@ def eliminar_coche(request, id_coche):
     return redirect('AlphaAutos:coche_list')
 
 @login_required
+@solo_lectura
 def buscar_coches(request):
     form = CocheSearchForm(request.GET or None)
     if len(request.GET) > 0 and form.is_valid():
-        qs = Coche.objects.all()
+        qs = Coche.objects.select_related('marca', 'concesionario').all()
         marca = form.cleaned_data.get("marca")
         modelo = form.cleaned_data.get("modelo")
         precio_max = form.cleaned_data.get("precio_max")
-        if marca: qs = qs.filter(marca__nombre__icontains=marca)
-        if modelo: qs = qs.filter(modelo__icontains=modelo)
         if precio_max: qs = qs.filter(precio__lte=precio_max)
-        return render(request, "Crud_Coche/coche_busqueda.html", {"form": form, "coches": qs.all() })
+        coches = paginar_busqueda(request, qs, 'coche', {'marca': marca, 'modelo': modelo}, ORDEN_MARCA)
+        return render(request, "Crud_Coche/coche_busqueda.html", {"form": form, "coches": coches, "pagina": coches}, using=motor_listados())
     return render(request, "Crud_Coche/buscar_coches.html", {"form": form})
 
 # ===================================================================
@@ -279,6 +377,7 @@ def eliminar_concesionario(request, id_concesionario):
     return redirect('AlphaAutos:lista_concesionarios')
 
 @login_required
+@solo_lectura
 def buscar_concesionarios(request):
     form = ConcesionarioSearchForm(request.GET or None)
     if len(request.GET) > 0 and form.is_valid():
@@ -286,10 +385,8 @@ def buscar_concesionarios(request):
         nombre = form.cleaned_data.get("nombre")
         ciudad = form.cleaned_data.get("ciudad")
         telefono = form.cleaned_data.get("telefono")
-        if nombre: qs = qs.filter(nombre__icontains=nombre)
-        if ciudad: qs = qs.filter(ciudad__icontains=ciudad)
-        if telefono: qs = qs.filter(telefono__icontains=telefono)
-        return render(request, "Crud_Concesionario/concesionario_busqueda.html", {"form": form, "concesionarios": qs.all()})
+        concesionarios = paginar_busqueda(request, qs, 'concesionario', {'nombre': nombre, 'ciudad': ciudad, 'telefono': telefono}, ORDEN_NOMBRE)
+        return render(request, "Crud_Concesionario/concesionario_busqueda.html", {"form": form, "concesionarios": concesionarios, "pagina": concesionarios}, using=motor_listados())
     return render(request, "Crud_Concesionario/buscar_concesionarios.html", {"form": form})
 
 # ===================================================================
@@ -329,12 +426,27 @@ def eliminar_marca(request, id_marca):
     return redirect('AlphaAutos:lista_marcas')
 
 @login_required
+@solo_lectura
 def marca_detail(request, id_marca):
-    marca = get_object_or_404(Marca, id=id_marca)
-    coches = marca.coche_set.select_related('concesionario').all()
-    return render(request, 'concesionario/marca_detail.html', {'marca': marca, 'coches': coches})
+    marca, firma = catalogo.obtener(
+        f"marca:{id_marca}", [f"marca:{id_marca}"], lambda: get_object_or_404(Marca, id=id_marca)
+    )
+    coches = marca.coche_set.select_related('marca', 'concesionario')
+    if request.GET.get('formato') == 'stream':
+        return streaming_coches(request, coches.order_by(*ORDEN_MARCA), f'Coches de {marca.nombre}')
+
+    # Una entrada por página (cursor); las filas muestran el nombre del concesionario
+    pagina, firma_coches = catalogo.obtener(
+        f"marca:{id_marca}:coches:{request.GET.urlencode()}", [f"marca:{id_marca}:coches"],
+        lambda: paginar_keyset(request, coches, ORDEN_MARCA),
+        dependencias_de=lambda pagina: {f"concesionario:{c.concesionario_id}" for c in pagina},
+    )
+    pagina.request = request
+    contexto = {'marca': marca, 'coches': pagina, 'pagina': pagina, 'firma_cache': firma + firma_coches}
+    return render(request, 'concesionario/marca_detail.html', contexto)
 
 @login_required
+@solo_lectura
 def buscar_marcas(request):
     form = MarcaSearchForm(request.GET or None)
     if len(request.GET) > 0 and form.is_valid():
@@ -342,10 +454,9 @@ def buscar_marcas(request):
         nombre = form.cleaned_data.get("nombre")
         pais = form.cleaned_data.get("pais_origen")
         anio = form.cleaned_data.get("anio_fundacion")
-        if nombre: qs = qs.filter(nombre__icontains=nombre)
-        if pais: qs = qs.filter(pais_origen__icontains=pais)
         if anio: qs = qs.filter(anio_fundacion=anio)
-        return render(request, "Crud_Marca/marca_busqueda.html", {"form": form, "marcas": qs.all()})
+        marcas = paginar_busqueda(request, qs, 'marca', {'nombre': nombre, 'pais_origen': pais}, ORDEN_NOMBRE)
+        return render(request, "Crud_Marca/marca_busqueda.html", {"form": form, "marcas": marcas, "pagina": marcas}, using=motor_listados())
     return render(request, "Crud_Marca/buscar_marcas.html", {"form": form})
 
 # ===================================================================
@@ -385,22 +496,23 @@ def eliminar_empleado(request, id_empleado):
     return redirect('AlphaAutos:lista_empleados')
 
 @login_required
+@solo_lectura
 def empleado_detail(request, id_empleado):
-    empleado = get_object_or_404(Empleado, id=id_empleado)
+    empleado = get_object_or_404(Empleado.objects.select_related('concesionario'), id=id_empleado)
     return render(request, 'concesionario/empleado_detail.html', {'empleado': empleado})
 
 @login_required
+@solo_lectura
 def buscar_empleados(request):
     form = EmpleadoSearchForm(request.GET or None)
     if len(request.GET) > 0 and form.is_valid():
-        qs = Empleado.objects.all()
+        qs = Empleado.objects.select_related('concesionario').all()
         nombre = form.cleaned_data.get("nombre")
         puesto = form.cleaned_data.get("puesto")
         concesionario = form.cleaned_data.get("concesionario")
-        if nombre: qs = qs.filter(nombre__icontains=nombre)
-        if puesto: qs = qs.filter(puesto__icontains=puesto)
         if concesionario: qs = qs.filter(concesionario=concesionario)
-        return render(request, "Crud_Empleados/empleado_busqueda.html", {"form": form, "empleados": qs.all()})
+        empleados = paginar_busqueda(request, qs, 'empleado', {'nombre': nombre, 'puesto': puesto}, ORDEN_NOMBRE)
+        return render(request, "Crud_Empleados/empleado_busqueda.html", {"form": form, "empleados": empleados, "pagina": empleados}, using=motor_listados())
     return render(request, "Crud_Empleados/buscar_empleados.html", {"form": form})
 
 # ===================================================================
@@ -442,18 +554,22 @@ def eliminar_cliente(request, id_cliente):
     return redirect('AlphaAutos:lista_clientes')
 
 @login_required
+@solo_lectura
 def cliente_detail(request, id_cliente):
-    cliente = get_object_or_404(Comprador, id=id_cliente)
+    cliente = get_object_or_404(Comprador.objects.select_related('usuario'), id=id_cliente)
     return render(request, 'concesionario/cliente_detail.html', {'cliente': cliente})
 
 @login_required
+@solo_lectura
 def buscar_clientes(request):
     form = CompradorSearchForm(request.GET or None)
     if len(request.GET) > 0 and form.is_valid():
         qs = Comprador.objects.select_related('usuario').all()
         usuario = form.cleaned_data.get("usuario")
-        if usuario: qs = qs.filter(usuario__username__icontains=usuario)
-        return render(request, "Crud_Clientes/cliente_busqueda.html", {"form": form, "clientes": qs.all()})
+        telefono = form.cleaned_data.get("telefono")
+        email = form.cleaned_data.get("email")
+        clientes = paginar_busqueda(request, qs, 'comprador', {'usuario': usuario, 'telefono': telefono, 'email': email}, ORDEN_USUARIO)
+        return render(request, "Crud_Clientes/cliente_busqueda.html", {"form": form, "clientes": clientes, "pagina": clientes}, using=motor_listados())
     return render(request, "Crud_Clientes/buscar_clientes.html", {"form": form})
 
 @permission_required('AlphaAutos.change_comprador')
@@ -509,11 +625,17 @@ def eliminar_aseguradora(request, id_aseguradora):
     return redirect('AlphaAutos:lista_aseguradoras')
 
 @login_required
+@solo_lectura
 def aseguradora_detail(request, id_aseguradora):
-    aseguradora = get_object_or_404(Aseguradora, id=id_aseguradora)
-    return render(request, 'concesionario/aseguradora_detail.html', {'aseguradora': aseguradora})
+    aseguradora, firma = catalogo.obtener(
+        f"aseguradora:{id_aseguradora}", [f"aseguradora:{id_aseguradora}", 'seguros'],
+        lambda: get_object_or_404(Aseguradora.objects.prefetch_related('seguros'), id=id_aseguradora),
+    )
+    contexto = {'aseguradora': aseguradora, 'firma_cache': firma}
+    return render(request, 'concesionario/aseguradora_detail.html', contexto)
 
 @login_required
+@solo_lectura
 def buscar_aseguradoras(request):
     form = AseguradoraSearchForm(request.GET or None)
     if len(request.GET) > 0 and form.is_valid():
@@ -521,10 +643,8 @@ def buscar_aseguradoras(request):
         nombre = form.cleaned_data.get("nombre")
         pais = form.cleaned_data.get("pais")
         telefono = form.cleaned_data.get("telefono")
-        if nombre: qs = qs.filter(nombre__icontains=nombre)
-        if pais: qs = qs.filter(pais__icontains=pais)
-        if telefono: qs = qs.filter(telefono__icontains=telefono)
-        return render(request, "Crud_Aseguradora/aseguradora_busqueda.html", {"form": form, "aseguradoras": qs.all()})
+        aseguradoras = paginar_busqueda(request, qs, 'aseguradora', {'nombre': nombre, 'pais': pais, 'telefono': telefono}, ORDEN_NOMBRE)
+        return render(request, "Crud_Aseguradora/aseguradora_busqueda.html", {"form": form, "aseguradoras": aseguradoras, "pagina": aseguradoras}, using=motor_listados())
     return render(request, "Crud_Aseguradora/buscar_aseguradoras.html", {"form": form})
 
 # ===================================================================
@@ -532,21 +652,191 @@ def buscar_aseguradoras(request):
 # ===================================================================
 
 @login_required
+@solo_lectura
 def lista_ventas(request):
-    qs = Venta.objects.select_related('coche', 'comprador').all()
+    qs = Venta.objects.select_related('coche__marca', 'comprador__usuario').all()
     
     # REQUISITO: Búsqueda Filtrada por Usuario
     # Si soy Comprador (Rol 3), solo veo mis compras
     if request.user.is_authenticated and request.user.rol == Usuario.COMPRADOR:
         qs = qs.filter(comprador__usuario=request.user)
         
-    return render(request, 'concesionario/lista_ventas.html', {'ventas': qs.all()})
+    return render(request, 'concesionario/lista_ventas.html', {'ventas': qs.all()}, using=motor_listados())
+
+# -------------------------------------------------------------------
+# VISTA: Operaciones masivas (/masivo/coches/, /masivo/empleados/, /masivo/ventas/)
+# -------------------------------------------------------------------
+# Cada acción: (plan con las filas afectadas, ejecución, permiso necesario).
+# El primer POST enseña el plan; el segundo (con 'confirmar') lo ejecuta.
+OPERACIONES_MASIVAS = {
+    'coches': {
+        'form': CochesMasivoForm,
+        'modelo': Coche,
+        'volver': 'AlphaAutos:coche_list',
+        'acciones': {
+            'ajustar_precio': (masivo.plan_precio_coches, lambda qs, datos: masivo.cambiar_precio_coches(qs, porcentaje=datos['porcentaje']), 'change_coche'),
+            'fijar_precio': (masivo.plan_precio_coches, lambda qs, datos: masivo.cambiar_precio_coches(qs, precio=datos['precio']), 'change_coche'),
+            'cambiar_concesionario': (masivo.plan_concesionario_coches, lambda qs, datos: masivo.cambiar_concesionario_coches(qs, datos['nuevo_concesionario']), 'change_coche'),
+            'eliminar': (masivo.plan_borrado_coches, lambda qs, datos: masivo.borrar_coches(qs), 'delete_coche'),
+        },
+    },
+    'empleados': {
+        'form': EmpleadosMasivoForm,
+        'modelo': Empleado,
+        'volver': 'AlphaAutos:lista_empleados',
+        'acciones': {
+            'cambiar': (masivo.plan_cambio_empleados, lambda qs, datos: masivo.cambiar_empleados(
+                qs, puesto=datos['puesto'], salario=datos['salario'], porcentaje=datos['porcentaje']
+            ), 'change_empleado'),
+            'eliminar': (masivo.plan_borrado_empleados, lambda qs, datos: masivo.borrar_empleados(qs), 'delete_empleado'),
+        },
+    },
+    'ventas': {
+        'form': VentasMasivoForm,
+        'modelo': Venta,
+        'volver': 'AlphaAutos:lista_ventas',
+        'acciones': {
+            'eliminar': (masivo.plan_borrado_ventas, lambda qs, datos: masivo.borrar_ventas(qs), 'delete_venta'),
+        },
+    },
+}
 
 @login_required
+def operacion_masiva(request, tipo):
+    if tipo not in OPERACIONES_MASIVAS:
+        raise Http404
+    operacion = OPERACIONES_MASIVAS[tipo]
+    if request.method == 'POST':
+        form = operacion['form'](request.POST)
+    else:
+        # Los listados mandan aquí los elementos marcados: ?ids=1&ids=2...
+        form = operacion['form'](initial={'ids': ','.join(request.GET.getlist('ids'))})
+
+    plan = None
+    if form.is_bound and form.is_valid():
+        calcular_plan, ejecutar, permiso = operacion['acciones'][form.cleaned_data['accion']]
+        if not request.user.has_perm(f'AlphaAutos.{permiso}'):
+            raise PermissionDenied
+        seleccion = form.seleccion(operacion['modelo'].objects.all())
+        if 'confirmar' in request.POST:
+            resultado = ejecutar(seleccion, form.cleaned_data)
+            if isinstance(resultado, dict):
+                detalle = ', '.join(f"{tabla}: {filas}" for tabla, filas in resultado.items() if filas)
+                messages.success(request, f"Borrado completado ({detalle or 'nada que borrar'}).")
+            else:
+                messages.success(request, f"{resultado} {tipo} actualizados.")
+            return redirect(operacion['volver'])
+        plan = calcular_plan(seleccion)
+
+    contexto = {'form': form, 'plan': plan, 'tipo': tipo, 'volver': operacion['volver']}
+    if plan is not None:
+        contexto['accion'] = dict(form.fields['accion'].choices)[form.cleaned_data['accion']]
+    return render(request, 'concesionario/masivo.html', contexto)
+
+# -------------------------------
+# VISTA: Métricas por vista (AlphaAutos/metricas.py)
+# -------------------------------
+@staff_member_required
+def ver_metricas(request):
+    contexto = {
+        'vistas': metricas.registro.resumen(),
+        'cache': catalogo.estadisticas(),
+        'muestreo': metricas.muestreo(),
+    }
+    return render(request, 'concesionario/metricas.html', contexto)
+
+def metricas_prometheus(request):
+    # Prometheus no tiene sesión: vale el staff o el token de settings
+    token = settings.ALPHAAUTOS_METRICAS_TOKEN
+    cabecera = request.headers.get('Authorization', '')
+    autorizado = request.user.is_staff or (
+        token and hmac.compare_digest(cabecera.encode(), f"Bearer {token}".encode())
+    )
+    if not autorizado:
+        raise PermissionDenied
+    texto = metricas.registro.prometheus() + metricas.prometheus_cache(catalogo.estadisticas())
+    return HttpResponse(texto, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Exportación en streaming: /exportar/ventas/?formato=csv|json&gzip=1
+@login_required
+@solo_lectura
+def exportar(request, tipo):
+    if tipo not in exportacion.EXPORTACIONES:
+        raise Http404
+    permiso = exportacion.EXPORTACIONES[tipo]['permiso']
+    if permiso and not request.user.has_perm(permiso):
+        raise PermissionDenied
+    formato = request.GET.get('formato', 'csv')
+    if formato not in exportacion.FORMATOS:
+        formato = 'csv'
+    return exportacion.respuesta(tipo, formato, request.user, comprimir=request.GET.get('gzip') == '1')
+
+# Opciones de los desplegables remotos: /opciones/coche_venta/?q=seat&despues=<cursor> (AlphaAutos/opciones.py)
+@login_required
+@solo_lectura
+def opciones_api(request, relacion):
+    definicion = opciones.RELACIONES.get(relacion)
+    if definicion is None:
+        raise Http404
+    catalogo.permisos_usuario(request.user)
+    if not definicion.puede(request.user):
+        raise PermissionDenied
+    pagina = paginar_keyset(request, definicion.buscar(request.user, request.GET.get('q', '')), definicion.orden)
+    return JsonResponse({
+        'relacion': relacion,
+        'resultados': [{'id': objeto.pk, 'texto': str(objeto)} for objeto in pagina],
+        'siguiente': pagina.cursor_siguiente,
+    })
+
+# Autocompletado de los buscadores: /autocompletar/modelo/?q=cor&limite=10 (AlphaAutos/autocompletar.py)
+def autocompletar_api(request, tipo):
+    fuente = autocompletar.FUENTES.get(tipo)
+    if fuente is None:
+        raise Http404
+    # Con la sesión basta (está en caché): request.user costaría una consulta por pulsación
+    if SESSION_KEY not in request.session:
+        raise PermissionDenied
+    if fuente.permiso:
+        # Los permisos, de la caché del catálogo (has_perm la reutiliza)
+        catalogo.permisos_usuario(request.user)
+        if not request.user.has_perm(fuente.permiso):
+            raise PermissionDenied
+    try:
+        limite = int(request.GET.get('limite', 10))
+    except ValueError:
+        limite = 10
+    respuesta = JsonResponse({
+        'tipo': tipo,
+        'q': request.GET.get('q', ''),
+        'sugerencias': autocompletar.sugerencias(tipo, request.GET.get('q', ''), limite),
+    })
+    # El navegador repite las mismas teclas (borrar y volver a escribir)
+    patch_cache_control(respuesta, private=True, max_age=30)
+    return respuesta
+
+@login_required
+@solo_lectura
 def venta_detail(request, id_venta):
-    venta = get_object_or_404(Venta, id=id_venta)
+    venta = get_object_or_404(
+        Venta.objects.select_related('coche__marca', 'comprador__usuario'),
+        id=id_venta
+    )
     return render(request, 'concesionario/venta_detail.html', {'venta': venta})
 
+# Reservar es un POST: los navegadores que precargan enlaces y los
+# rastreadores no pueden dejar coches reservados
+@require_POST
+@permission_required('AlphaAutos.add_venta')
+def reservar_coche(request, id_coche):
+    if reservas.reservar(id_coche, request.user):
+        return redirect(f"{reverse('AlphaAutos:crear_venta')}?coche={id_coche}")
+    messages.warning(request, "Ese coche ya está vendido o reservado por otro usuario.")
+    return redirect('AlphaAutos:coche_detail', id_coche=id_coche)
+
+
+# Sin transaction.atomic: reservas.vender() abre la suya (venta y stock juntos)
+# y, en SQLite, antes hace cola en el Lock de escritores, que dentro de otra
+# transacción no se usaría
 @permission_required('AlphaAutos.add_venta')
 def crear_venta(request):
     if request.method == 'POST':
@@ -563,30 +853,45 @@ def crear_venta(request):
             if request.user.rol == Usuario.COMPRADOR:
                 venta.comprador = request.user.comprador
             
-            venta.save()
-            messages.success(request, f"Venta creada correctamente por {venta.precio_final} €.")
-            return redirect('AlphaAutos:lista_ventas')
+            # Reclama el coche y guarda (AlphaAutos/reservas.py): si otro se lo ha llevado, no se vende dos veces
+            if reservas.vender(venta, request.user):
+                messages.success(request, f"Venta creada correctamente por {venta.precio_final} €.")
+                return redirect('AlphaAutos:lista_ventas')
+            form.add_error('coche', 'Este coche acaba de venderse o lo tiene reservado otro usuario.')
     else:
+        # ?coche=<id>: viene de reservar_coche, solo se preselecciona (un GET no reserva)
+        coche_id = request.GET.get('coche')
+        inicial = {'coche': int(coche_id)} if coche_id and coche_id.isdigit() else {}
         #También pasamos el usuario aquí para que se oculte el campo al entrar
-        form = VentaModelForm(request=request.user)
+        form = VentaModelForm(initial=inicial, request=request.user)
     
     return render(request, 'Crud_Venta/crear_venta.html', {'form': form})
 
 
+# Como crear_venta: la transacción la abre reservas.vender() o el save sin reclamar
 @permission_required('AlphaAutos.change_venta')
 def editar_venta(request, id_venta):
     venta = get_object_or_404(Venta, id=id_venta)
     if request.method == 'POST':
-        form = VentaModelForm(request.POST, instance=venta)
+        form = VentaModelForm(request.POST, instance=venta, request=request.user)
         if form.is_valid():
-            form.save()
-            messages.success(request, "Venta editada.")
-            return redirect('AlphaAutos:lista_ventas')
+            venta = form.save(commit=False)
+            # Si pasa a ocupar un coche (otro coche o deja de estar anulada), hay que reclamarlo
+            reclamar = not venta.anulada and {'coche', 'anulada'} & set(form.changed_data)
+            if not reclamar:
+                with transaction.atomic():
+                    venta.save()
+            elif not reservas.vender(venta, request.user):
+                form.add_error('coche', 'Este coche ya tiene una venta o lo tiene reservado otro usuario.')
+            if not form.errors:
+                messages.success(request, "Venta editada.")
+                return redirect('AlphaAutos:lista_ventas')
     else:
-        form = VentaModelForm(instance=venta)
+        form = VentaModelForm(instance=venta, request=request.user)
     return render(request, 'Crud_Venta/editar_venta.html', {'form': form, 'venta': venta})
 
 @permission_required('AlphaAutos.delete_venta')
+@transaction.atomic
 def eliminar_venta(request, id_venta):
     venta = get_object_or_404(Venta, id=id_venta)
     venta.delete()
@@ -595,10 +900,11 @@ def eliminar_venta(request, id_venta):
 
 @login_required
 @login_required
+@solo_lectura
 def buscar_ventas(request):
     # 1. Pasamos 'user=request.user' al formulario
     form = VentaSearchForm(request.GET or None, request=request.user)
-    qs = Venta.objects.select_related('coche', 'comprador').all()
+    qs = Venta.objects.select_related('coche__marca', 'comprador__usuario').all()
 
     # 2. FILTRO DE SEGURIDAD: Si es Comprador, SOLO ve sus ventas (Backend)
     if request.user.rol == Usuario.COMPRADOR:
@@ -612,17 +918,19 @@ def buscar_ventas(request):
         # Solo intentamos filtrar por comprador si el campo existe (es decir, si NO es comprador)
         comprador = form.cleaned_data.get("comprador")
         
-        if coche: 
-            qs = qs.filter(coche__modelo__icontains=coche)
+        # Los textos de coche y comprador se buscan en el índice, dentro de la misma consulta
+        qs = buscador.buscar(qs, 'coche', {'modelo': coche}, campo='coche')
         
+        # El método de pago es un texto corto con pocos valores distintos
         if pago: 
             qs = qs.filter(metodo_pago__icontains=pago)
             
         # Solo aplicamos este filtro si el usuario es Gerente/Admin (porque el Comprador no ve este campo)
         if comprador and request.user.rol != Usuario.COMPRADOR:
-            qs = qs.filter(comprador__usuario__username__icontains=comprador)
+            qs = buscador.buscar(qs, 'comprador', {'usuario': comprador}, campo='comprador')
 
-        return render(request, "Crud_Venta/venta_busqueda.html", {"form": form, "ventas": qs.all()})
+        ventas = paginar_keyset(request, qs, ORDEN_VENTA)
+        return render(request, "Crud_Venta/venta_busqueda.html", {"form": form, "ventas": ventas, "pagina": ventas}, using=motor_listados())
         
     return render(request, "Crud_Venta/buscar_ventas.html", {"form": form})
 
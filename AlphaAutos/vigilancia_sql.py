@@ -0,0 +1,181 @@
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('AlphaAutos.sql')
+
+# -------------------------------------------------------------------
+# Consultas lentas y repetidas (N+1)
+# -------------------------------------------------------------------
+# Un execute_wrapper que se instala en todas las conexiones desde
+# AlphaautosConfig.ready() (apps.py) y que, por cada consulta:
+#
+#   - calcula su huella: el SQL con los literales cambiados por '?' y los
+#     IN (...) colapsados, así 'WHERE id = 3' y 'WHERE id = 7' cuentan
+#     como la misma consulta;
+#   - si tarda más de ALPHAAUTOS_SQL_LENTA_MS, escribe un evento
+#     'consulta_lenta' con la vista, la línea de plantilla y la línea de
+#     código que la han lanzado.
+#
+# VigilanciaSQLMiddleware lleva la cuenta por petición: si una huella se
+# repite más de ALPHAAUTOS_SQL_REPETICIONES veces (la firma de un N+1,
+# como {{ aseguradora.seguros.all }} dentro de un bucle), al terminar la
+# petición escribe un evento 'n_mas_1'.
+#
+# Cada evento es una línea JSON en el logger 'AlphaAutos.sql' (ver
+# LOGGING en settings.py); manage.py resumen_sql los agrega.
+
+_peticion = contextvars.ContextVar('peticion_sql', default=None)
+
+_LITERALES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                       # 'texto'
+    (re.compile(r'(?<![\w."])-?\b\d+(?:\.\d+)?\b'), '?'),        # 12, -3.5
+    (re.compile(r'%s'), '?'),                                   # parámetros
+    (re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.I), 'IN (...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+_DIRECTORIO_APP = os.path.dirname(os.path.abspath(__file__))
+# Los middlewares de medición están en la pila de todas las consultas: no son el origen
+_INSTRUMENTACION = {os.path.join(_DIRECTORIO_APP, nombre) for nombre in ('vigilancia_sql.py', 'metricas.py')}
+
+
+@functools.lru_cache(maxsize=4096)
+def normalizar(sql):
+    for patron, sustituto in _LITERALES:
+        sql = patron.sub(sustituto, sql)
+    return sql.strip()
+
+
+@functools.lru_cache(maxsize=4096)
+def huella(sql):
+    """(identificador corto, SQL normalizado) de la consulta."""
+    normalizado = normalizar(sql)
+    return hashlib.sha1(normalizado.encode()).hexdigest()[:12], normalizado
+
+
+def origen():
+    """(plantilla:línea, fichero:línea del código de la app) que están ejecutando la consulta."""
+    plantilla = codigo = None
+    marco = sys._getframe(1)
+    while marco is not None and (plantilla is None or codigo is None):
+        if plantilla is None and marco.f_code.co_name == 'render_annotated':
+            # Node.render_annotated de django/template/base.py: el nodo que se está pintando
+            nodo = marco.f_locals.get('self')
+            origin = getattr(nodo, 'origin', None)
+            token = getattr(nodo, 'token', None)
+            if origin is not None and token is not None:
+                plantilla = f"{origin.template_name or origin.name}:{token.lineno}"
+        fichero = os.path.abspath(marco.f_code.co_filename)
+        if codigo is None and fichero.startswith(_DIRECTORIO_APP) and fichero not in _INSTRUMENTACION:
+            codigo = f"{os.path.relpath(fichero, os.path.dirname(_DIRECTORIO_APP))}:{marco.f_lineno}"
+        marco = marco.f_back
+    return plantilla, codigo
+
+
+def registrar(evento, **datos):
+    datos = {'evento': evento, 'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'), **datos}
+    logger.warning(json.dumps(datos, ensure_ascii=False, default=str))
+
+
+class _Peticion:
+
+    def __init__(self, request):
+        self.ruta = request.path
+        self.metodo = request.method
+        self.vista = None
+        self.repeticiones = Counter()
+        self.tiempos = Counter()
+        # huella -> (SQL normalizado, plantilla, código) de la primera vez que se vio
+        self.primeras = {}
+
+
+def vigilante(execute, sql, params, many, context):
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracion = (time.perf_counter() - inicio) * 1000
+        peticion = _peticion.get()
+        lenta = duracion >= settings.ALPHAAUTOS_SQL_LENTA_MS
+        if peticion is not None or lenta:
+            identificador, normalizado = huella(sql)
+            sitio = None
+            if peticion is not None:
+                peticion.repeticiones[identificador] += 1
+                peticion.tiempos[identificador] += duracion
+                if identificador not in peticion.primeras:
+                    # Una sola vez por huella y petición: recorrer la pila no es gratis
+                    sitio = origen()
+                    peticion.primeras[identificador] = (normalizado, *sitio)
+            if lenta:
+                plantilla, codigo = sitio or origen()
+                registrar(
+                    'consulta_lenta',
+                    vista=peticion.vista if peticion else None,
+                    ruta=peticion.ruta if peticion else None,
+                    ms=round(duracion, 2), huella=identificador, sql=sql[:2000],
+                    plantilla=plantilla, codigo=codigo,
+                )
+
+
+def _instalar_en(conexion):
+    if vigilante not in conexion.execute_wrappers:
+        conexion.execute_wrappers.append(vigilante)
+
+
+def _al_conectar(sender, connection, **kwargs):
+    _instalar_en(connection)
+
+
+def instalar():
+    """Se llama desde AlphaautosConfig.ready(). Cada hilo tiene sus conexiones: se instala al crearlas."""
+    connection_created.connect(_al_conectar, dispatch_uid='alphaautos_vigilancia_sql')
+    for conexion in connections.all(initialized_only=True):
+        _instalar_en(conexion)
+
+
+class VigilanciaSQLMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        peticion = _Peticion(request)
+        token = _peticion.set(peticion)
+        try:
+            response = self.get_response(request)
+        finally:
+            _peticion.reset(token)
+        self.informar(peticion)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = getattr(request, 'resolver_match', None)
+        _peticion.get().vista = match.view_name if match else None
+
+    def informar(self, peticion):
+        maximo = settings.ALPHAAUTOS_SQL_REPETICIONES
+        for identificador, veces in peticion.repeticiones.items():
+            if veces <= maximo:
+                continue
+            normalizado, plantilla, codigo = peticion.primeras[identificador]
+            registrar(
+                'n_mas_1',
+                vista=peticion.vista, ruta=peticion.ruta, metodo=peticion.metodo,
+                huella=identificador, repeticiones=veces,
+                ms_total=round(peticion.tiempos[identificador], 2),
+                sql=normalizado[:2000], plantilla=plantilla, codigo=codigo,
+            )
@@ -0,0 +1,180 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import aget_object_or_404, render
+
+from .models import *
+from . import cache as catalogo, sesiones
+from .replicas import solo_lectura
+
+# -------------------------------------------------------------------
+# Vistas async (ASGI)
+# -------------------------------------------------------------------
+# Versiones async de index, los detalles y los listados del catálogo,
+# con el ORM async (aget, async for). Se usan al servir con ASGI
+# (mysite/asgi.py -> ROOT_URLCONF 'mysite.urls_asgi'): mientras esperan a
+# la BD no ocupan el bucle. Con WSGI se siguen usando las de views.py,
+# porque Django tendría que abrir un bucle de eventos en cada petición.
+#
+# Los context processors y las plantillas usan el ORM síncrono (perms,
+# request.user), así que el render va en sync_to_async.
+
+
+async def render_async(request, plantilla, contexto=None):
+    # login_required ya cargó el usuario con auser(): sin esto, request.user lo consultaría otra vez
+    request.user = await request.auser()
+    return await sync_to_async(render)(request, plantilla, contexto)
+
+
+async def alista(queryset):
+    return [objeto async for objeto in queryset]
+
+
+async def a_la_vez(*corrutinas):
+    """asyncio.gather que espera a todas antes de propagar el primer error (un 404 no deja cargas sueltas)."""
+    resultados = await asyncio.gather(*corrutinas, return_exceptions=True)
+    for resultado in resultados:
+        if isinstance(resultado, BaseException):
+            raise resultado
+    return resultados
+
+
+# -------------------------------
+# VISTA: Página inicial (Index)
+# -------------------------------
+@solo_lectura
+async def index(request):
+    # Como views.index: los datos de sesión se guardan al hacer login y aquí solo si faltan
+    user = await request.auser()
+    if user.is_authenticated:
+        sesion = request.session
+        faltan = {
+            clave: valor for clave, valor in sesiones.datos_sesion(user).items()
+            if not await sesion.ahas_key(clave)
+        }
+        if faltan:
+            await sesion.aupdate(faltan)
+
+        # VARIABLE SESIÓN 4: Contador de visitas a la Home (en memoria, se vuelca por lotes)
+        sesiones.anotar_visita(await sesion.aget("id_visitas"))
+
+    return await render_async(request, 'concesionario/index.html')
+
+
+# -------------------------------
+# VISTAS: Detalles
+# -------------------------------
+@login_required
+@solo_lectura
+async def coche_detail(request, id_coche):
+    coche, firma = await catalogo.aobtener(
+        f"coche:{id_coche}", [f"coche:{id_coche}"],
+        lambda: aget_object_or_404(Coche.objects.select_related('marca', 'concesionario'), id=id_coche),
+        dependencias_de=lambda c: [f"marca:{c.marca_id}", f"concesionario:{c.concesionario_id}"],
+    )
+    contexto = {'coche': coche, 'firma_cache': firma}
+    return await render_async(request, 'concesionario/coche_detail.html', contexto)
+
+
+@login_required
+@solo_lectura
+async def concesionario_detail(request, id_concesionario):
+    # Las tres cargas solo dependen del id: se piden a la vez
+    (concesionario, firma), (empleados, firma_empleados), (coches, firma_coches) = await a_la_vez(
+        catalogo.aobtener(
+            f"concesionario:{id_concesionario}", [f"concesionario:{id_concesionario}"],
+            lambda: aget_object_or_404(Concesionario, id=id_concesionario),
+        ),
+        catalogo.aobtener(
+            f"concesionario:{id_concesionario}:empleados", [f"concesionario:{id_concesionario}:empleados"],
+            lambda: alista(Empleado.objects.filter(concesionario_id=id_concesionario)),
+        ),
+        # Las filas muestran la marca y el nombre del concesionario
+        catalogo.aobtener(
+            f"concesionario:{id_concesionario}:coches",
+            [f"concesionario:{id_concesionario}:coches", f"concesionario:{id_concesionario}"],
+            lambda: alista(
+                Coche.objects.filter(concesionario_id=id_concesionario).select_related('marca', 'concesionario')
+            ),
+            dependencias_de=lambda coches: {f"marca:{c.marca_id}" for c in coches},
+        ),
+    )
+    contexto = {
+        'concesionario': concesionario, 'empleados': empleados, 'coches': coches,
+        'firma_cache': firma + firma_empleados + firma_coches,
+    }
+    return await render_async(request, 'concesionario/concesionario_detail.html', contexto)
+
+
+@login_required
+@solo_lectura
+async def empleado_detail(request, id_empleado):
+    empleado = await aget_object_or_404(Empleado.objects.select_related('concesionario'), id=id_empleado)
+    return await render_async(request, 'concesionario/empleado_detail.html', {'empleado': empleado})
+
+
+@login_required
+@solo_lectura
+async def aseguradora_detail(request, id_aseguradora):
+    aseguradora, firma = await catalogo.aobtener(
+        f"aseguradora:{id_aseguradora}", [f"aseguradora:{id_aseguradora}", 'seguros'],
+        lambda: aget_object_or_404(Aseguradora.objects.prefetch_related('seguros'), id=id_aseguradora),
+    )
+    contexto = {'aseguradora': aseguradora, 'firma_cache': firma}
+    return await render_async(request, 'concesionario/aseguradora_detail.html', contexto)
+
+
+@login_required
+@solo_lectura
+async def venta_detail(request, id_venta):
+    venta = await aget_object_or_404(
+        Venta.objects.select_related('coche__marca', 'comprador__usuario'),
+        id=id_venta
+    )
+    return await render_async(request, 'concesionario/venta_detail.html', {'venta': venta})
+
+
+# -------------------------------
+# VISTAS: Listados del catálogo
+# -------------------------------
+@login_required
+@solo_lectura
+async def lista_concesionarios(request):
+    concesionarios, firma = await catalogo.aobtener(
+        'lista:concesionario', ['lista:concesionario'], lambda: alista(Concesionario.objects.all())
+    )
+    contexto = {'concesionarios': concesionarios, 'firma_cache': firma}
+    return await render_async(request, 'concesionario/lista_concesionario.html', contexto)
+
+
+@login_required
+@solo_lectura
+async def lista_marcas(request):
+    marcas, firma = await catalogo.aobtener('lista:marca', ['lista:marca'], lambda: alista(Marca.objects.all()))
+    return await render_async(request, 'concesionario/lista_marcas.html', {'marcas': marcas, 'firma_cache': firma})
+
+
+@login_required
+@solo_lectura
+async def lista_aseguradoras(request):
+    aseguradoras, firma = await catalogo.aobtener(
+        'lista:aseguradora', ['lista:aseguradora', 'seguros'],
+        lambda: alista(Aseguradora.objects.prefetch_related('seguros')),
+    )
+    contexto = {'aseguradoras': aseguradoras, 'firma_cache': firma}
+    return await render_async(request, 'concesionario/lista_aseguradoras.html', contexto)
+
+
+# Nombres de ruta (AlphaAutos/urls.py) que tienen versión async: los usa urls_asgi.py
+VISTAS = {
+    'index': index,
+    'coche_detail': coche_detail,
+    'concesionario_detail': concesionario_detail,
+    'empleado_detail': empleado_detail,
+    'aseguradora_detail': aseguradora_detail,
+    'venta_detail': venta_detail,
+    'lista_concesionarios': lista_concesionarios,
+    'lista_marcas': lista_marcas,
+    'lista_aseguradoras': lista_aseguradoras,
+}
@@ -12,5 +12,16 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+# Con ASGI, el código síncrono de cada petición corre en un hilo nuevo: las
+# conexiones persistentes se quedarían abiertas en hilos que ya no existen.
+# En Postgres, para reutilizar conexiones, el pool (ver settings.py).
+os.environ.setdefault('ALPHAAUTOS_CONN_MAX_AGE', '0')
+# Vistas async donde las hay (AlphaAutos/vistas_async.py)
+os.environ.setdefault('ALPHAAUTOS_VISTAS_ASYNC', '1')
 
 application = get_asgi_application()
+
+# Índices de autocompletado en memoria (AlphaAutos/autocompletar.py), sin esperar a la primera consulta
+from AlphaAutos import autocompletar  # noqa: E402
+
+autocompletar.calentar()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,20 +46,32 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # El primero, para que sus tiempos incluyan todo lo demás
+    'AlphaAutos.metricas.MetricasMiddleware',
+    'AlphaAutos.vigilancia_sql.VigilanciaSQLMiddleware',
+    'AlphaAutos.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # ?perfil_plantillas (staff): informe de tiempos por plantilla y etiqueta (AlphaAutos/perfil_plantillas.py)
+    'AlphaAutos.perfil_plantillas.PerfilPlantillasMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'mysite.urls'
+# Con ASGI (mysite/asgi.py lo activa), las vistas de AlphaAutos/vistas_async.py
+# sustituyen a las de views.py donde las hay. Con WSGI, las síncronas.
+ALPHAAUTOS_VISTAS_ASYNC = os.environ.get('ALPHAAUTOS_VISTAS_ASYNC', '0') == '1'
+ROOT_URLCONF = 'mysite.urls_asgi' if ALPHAAUTOS_VISTAS_ASYNC else 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que además mide el tiempo de render (AlphaAutos/metricas.py)
+        'BACKEND': 'AlphaAutos.metricas.PlantillasMedidas',
+        # Sin NAME, el alias sería 'metricas' en lugar del habitual engines['django']
+        'NAME': 'django',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -66,22 +80,126 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'AlphaAutos.cache.contexto_cache',
+                'AlphaAutos.sesiones.contexto_visitas',
             ],
         },
     },
 ]
 
+# Jinja2 para los listados y búsquedas más pesados (AlphaAutos/jinja.py), si está instalado.
+# El motor 'jinja2' está siempre que se pueda (manage.py comparar_plantillas lo usa); las
+# vistas solo lo usan con ALPHAAUTOS_JINJA2=1. El resto de páginas sigue con DjangoTemplates
+try:
+    import jinja2  # noqa: F401
+    HAY_JINJA2 = True
+except ImportError:
+    HAY_JINJA2 = False
+ALPHAAUTOS_JINJA2 = HAY_JINJA2 and os.environ.get('ALPHAAUTOS_JINJA2', '0') == '1'
+# Código compilado de las plantillas Jinja2 ('' = sin caché en disco: se compilan al arrancar)
+ALPHAAUTOS_JINJA2_BYTECODE = os.environ.get(
+    'ALPHAAUTOS_JINJA2_BYTECODE', os.path.join(tempfile.gettempdir(), 'alphaautos-jinja2'),
+)
+if HAY_JINJA2:
+    TEMPLATES.append({
+        'BACKEND': 'AlphaAutos.jinja.PlantillasJinja',
+        'NAME': 'jinja2',
+        'DIRS': [],
+        # Plantillas en AlphaAutos/jinja2/
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'environment': 'AlphaAutos.jinja.entorno',
+            'context_processors': TEMPLATES[0]['OPTIONS']['context_processors'],
+        },
+    })
+
 WSGI_APPLICATION = 'mysite.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# ALPHAAUTOS_BD elige el perfil:
+#   'sqlite'   -> fichero local, con WAL y los PRAGMA de ALPHAAUTOS_SQLITE_PRAGMAS (por defecto)
+#   'postgres' -> PostgreSQL (variables POSTGRES_*), con conexiones persistentes o pool
+# Los PRAGMA se aplican al abrir cada conexión (AlphaAutos/bd.py).
+ALPHAAUTOS_BD = os.environ.get('ALPHAAUTOS_BD', 'sqlite')
+
+# Segundos que se reutiliza una conexión entre peticiones (0 = una por petición)
+CONN_MAX_AGE = int(os.environ.get('ALPHAAUTOS_CONN_MAX_AGE', '60'))
+
+try:
+    # El pool de Django 5.1 necesita psycopg 3 con psycopg_pool; con psycopg2 no hay pool
+    import psycopg_pool  # noqa: F401
+    HAY_POOL_POSTGRES = True
+except ImportError:
+    HAY_POOL_POSTGRES = False
+
+PERFILES_BD = {
+    'sqlite': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('ALPHAAUTOS_SQLITE', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # BEGIN IMMEDIATE: una transacción que va a escribir pide el bloqueo al
+            # empezar y espera (busy_timeout). Con BEGIN a secas, dos que leen y
+            # luego escriben chocan y una falla con 'database is locked' sin esperar.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    },
+    'postgres': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'alphaautos'),
+        'USER': os.environ.get('POSTGRES_USER', 'alphaautos'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # Con pool, Django no admite conexiones persistentes: las reparte el pool
+        'CONN_MAX_AGE': 0 if HAY_POOL_POSTGRES else CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': 5,
+            **({'pool': {
+                'min_size': int(os.environ.get('ALPHAAUTOS_POOL_MIN', '2')),
+                'max_size': int(os.environ.get('ALPHAAUTOS_POOL_MAX', '10')),
+                'timeout': 10,
+            }} if HAY_POOL_POSTGRES else {}),
+        },
+    },
+}
+
+DATABASES = {
+    'default': PERFILES_BD[ALPHAAUTOS_BD],
+}
+
+# Réplica de lectura (AlphaAutos/replicas.py). ALPHAAUTOS_REPLICA es el fichero
+# (sqlite) o el host (postgres) de la réplica; sin ella, todo va al primario.
+# En las pruebas, la réplica es un espejo de la BD de pruebas del primario.
+ALPHAAUTOS_REPLICA = os.environ.get('ALPHAAUTOS_REPLICA', '')
+if ALPHAAUTOS_REPLICA:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        ('NAME' if ALPHAAUTOS_BD == 'sqlite' else 'HOST'): ALPHAAUTOS_REPLICA,
+        'TEST': {'MIRROR': 'default'},
     }
+ALPHAAUTOS_REPLICA_ALIAS = 'replica' if ALPHAAUTOS_REPLICA else None
+# Segundos que un navegador lee del primario después de escribir
+ALPHAAUTOS_REPLICA_FIJAR_S = int(os.environ.get('ALPHAAUTOS_REPLICA_FIJAR_S', '5'))
+
+DATABASE_ROUTERS = ['AlphaAutos.replicas.RouterReplicas']
+
+# PRAGMA de cada conexión SQLite (en orden). journal_mode=WAL deja leer mientras
+# otro escribe; con WAL, synchronous=NORMAL sigue siendo seguro ante caídas del
+# proceso y ahorra un fsync por transacción. cache_size negativo = KiB.
+ALPHAAUTOS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
 }
 
 
@@ -133,6 +251,13 @@ import os
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 'imagenes': Coche.imagen se guarda una sola vez por contenido (AlphaAutos/almacen.py)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'imagenes': {'BACKEND': 'AlphaAutos.almacen.AlmacenContenido'},
+}
+
 # Custom user model
 AUTH_USER_MODEL = 'AlphaAutos.Usuario'
 
@@ -141,4 +266,94 @@ LOGIN_REDIRECT_URL = 'AlphaAutos:index'
 LOGOUT_REDIRECT_URL = 'AlphaAutos:index'
 
 # Esto imprime los correos en la terminal en lugar de enviarlos
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# Caché del catálogo (AlphaAutos/cache.py). ALPHAAUTOS_CACHE elige el backend:
+#   'lru'    -> en memoria del proceso, acotado por entradas y bytes (por defecto)
+#   'locmem' -> LocMemCache de Django
+#   'file'   -> en disco, compartida entre procesos
+ALPHAAUTOS_CACHE = os.environ.get('ALPHAAUTOS_CACHE', 'lru')
+
+CACHES_CATALOGO = {
+    'lru': {
+        'BACKEND': 'AlphaAutos.cache.LRUCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000, 'MAX_BYTES': 64 * 1024 * 1024},
+    },
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'alphaautos-catalogo',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'catalogo'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogo': {**CACHES_CATALOGO[ALPHAAUTOS_CACHE], 'TIMEOUT': 3600},
+}
+
+# Sesiones (AlphaAutos/sesiones.py). ALPHAAUTOS_SESIONES elige dónde se guardan:
+#   'cached_db' -> caché 'default' con copia en la BD; solo se escribe al cambiar (por defecto)
+#   'cookie'    -> cookie firmada, sin BD ni caché (hasta ~4 KB; no se puede cerrar una sesión desde el servidor)
+#   'db'        -> solo BD (lo de Django por defecto)
+ALPHAAUTOS_SESIONES = os.environ.get('ALPHAAUTOS_SESIONES', 'cached_db')
+SESSION_ENGINE = {
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cookie': 'django.contrib.sessions.backends.signed_cookies',
+    'db': 'django.contrib.sessions.backends.db',
+}[ALPHAAUTOS_SESIONES]
+# Las visitas a la home se cuentan en memoria y se vuelcan a esta caché cada N segundos
+ALPHAAUTOS_VISITAS_CACHE = 'default'
+ALPHAAUTOS_VISITAS_VOLCADO_S = float(os.environ.get('ALPHAAUTOS_VISITAS_VOLCADO_S', '30'))
+
+# Perfil del render de plantillas por etiqueta y variable (AlphaAutos/perfil_plantillas.py).
+# Instalado, cuesta un ContextVar.get() por nodo aunque no se perfile: por defecto solo en DEBUG
+ALPHAAUTOS_PERFIL_PLANTILLAS = os.environ.get('ALPHAAUTOS_PERFIL_PLANTILLAS', '1' if DEBUG else '0') == '1'
+
+# Segundos que un coche queda reservado al abrir crear_venta?coche=<id> (AlphaAutos/reservas.py)
+ALPHAAUTOS_RESERVA_S = int(os.environ.get('ALPHAAUTOS_RESERVA_S', '600'))
+
+# Segundos tras los que cada proceso recarga de la BD los índices de autocompletado
+# (AlphaAutos/autocompletar.py). Sus propios cambios los ve al momento, por las señales
+ALPHAAUTOS_AUTOCOMPLETAR_S = float(os.environ.get('ALPHAAUTOS_AUTOCOMPLETAR_S', '300'))
+
+# Hilos que generan las rendiciones de las imágenes de coches (AlphaAutos/imagenes.py)
+ALPHAAUTOS_IMAGENES_HILOS = int(os.environ.get('ALPHAAUTOS_IMAGENES_HILOS', '2'))
+
+# Métricas por vista (AlphaAutos/metricas.py): fracción de peticiones que se
+# mide (0 = ninguna, 1 = todas) y token para que Prometheus lea
+# /metricas/prometheus/ sin sesión (cabecera 'Authorization: Bearer <token>')
+ALPHAAUTOS_METRICAS_MUESTREO = float(os.environ.get('ALPHAAUTOS_METRICAS_MUESTREO', '0.1'))
+ALPHAAUTOS_METRICAS_TOKEN = os.environ.get('ALPHAAUTOS_METRICAS_TOKEN', '')
+
+# Consultas lentas y N+1 (AlphaAutos/vigilancia_sql.py): umbral de consulta
+# lenta en ms y cuántas veces puede repetirse la misma consulta en una
+# petición antes de avisar. Los eventos son líneas JSON del logger
+# 'AlphaAutos.sql', que van a ALPHAAUTOS_SQL_LOG si se define y si no a stderr.
+ALPHAAUTOS_SQL_LENTA_MS = float(os.environ.get('ALPHAAUTOS_SQL_LENTA_MS', '100'))
+ALPHAAUTOS_SQL_REPETICIONES = int(os.environ.get('ALPHAAUTOS_SQL_REPETICIONES', '5'))
+ALPHAAUTOS_SQL_LOG = os.environ.get('ALPHAAUTOS_SQL_LOG', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        # El mensaje ya es la línea JSON
+        'json_lines': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'sql': {
+            'class': 'logging.handlers.WatchedFileHandler' if ALPHAAUTOS_SQL_LOG else 'logging.StreamHandler',
+            **({'filename': ALPHAAUTOS_SQL_LOG} if ALPHAAUTOS_SQL_LOG else {}),
+            'formatter': 'json_lines',
+        },
+    },
+    'loggers': {
+        'AlphaAutos.sql': {'handlers': ['sql'], 'level': 'WARNING', 'propagate': False},
+    },
+}
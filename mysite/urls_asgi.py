@@ -0,0 +1,17 @@
+"""
+URLconf al servir con ASGI (ver mysite/asgi.py y ALPHAAUTOS_VISTAS_ASYNC
+en settings.py): la de mysite/urls.py con AlphaAutos.urls_asgi, que usa
+las vistas async donde las hay.
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('', include('AlphaAutos.urls_asgi')),
+    path('accounts/', include('django.contrib.auth.urls')),
+]
+handler404 = 'AlphaAutos.views.mi_error_404'
+handler400 = 'AlphaAutos.views.mi_error_400'
+handler500 = 'AlphaAutos.views.mi_error_500'
+handler403 = 'AlphaAutos.views.mi_error_403'
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+# Índices de autocompletado en memoria (AlphaAutos/autocompletar.py), sin esperar a la primera consulta
+from AlphaAutos import autocompletar  # noqa: E402
+
+autocompletar.calentar()